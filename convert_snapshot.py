@@ -0,0 +1,47 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+# >.>.>.>.>.>.>.>.>.>.>.>.>.>.>.>.
+# Licensed under the Apache License, Version 2.0 (the "License")
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# --- File Name: convert_snapshot.py
+# .<.<.<.<.<.<.<.<.<.<.<.<.<.<.<.<
+"""
+Convert network pickles into split snapshots (graph specs + memory-mapped weights).
+The result loads anywhere misc.load_pkl() is used.
+"""
+
+import argparse
+import glob
+import os
+
+import dnnlib.tflib as tflib
+
+
+def convert(network_pkl, out_file):
+    networks = tflib.snapshot.convert_pkl(network_pkl, out_file)
+    names = [net.name for net in networks] if isinstance(networks, (tuple, list)) else [networks.name]
+    print('%s -> %s (%s, %.1f MB)' % (network_pkl, out_file, ', '.join(names), os.path.getsize(out_file) / 2**20))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert network pickles into split snapshots.')
+    parser.add_argument('network_pkls',
+                        help='Network pickles to convert (globs allowed).',
+                        nargs='+')
+    parser.add_argument('--out_ext',
+                        help='Extension of converted files, replacing .pkl.',
+                        type=str,
+                        default='.snap')
+    args = parser.parse_args()
+
+    tflib.init_tf()
+    for pattern in args.network_pkls:
+        for network_pkl in sorted(glob.glob(pattern)):
+            convert(network_pkl, os.path.splitext(network_pkl)[0] + args.out_ext)
+
+
+if __name__ == "__main__":
+    main()
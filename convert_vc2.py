@@ -39,10 +39,11 @@ def convert_pkl(network_pkl, new_func_name_G, new_func_name_D, new_func_name_I):
     print('Loading networks from "%s"...' % network_pkl)
     # _G, _D, Gs = pretrained_networks.load_networks(network_pkl)
     _G, _D, _I, _Gs = misc.load_pkl(network_pkl)
-    Gs = _Gs.convert(new_func_name=new_func_name_G, synthesis_func='G_synthesis_modular_ps_sc')
-    G = _G.convert(new_func_name=new_func_name_G, synthesis_func='G_synthesis_modular_ps_sc')
-    D = _D.convert(new_func_name=new_func_name_D)
-    I = _I.convert(new_func_name=new_func_name_I)
+    with tflib.batch_set_vars():
+        Gs = _Gs.convert(new_func_name=new_func_name_G, synthesis_func='G_synthesis_modular_ps_sc')
+        G = _G.convert(new_func_name=new_func_name_G, synthesis_func='G_synthesis_modular_ps_sc')
+        D = _D.convert(new_func_name=new_func_name_D)
+        I = _I.convert(new_func_name=new_func_name_I)
 
     misc.save_pkl((G, D, I, Gs),
                   dnnlib.make_run_dir_path('network-saved.pkl'))
@@ -10,8 +10,14 @@ import os
 import sys
 import glob
 import h5py
+import hashlib
+import time
 import argparse
+import inspect
 import threading
+import zipfile
+import collections
+import multiprocessing
 import six.moves.queue as Queue  # pylint: disable=import-error
 import traceback
 import numpy as np
@@ -32,12 +38,97 @@ def error(msg):
 #----------------------------------------------------------------------------
 
 
+def encode_tfrecord(quant):
+    ex = tf.train.Example(features=tf.train.Features(
+        feature={
+            'shape':
+            tf.train.Feature(int64_list=tf.train.Int64List(
+                value=quant.shape)),
+            'data':
+            tf.train.Feature(bytes_list=tf.train.BytesList(
+                value=[quant.tostring()]))
+        }))
+    return ex.SerializeToString()
+
+
+def encode_raw(quant):
+    return quant.tobytes()
+
+
+def build_pyramid_reference(img, num_lods):
+    # Per-image 2x2 box-filter mip pyramid of a single [C, H, W] image.
+    pyramid = []
+    for lod in range(num_lods):
+        if lod:
+            img = img.astype(np.float32)
+            img = (img[:, 0::2, 0::2] + img[:, 0::2, 1::2] +
+                   img[:, 1::2, 0::2] + img[:, 1::2, 1::2]) * 0.25
+        pyramid.append(np.rint(img).clip(0, 255).astype(np.uint8))
+    return pyramid
+
+
+def build_pyramid(images, num_lods, buffers=None):
+    # Vectorized mip pyramid of a whole [N, C, H, W] batch, bit-identical to
+    # calling build_pyramid_reference() on each image. The additions happen
+    # in the same order and precision, one level at a time. Returns one
+    # uint8 [N, C, H, W] array per LOD. These alias the arrays cached in
+    # `buffers` and are overwritten by the next call that uses them.
+    if buffers is None:
+        buffers = dict()
+    n, c, h, w = images.shape
+    if buffers.get('shape') != (images.shape, num_lods):
+        buffers.clear()
+        buffers['shape'] = (images.shape, num_lods)
+        for name, dtype in [('float', np.float32), ('scratch', np.float32),
+                            ('quant', np.uint8)]:
+            buffers[name] = [
+                np.empty([n, c, h >> lod, w >> lod], dtype)
+                for lod in range(num_lods)
+            ]
+    flt, scratch, quant = buffers['float'], buffers['scratch'], buffers[
+        'quant']
+
+    if images.dtype == np.uint8:
+        pyramid = [images]
+    else:
+        pyramid = [np.rint(images).clip(0, 255).astype(np.uint8)]
+    if num_lods > 1:
+        np.copyto(flt[0], images, casting='unsafe')
+    for lod in range(1, num_lods):
+        src = flt[lod - 1].reshape(n, c, h >> lod, 2, w >> lod, 2)
+        dst = flt[lod]
+        np.add(src[:, :, :, 0, :, 0], src[:, :, :, 0, :, 1], out=dst)
+        np.add(dst, src[:, :, :, 1, :, 0], out=dst)
+        np.add(dst, src[:, :, :, 1, :, 1], out=dst)
+        np.multiply(dst, np.float32(0.25), out=dst)
+        np.rint(dst, out=scratch[lod])
+        np.clip(scratch[lod], 0, 255, out=scratch[lod])
+        quant[lod][...] = scratch[lod]
+        pyramid.append(quant[lod])
+    return pyramid
+
+
+def encode_images(images, num_lods, encode_func, buffers=None):
+    # Build the mip pyramid of each image and encode every level.
+    # Top-level so that it can run in TFRecordExporter's worker processes.
+    pyramid = build_pyramid(np.asarray(images), num_lods, buffers)
+    return [[encode_func(quant[idx]) for quant in pyramid]
+            for idx in range(pyramid[0].shape[0])]
+
+
+#----------------------------------------------------------------------------
+
+
 class TFRecordExporter:
+    encode_func = staticmethod(encode_tfrecord)
+
     def __init__(self,
                  tfrecord_dir,
                  expected_images,
                  print_progress=True,
-                 progress_interval=10):
+                 progress_interval=10,
+                 num_workers=0,
+                 chunk_size=16):
         self.tfrecord_dir = tfrecord_dir
         self.tfr_prefix = os.path.join(self.tfrecord_dir,
                                        os.path.basename(self.tfrecord_dir))
@@ -46,8 +137,19 @@ class TFRecordExporter:
         self.shape = None
         self.resolution_log2 = None
         self.tfr_writers = []
+        self.tfr_files = []
+        self.record_sizes = []
+        self.record_hashes = []
+        self.label_file = None
         self.print_progress = print_progress
         self.progress_interval = progress_interval
+        self.num_workers = num_workers  # 0 = encode on the calling thread.
+        self.chunk_size = chunk_size  # Images per worker task.
+        self.pool = None
+        self.pending = collections.deque()  # Worker results, in write order.
+        self.chunk = []
+        self.start_time = None
+        self.pyramid_buffers = dict()  # Reused by add_images().
 
         if self.print_progress:
             print('Creating dataset "%s"' % tfrecord_dir)
@@ -58,12 +160,22 @@ class TFRecordExporter:
     def close(self):
         if self.print_progress:
             print('%-40s\r' % 'Flushing data...', end='', flush=True)
+        if self.pool is not None:
+            self.submit_chunk()
+            while self.pending:
+                self.write_images(self.pending.popleft().get())
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
         for tfr_writer in self.tfr_writers:
             tfr_writer.close()
         self.tfr_writers = []
+        if self.shape is not None:
+            self.write_index()
         if self.print_progress:
             print('%-40s\r' % '', end='', flush=True)
-            print('Added %d images.' % self.cur_images)
+            print('Added %d images (%.1f img/s).' %
+                  (self.cur_images, self.images_per_sec()))
 
     def choose_shuffled_order(
             self):  # Note: Images and labels must be added in shuffled order.
@@ -71,48 +183,117 @@ class TFRecordExporter:
         np.random.RandomState(123).shuffle(order)
         return order
 
-    def add_image(self, img):
-        if self.print_progress and self.cur_images % self.progress_interval == 0:
-            print('%d / %d\r' % (self.cur_images, self.expected_images),
+    def images_per_sec(self):
+        if self.start_time is None:
+            return 0.0
+        return self.cur_images / max(time.time() - self.start_time, 1e-8)
+
+    def report_progress(self, num_new):
+        interval = self.progress_interval
+        if self.print_progress and (self.cur_images // interval !=
+                                    (self.cur_images + num_new - 1) // interval
+                                    or self.cur_images % interval == 0):
+            print('%d / %d (%.1f img/s)\r' %
+                  (self.cur_images, self.expected_images,
+                   self.images_per_sec()),
                   end='',
                   flush=True)
+
+    def init_shape(self, shape):
         if self.shape is None:
-            self.shape = img.shape
+            self.shape = shape
             self.resolution_log2 = int(np.log2(self.shape[1]))
             assert self.shape[0] in [1, 3]
             assert self.shape[1] == self.shape[2]
             assert self.shape[1] == 2**self.resolution_log2
-            tfr_opt = tf.python_io.TFRecordOptions(
-                tf.python_io.TFRecordCompressionType.NONE)
-            for lod in range(self.resolution_log2 - 1):
-                tfr_file = self.tfr_prefix + '-r%02d.tfrecords' % (
-                    self.resolution_log2 - lod)
-                self.tfr_writers.append(
-                    tf.python_io.TFRecordWriter(tfr_file, tfr_opt))
-        assert img.shape == self.shape
-        for lod, tfr_writer in enumerate(self.tfr_writers):
-            if lod:
-                img = img.astype(np.float32)
-                img = (img[:, 0::2, 0::2] + img[:, 0::2, 1::2] +
-                       img[:, 1::2, 0::2] + img[:, 1::2, 1::2]) * 0.25
-            quant = np.rint(img).clip(0, 255).astype(np.uint8)
-            ex = tf.train.Example(features=tf.train.Features(
-                feature={
-                    'shape':
-                    tf.train.Feature(int64_list=tf.train.Int64List(
-                        value=quant.shape)),
-                    'data':
-                    tf.train.Feature(bytes_list=tf.train.BytesList(
-                        value=[quant.tostring()]))
-                }))
-            tfr_writer.write(ex.SerializeToString())
+            self.open_writers()
+            if self.num_workers > 0:
+                self.pool = multiprocessing.Pool(self.num_workers)
+            self.start_time = time.time()
+        assert shape == self.shape
+
+    def add_image(self, img):
+        self.report_progress(1)
+        self.init_shape(img.shape)
+        if self.pool is None:
+            self.write_images(
+                encode_images([img], self.resolution_log2 - 1,
+                              self.encode_func))
+        else:
+            self.chunk.append(img)
+            if len(self.chunk) >= self.chunk_size:
+                self.submit_chunk()
         self.cur_images += 1
 
+    def add_images(self, images):
+        # Same as calling add_image() for each [C, H, W] image of the batch,
+        # but builds all LODs of the whole batch at once.
+        if len(images) == 0:
+            return
+        self.report_progress(len(images))
+        self.init_shape(images[0].shape)
+        if self.pool is None:
+            self.write_images(
+                encode_images(images, self.resolution_log2 - 1,
+                              self.encode_func, self.pyramid_buffers))
+        else:
+            for img in images:
+                self.chunk.append(img)
+                if len(self.chunk) >= self.chunk_size:
+                    self.submit_chunk()
+        self.cur_images += len(images)
+
+    def submit_chunk(self):
+        if self.chunk:
+            self.pending.append(
+                self.pool.apply_async(
+                    encode_images,
+                    (self.chunk, self.resolution_log2 - 1, self.encode_func)))
+            self.chunk = []
+        while len(self.pending) > self.num_workers * 4:
+            self.write_images(self.pending.popleft().get())
+
+    def write_images(self, records):
+        for lod_records in records:
+            for lod, record in enumerate(lod_records):
+                self.write_record(lod, record)
+
+    def open_writers(self):
+        tfr_opt = tf.python_io.TFRecordOptions(
+            tf.python_io.TFRecordCompressionType.NONE)
+        for lod in range(self.resolution_log2 - 1):
+            tfr_file = self.tfr_prefix + '-r%02d.tfrecords' % (
+                self.resolution_log2 - lod)
+            self.tfr_files.append(tfr_file)
+            self.record_sizes.append([])
+            self.record_hashes.append(hashlib.sha1())
+            self.tfr_writers.append(
+                tf.python_io.TFRecordWriter(tfr_file, tfr_opt))
+
+    def write_record(self, lod, record):
+        self.tfr_writers[lod].write(record)
+        self.record_sizes[lod].append(
+            len(record) + dataset.TFRECORD_FRAMING_BYTES)
+        self.record_hashes[lod].update(record)
+
+    def write_index(self):
+        file_entries = [
+            dataset.make_manifest_file_entry(tfr_file, [
+                self.shape[0], self.shape[1] >> lod, self.shape[2] >> lod
+            ], self.record_sizes[lod], self.record_hashes[lod].hexdigest())
+            for lod, tfr_file in enumerate(self.tfr_files)
+        ]
+        label_entry = dataset.make_manifest_label_entry(
+            self.label_file) if self.label_file is not None else None
+        dataset.save_index(self.tfr_prefix + dataset.MANIFEST_SUFFIX,
+                           dataset.make_manifest(file_entries, label_entry))
+
     def add_labels(self, labels):
         if self.print_progress:
             print('%-40s\r' % 'Saving labels...', end='', flush=True)
         assert labels.shape[0] == self.cur_images
-        with open(self.tfr_prefix + '-rxx.labels', 'wb') as f:
+        self.label_file = self.tfr_prefix + '-rxx.labels'
+        with open(self.label_file, 'wb') as f:
             np.save(f, labels.astype(np.float32))
 
     def __enter__(self):
@@ -122,6 +303,51 @@ class TFRecordExporter:
         self.close()
 
 
+#----------------------------------------------------------------------------
+# Exporter for the memory-mappable format read by dataset.MmapDataset.
+# Each LOD is stored as one contiguous raw uint8 file of [N, C, H, W]
+# records, described by a small JSON index next to the labels file.
+
+
+class MmapExporter(TFRecordExporter):
+    encode_func = staticmethod(encode_raw)
+
+    def open_writers(self):
+        for lod in range(self.resolution_log2 - 1):
+            raw_file = self.tfr_prefix + '-r%02d.raw' % (
+                self.resolution_log2 - lod)
+            self.tfr_files.append(raw_file)
+            self.tfr_writers.append(open(raw_file, 'wb'))
+
+    def write_record(self, lod, record):
+        self.tfr_writers[lod].write(record)
+
+    def write_index(self):
+        index = dict(format=dataset.MMAP_FORMAT,
+                     num_images=self.cur_images,
+                     dtype='uint8',
+                     lods=[])
+        for lod, raw_file in enumerate(self.tfr_files):
+            res = self.shape[1] >> lod
+            index['lods'].append(
+                dict(lod=lod,
+                     file=os.path.basename(raw_file),
+                     shape=[self.shape[0], res, res]))
+        dataset.save_index(self.tfr_prefix + dataset.MMAP_INDEX_SUFFIX, index)
+
+
+EXPORT_BATCH_SIZE = 256  # Images per add_images() call in create_* commands.
+EXPORT_FORMATS = dict(tfrecords=TFRecordExporter, mmap=MmapExporter)
+export_num_workers = 0  # Overridden by the --num_workers command line option.
+
+
+def create_exporter(tfrecord_dir, expected_images, export_format='tfrecords',
+                    **kwargs):
+    kwargs.setdefault('num_workers', export_num_workers)
+    return EXPORT_FORMATS[export_format](tfrecord_dir, expected_images,
+                                         **kwargs)
+
+
 #----------------------------------------------------------------------------
 
 
@@ -231,10 +457,10 @@ class ThreadPool(object):
 def display(tfrecord_dir):
     print('Loading dataset "%s"' % tfrecord_dir)
     tflib.init_tf({'gpu_options.allow_growth': True})
-    dset = dataset.TFRecordDataset(tfrecord_dir,
-                                   max_label_size='full',
-                                   repeat=False,
-                                   shuffle_mb=0)
+    dset = dataset.load_dataset(tfrecord_dir=tfrecord_dir,
+                                max_label_size='full',
+                                repeat=False,
+                                shuffle_mb=0)
     tflib.init_uninitialized_vars()
     import cv2  # pip install opencv-python
 
@@ -260,90 +486,251 @@ def display(tfrecord_dir):
 #----------------------------------------------------------------------------
 
 
-def extract(tfrecord_dir, output_dir):
+VERIFY_BATCH_SIZE = 256  # Images per minibatch in extract and compare.
+
+
+def get_verify_num_workers():
+    # extract and compare always use a pool; --num_workers=0 = one per CPU.
+    return export_num_workers if export_num_workers > 0 else multiprocessing.cpu_count()
+
+
+def iterate_minibatches_np(dset, minibatch_size):
+    while True:
+        try:
+            yield dset.get_minibatch_np(minibatch_size)
+        except tf.errors.OutOfRangeError:
+            return
+
+
+def imap_ordered(pool, func, args_iter, max_pending):
+    # Like pool.imap(), but stops reading args_iter while max_pending tasks
+    # are in flight, so that memory stays bounded for large datasets.
+    pending = collections.deque()
+    for args in args_iter:
+        pending.append(pool.apply_async(func, args))
+        while len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def save_png_images(images, first_idx, output_dir):
+    # Top-level so that it can run in extract's worker processes.
+    for i, img in enumerate(images):
+        if img.shape[0] == 1:
+            img = PIL.Image.fromarray(img[0], 'L')
+        else:
+            img = PIL.Image.fromarray(img.transpose(1, 2, 0), 'RGB')
+        img.save(os.path.join(output_dir, 'img%08d.png' % (first_idx + i)))
+    return len(images)
+
+
+def digest_array(arr):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.int64(arr.shape).tobytes())
+    h.update(arr.dtype.str.encode('ascii'))
+    h.update(np.ascontiguousarray(arr).tobytes())
+    return h.digest()
+
+
+def digest_minibatch(which, images, labels):
+    # Top-level so that it can run in compare's worker processes.
+    image_digests = [digest_array(img) for img in images]
+    label_digests = [digest_array(label) for label in labels]
+    return which, image_digests, label_digests
+
+
+def report_mismatches(what, digests_a, digests_b, max_listed=100):
+    num = min(len(digests_a), len(digests_b))
+    digests_a = np.frombuffer(b''.join(digests_a[:num]), np.uint8).reshape(num, -1)
+    digests_b = np.frombuffer(b''.join(digests_b[:num]), np.uint8).reshape(num, -1)
+    mismatches = np.flatnonzero(np.any(digests_a != digests_b, axis=1))
+    if mismatches.size:
+        listed = ', '.join(str(idx) for idx in mismatches[:max_listed])
+        if mismatches.size > max_listed:
+            listed += ', ... (%d more)' % (mismatches.size - max_listed)
+        print('%s differ at %d indices: %s' % (what, mismatches.size, listed))
+    print('Identical %s: %d / %d' % (what.lower(), num - mismatches.size, num))
+
+
+def extract(tfrecord_dir, output_dir, minibatch_size=VERIFY_BATCH_SIZE):
+    num_workers = get_verify_num_workers()
+    pool = multiprocessing.Pool(num_workers)  # Before TF creates its threads.
     print('Loading dataset "%s"' % tfrecord_dir)
     tflib.init_tf({'gpu_options.allow_growth': True})
-    dset = dataset.TFRecordDataset(tfrecord_dir,
-                                   max_label_size=0,
-                                   repeat=False,
-                                   shuffle_mb=0)
+    dset = dataset.load_dataset(tfrecord_dir=tfrecord_dir,
+                                max_label_size=0,
+                                repeat=False,
+                                shuffle_mb=0)
     tflib.init_uninitialized_vars()
 
-    print('Extracting images to "%s"' % output_dir)
+    print('Extracting images to "%s" with %d workers' %
+          (output_dir, num_workers))
     if not os.path.isdir(output_dir):
         os.makedirs(output_dir)
+
+    def iterate_tasks():
+        idx = 0
+        for images, _labels in iterate_minibatches_np(dset, minibatch_size):
+            yield images, idx, output_dir
+            idx += len(images)
+
     idx = 0
-    while True:
-        if idx % 10 == 0:
-            print('%d\r' % idx, end='', flush=True)
-        try:
-            images, _labels = dset.get_minibatch_np(1)
-        except tf.errors.OutOfRangeError:
-            break
-        if images.shape[1] == 1:
-            img = PIL.Image.fromarray(images[0][0], 'L')
-        else:
-            img = PIL.Image.fromarray(images[0].transpose(1, 2, 0), 'RGB')
-        img.save(os.path.join(output_dir, 'img%08d.png' % idx))
-        idx += 1
-    print('Extracted %d images.' % idx)
+    start_time = time.time()
+    for num_saved in imap_ordered(pool, save_png_images, iterate_tasks(),
+                                  num_workers * 2):
+        idx += num_saved
+        print('%d\r' % idx, end='', flush=True)
+    pool.close()
+    pool.join()
+    print('Extracted %d images (%.1f img/s).' %
+          (idx, idx / max(time.time() - start_time, 1e-8)))
 
 
 #----------------------------------------------------------------------------
 
 
-def compare(tfrecord_dir_a, tfrecord_dir_b, ignore_labels):
+def compare(tfrecord_dir_a,
+            tfrecord_dir_b,
+            ignore_labels,
+            minibatch_size=VERIFY_BATCH_SIZE,
+            verify_manifest=0):
+    num_workers = get_verify_num_workers()
+    pool = multiprocessing.Pool(num_workers)  # Before TF creates its threads.
     max_label_size = 0 if ignore_labels else 'full'
-    print('Loading dataset "%s"' % tfrecord_dir_a)
     tflib.init_tf({'gpu_options.allow_growth': True})
-    dset_a = dataset.TFRecordDataset(tfrecord_dir_a,
-                                     max_label_size=max_label_size,
-                                     repeat=False,
-                                     shuffle_mb=0)
+    if verify_manifest:
+        for tfrecord_dir in [tfrecord_dir_a, tfrecord_dir_b]:
+            if glob.glob(os.path.join(tfrecord_dir, '*.tfrecords')):
+                dataset.load_tfrecord_manifest(tfrecord_dir,
+                                               verbose=True,
+                                               verify=True)
+    print('Loading dataset "%s"' % tfrecord_dir_a)
+    dset_a = dataset.load_dataset(tfrecord_dir=tfrecord_dir_a,
+                                  max_label_size=max_label_size,
+                                  repeat=False,
+                                  shuffle_mb=0)
     print('Loading dataset "%s"' % tfrecord_dir_b)
-    dset_b = dataset.TFRecordDataset(tfrecord_dir_b,
-                                     max_label_size=max_label_size,
-                                     repeat=False,
-                                     shuffle_mb=0)
+    dset_b = dataset.load_dataset(tfrecord_dir=tfrecord_dir_b,
+                                  max_label_size=max_label_size,
+                                  repeat=False,
+                                  shuffle_mb=0)
     tflib.init_uninitialized_vars()
 
-    print('Comparing datasets')
-    idx = 0
-    identical_images = 0
-    identical_labels = 0
-    while True:
-        if idx % 100 == 0:
-            print('%d\r' % idx, end='', flush=True)
-        try:
-            images_a, labels_a = dset_a.get_minibatch_np(1)
-        except tf.errors.OutOfRangeError:
-            images_a, labels_a = None, None
-        try:
-            images_b, labels_b = dset_b.get_minibatch_np(1)
-        except tf.errors.OutOfRangeError:
-            images_b, labels_b = None, None
-        if images_a is None or images_b is None:
-            if images_a is not None or images_b is not None:
-                print('Datasets contain different number of images')
-            break
-        if images_a.shape == images_b.shape and np.all(images_a == images_b):
-            identical_images += 1
-        else:
-            print('Image %d is different' % idx)
-        if labels_a.shape == labels_b.shape and np.all(labels_a == labels_b):
-            identical_labels += 1
-        else:
-            print('Label %d is different' % idx)
-        idx += 1
-    print('Identical images: %d / %d' % (identical_images, idx))
+    # Manifests written by the exporter carry a content hash of the records.
+    content_hashes = [(getattr(dset, 'manifest', None) or {}).get('content_hash')
+                      for dset in [dset_a, dset_b]]
+    if all(content_hashes):
+        print('Manifest content hashes %s: %s vs %s' %
+              ('match' if content_hashes[0] == content_hashes[1] else 'differ',
+               content_hashes[0], content_hashes[1]))
+
+    def iterate_tasks():
+        # Alternate between the datasets so that neither runs far ahead.
+        iters = [iterate_minibatches_np(dset_a, minibatch_size),
+                 iterate_minibatches_np(dset_b, minibatch_size)]
+        while any(it is not None for it in iters):
+            for which, it in enumerate(iters):
+                if it is None:
+                    continue
+                try:
+                    images, labels = next(it)
+                except StopIteration:
+                    iters[which] = None
+                    continue
+                yield which, images, labels
+
+    print('Comparing datasets with %d workers' % num_workers)
+    image_digests = [[], []]
+    label_digests = [[], []]
+    start_time = time.time()
+    for which, images, labels in imap_ordered(pool, digest_minibatch,
+                                              iterate_tasks(),
+                                              num_workers * 2):
+        image_digests[which] += images
+        label_digests[which] += labels
+        print('%d\r' % max(len(d) for d in image_digests), end='', flush=True)
+    pool.close()
+    pool.join()
+    num_a, num_b = len(image_digests[0]), len(image_digests[1])
+    print('Hashed %d + %d images (%.1f img/s).' %
+          (num_a, num_b, (num_a + num_b) / max(time.time() - start_time, 1e-8)))
+
+    if num_a != num_b:
+        print('Datasets contain different number of images: %d vs %d' %
+              (num_a, num_b))
+    report_mismatches('Images', image_digests[0], image_digests[1])
     if not ignore_labels:
-        print('Identical labels: %d / %d' % (identical_labels, idx))
+        report_mismatches('Labels', label_digests[0], label_digests[1])
+
+
+#----------------------------------------------------------------------------
+
+
+def convert_to_mmap(tfrecord_dir, output_dir, minibatch_size=256):
+    print('Loading dataset "%s"' % tfrecord_dir)
+    tflib.init_tf({'gpu_options.allow_growth': True})
+    dset = dataset.TFRecordDataset(tfrecord_dir,
+                                   max_label_size='full',
+                                   repeat=False,
+                                   shuffle_mb=0)
+    tflib.init_uninitialized_vars()
+
+    all_labels = []
+    with MmapExporter(output_dir, dset.num_images) as exp:
+        while True:
+            try:
+                images, labels = dset.get_minibatch_np(minibatch_size)
+            except tf.errors.OutOfRangeError:
+                break
+            for img in images:
+                exp.add_image(img)
+            all_labels.append(labels)
+        if dset.label_size > 0:
+            exp.add_labels(np.concatenate(all_labels))
+
+
+#----------------------------------------------------------------------------
+
+
+def benchmark_pyramid(resolution, channels, num_images, batch_size):
+    print('Benchmarking mip pyramid construction for %d images of %dx%dx%d' %
+          (num_images, channels, resolution, resolution))
+    num_lods = int(np.log2(resolution)) - 1
+    images = np.random.RandomState(123).randint(
+        0, 256, [num_images, channels, resolution, resolution]).astype(np.uint8)
+
+    time_begin = time.time()
+    reference = [build_pyramid_reference(img, num_lods) for img in images]
+    time_reference = time.time() - time_begin
+
+    buffers = dict()
+    identical = True
+    time_batch = 0.0
+    for begin in range(0, num_images, batch_size):
+        time_begin = time.time()
+        pyramid = build_pyramid(images[begin:begin + batch_size], num_lods,
+                                buffers)
+        time_batch += time.time() - time_begin
+        for lod, quant in enumerate(pyramid):
+            expected = np.stack(
+                [ref[lod] for ref in reference[begin:begin + batch_size]])
+            identical = identical and np.array_equal(quant, expected)
+
+    print('Per-image:  %-8.3f sec  %-10.1f img/s' %
+          (time_reference, num_images / time_reference))
+    print('Batched:    %-8.3f sec  %-10.1f img/s' %
+          (time_batch, num_images / time_batch))
+    print('Speedup:    %.2fx' % (time_reference / time_batch))
+    print('Bit-identical: %s' % identical)
+    if not identical:
+        error('Batched pyramid differs from the per-image reference')
 
 
 #----------------------------------------------------------------------------
 
 
-def create_mnist(tfrecord_dir, mnist_dir):
+def create_mnist(tfrecord_dir, mnist_dir, export_format='tfrecords'):
     print('Loading MNIST from "%s"' % mnist_dir)
     import gzip
     with gzip.open(os.path.join(mnist_dir, 'train-images-idx3-ubyte.gz'),
@@ -363,13 +750,14 @@ def create_mnist(tfrecord_dir, mnist_dir):
     onehot = np.zeros((labels.size, np.max(labels) + 1), dtype=np.float32)
     onehot[np.arange(labels.size), labels] = 1.0
 
-    with TFRecordExporter(tfrecord_dir, images.shape[0]) as tfr:
+    with create_exporter(tfrecord_dir, images.shape[0],
+                         export_format=export_format) as tfr:
         order = tfr.choose_shuffled_order()
-        for idx in range(order.size):
-            tfr.add_image(images[order[idx]])
+        for begin in range(0, order.size, EXPORT_BATCH_SIZE):
+            tfr.add_images(images[order[begin:begin + EXPORT_BATCH_SIZE]])
         tfr.add_labels(onehot[order])
 
-def create_test_mnist(tfrecord_dir, mnist_dir):
+def create_test_mnist(tfrecord_dir, mnist_dir, export_format='tfrecords'):
     print('Loading MNIST from "%s"' % mnist_dir)
     import gzip
     with gzip.open(os.path.join(mnist_dir, 't10k-images-idx3-ubyte.gz'),
@@ -389,14 +777,15 @@ def create_test_mnist(tfrecord_dir, mnist_dir):
     onehot = np.zeros((labels.size, np.max(labels) + 1), dtype=np.float32)
     onehot[np.arange(labels.size), labels] = 1.0
 
-    with TFRecordExporter(tfrecord_dir, images.shape[0]) as tfr:
+    with create_exporter(tfrecord_dir, images.shape[0],
+                         export_format=export_format) as tfr:
         order = tfr.choose_shuffled_order()
-        for idx in range(order.size):
-            tfr.add_image(images[order[idx]])
+        for begin in range(0, order.size, EXPORT_BATCH_SIZE):
+            tfr.add_images(images[order[begin:begin + EXPORT_BATCH_SIZE]])
         tfr.add_labels(onehot[order])
 
 
-def create_mnist_per_class(tfrecord_dir, mnist_dir):
+def create_mnist_per_class(tfrecord_dir, mnist_dir, export_format='tfrecords'):
     print('Loading MNIST from "%s"' % mnist_dir)
     import gzip
     with gzip.open(os.path.join(mnist_dir, 'train-images-idx3-ubyte.gz'),
@@ -418,7 +807,8 @@ def create_mnist_per_class(tfrecord_dir, mnist_dir):
 
     for i in range(10):
         tfrecord_dir_i = os.path.join(tfrecord_dir, 'number_' + str(i))
-        with TFRecordExporter(tfrecord_dir_i, images.shape[0]//10) as tfr:
+        with create_exporter(tfrecord_dir_i, images.shape[0]//10,
+                             export_format=export_format) as tfr:
             for idx in range(labels.shape[0]):
                 if onehot[idx][i] > 0:
                     tfr.add_image(images[idx])
@@ -430,7 +820,8 @@ def create_mnist_per_class(tfrecord_dir, mnist_dir):
 def create_mnistrgb(tfrecord_dir,
                     mnist_dir,
                     num_images=1000000,
-                    random_seed=123):
+                    random_seed=123,
+                    export_format='tfrecords'):
     print('Loading MNIST from "%s"' % mnist_dir)
     import gzip
     with gzip.open(os.path.join(mnist_dir, 'train-images-idx3-ubyte.gz'),
@@ -443,7 +834,8 @@ def create_mnistrgb(tfrecord_dir,
     assert images.shape == (60000, 32, 32) and images.dtype == np.uint8
     assert np.min(images) == 0 and np.max(images) == 255
 
-    with TFRecordExporter(tfrecord_dir, num_images) as tfr:
+    with create_exporter(tfrecord_dir, num_images,
+                         export_format=export_format) as tfr:
         rnd = np.random.RandomState(random_seed)
         for _idx in range(num_images):
             tfr.add_image(images[rnd.randint(images.shape[0], size=3)])
@@ -452,7 +844,7 @@ def create_mnistrgb(tfrecord_dir,
 #----------------------------------------------------------------------------
 
 
-def create_cifar10(tfrecord_dir, cifar10_dir):
+def create_cifar10(tfrecord_dir, cifar10_dir, export_format='tfrecords'):
     print('Loading CIFAR-10 from "%s"' % cifar10_dir)
     import pickle
     images = []
@@ -472,17 +864,18 @@ def create_cifar10(tfrecord_dir, cifar10_dir):
     onehot = np.zeros((labels.size, np.max(labels) + 1), dtype=np.float32)
     onehot[np.arange(labels.size), labels] = 1.0
 
-    with TFRecordExporter(tfrecord_dir, images.shape[0]) as tfr:
+    with create_exporter(tfrecord_dir, images.shape[0],
+                         export_format=export_format) as tfr:
         order = tfr.choose_shuffled_order()
-        for idx in range(order.size):
-            tfr.add_image(images[order[idx]])
+        for begin in range(0, order.size, EXPORT_BATCH_SIZE):
+            tfr.add_images(images[order[begin:begin + EXPORT_BATCH_SIZE]])
         tfr.add_labels(onehot[order])
 
 
 #----------------------------------------------------------------------------
 
 
-def create_cifar100(tfrecord_dir, cifar100_dir):
+def create_cifar100(tfrecord_dir, cifar100_dir, export_format='tfrecords'):
     print('Loading CIFAR-100 from "%s"' % cifar100_dir)
     import pickle
     with open(os.path.join(cifar100_dir, 'train'), 'rb') as file:
@@ -496,17 +889,18 @@ def create_cifar100(tfrecord_dir, cifar100_dir):
     onehot = np.zeros((labels.size, np.max(labels) + 1), dtype=np.float32)
     onehot[np.arange(labels.size), labels] = 1.0
 
-    with TFRecordExporter(tfrecord_dir, images.shape[0]) as tfr:
+    with create_exporter(tfrecord_dir, images.shape[0],
+                         export_format=export_format) as tfr:
         order = tfr.choose_shuffled_order()
-        for idx in range(order.size):
-            tfr.add_image(images[order[idx]])
+        for begin in range(0, order.size, EXPORT_BATCH_SIZE):
+            tfr.add_images(images[order[begin:begin + EXPORT_BATCH_SIZE]])
         tfr.add_labels(onehot[order])
 
 
 #----------------------------------------------------------------------------
 
 
-def create_svhn(tfrecord_dir, svhn_dir):
+def create_svhn(tfrecord_dir, svhn_dir, export_format='tfrecords'):
     print('Loading SVHN from "%s"' % svhn_dir)
     import pickle
     images = []
@@ -526,17 +920,19 @@ def create_svhn(tfrecord_dir, svhn_dir):
     onehot = np.zeros((labels.size, np.max(labels) + 1), dtype=np.float32)
     onehot[np.arange(labels.size), labels] = 1.0
 
-    with TFRecordExporter(tfrecord_dir, images.shape[0]) as tfr:
+    with create_exporter(tfrecord_dir, images.shape[0],
+                         export_format=export_format) as tfr:
         order = tfr.choose_shuffled_order()
-        for idx in range(order.size):
-            tfr.add_image(images[order[idx]])
+        for begin in range(0, order.size, EXPORT_BATCH_SIZE):
+            tfr.add_images(images[order[begin:begin + EXPORT_BATCH_SIZE]])
         tfr.add_labels(onehot[order])
 
 
 #----------------------------------------------------------------------------
 
 
-def create_lsun(tfrecord_dir, lmdb_dir, resolution=256, max_images=None):
+def create_lsun(tfrecord_dir, lmdb_dir, resolution=256, max_images=None,
+                export_format='tfrecords'):
     print('Loading LSUN dataset from "%s"' % lmdb_dir)
     import lmdb  # pip install lmdb # pylint: disable=import-error
     import cv2  # pip install opencv-python
@@ -545,7 +941,8 @@ def create_lsun(tfrecord_dir, lmdb_dir, resolution=256, max_images=None):
         total_images = txn.stat()['entries']  # pylint: disable=no-value-for-parameter
         if max_images is None:
             max_images = total_images
-        with TFRecordExporter(tfrecord_dir, max_images) as tfr:
+        with create_exporter(tfrecord_dir, max_images,
+                             export_format=export_format) as tfr:
             for _idx, (_key, value) in enumerate(txn.cursor()):
                 try:
                     try:
@@ -580,7 +977,8 @@ def create_lsun_wide(tfrecord_dir,
                      lmdb_dir,
                      width=512,
                      height=384,
-                     max_images=None):
+                     max_images=None,
+                     export_format='tfrecords'):
     assert width == 2**int(np.round(np.log2(width)))
     assert height <= width
     print('Loading LSUN dataset from "%s"' % lmdb_dir)
@@ -591,8 +989,9 @@ def create_lsun_wide(tfrecord_dir,
         total_images = txn.stat()['entries']  # pylint: disable=no-value-for-parameter
         if max_images is None:
             max_images = total_images
-        with TFRecordExporter(tfrecord_dir, max_images,
-                              print_progress=False) as tfr:
+        with create_exporter(tfrecord_dir, max_images,
+                              print_progress=False,
+                              export_format=export_format) as tfr:
             for idx, (_key, value) in enumerate(txn.cursor()):
                 try:
                     try:
@@ -633,7 +1032,8 @@ def create_lsun_wide(tfrecord_dir,
 #----------------------------------------------------------------------------
 
 
-def create_celeba(tfrecord_dir, celeba_dir, cx=89, cy=121):
+def create_celeba(tfrecord_dir, celeba_dir, cx=89, cy=121,
+                  export_format='tfrecords'):
     print('Loading CelebA from "%s"' % celeba_dir)
     glob_pattern = os.path.join(celeba_dir, 'img_align_celeba_png', '*.png')
     image_filenames = sorted(glob.glob(glob_pattern))
@@ -641,7 +1041,8 @@ def create_celeba(tfrecord_dir, celeba_dir, cx=89, cy=121):
     if len(image_filenames) != expected_images:
         error('Expected to find %d images' % expected_images)
 
-    with TFRecordExporter(tfrecord_dir, len(image_filenames)) as tfr:
+    with create_exporter(tfrecord_dir, len(image_filenames),
+                         export_format=export_format) as tfr:
         order = tfr.choose_shuffled_order()
         for idx in range(order.size):
             img = np.asarray(PIL.Image.open(image_filenames[order[idx]]))
@@ -654,7 +1055,8 @@ def create_celeba(tfrecord_dir, celeba_dir, cx=89, cy=121):
 #----------------------------------------------------------------------------
 
 
-def create_from_images(tfrecord_dir, image_dir, shuffle):
+def create_from_images(tfrecord_dir, image_dir, shuffle,
+                       export_format='tfrecords'):
     print('Loading images from "%s"' % image_dir)
     image_filenames = sorted(glob.glob(os.path.join(image_dir, '*')))
     if len(image_filenames) == 0:
@@ -670,7 +1072,8 @@ def create_from_images(tfrecord_dir, image_dir, shuffle):
     if channels not in [1, 3]:
         error('Input images must be stored as RGB or grayscale')
 
-    with TFRecordExporter(tfrecord_dir, len(image_filenames)) as tfr:
+    with create_exporter(tfrecord_dir, len(image_filenames),
+                         export_format=export_format) as tfr:
         order = tfr.choose_shuffled_order() if shuffle else np.arange(
             len(image_filenames))
         for idx in range(order.size):
@@ -688,7 +1091,8 @@ def create_from_images(tfrecord_dir, image_dir, shuffle):
 
 
 def create_from_dsprites_npz(tfrecord_dir, dsprites_filename, shuffle,
-                             shape_only, sample_color):
+                             shape_only, sample_color,
+                             export_format='tfrecords'):
     print('Loading images from "%s"' % dsprites_filename)
     data = np.load(dsprites_filename, encoding='latin1', allow_pickle=True)
     images = data['imgs'] * 255
@@ -705,7 +1109,8 @@ def create_from_dsprites_npz(tfrecord_dir, dsprites_filename, shuffle,
     if channels not in [1, 3]:
         error('Input images must be stored as RGB or grayscale')
 
-    with TFRecordExporter(tfrecord_dir, images.shape[0]) as tfr:
+    with create_exporter(tfrecord_dir, images.shape[0],
+                         export_format=export_format) as tfr:
         order = tfr.choose_shuffled_order() if shuffle else np.arange(
             images.shape[0])
         for idx in range(order.size):
@@ -731,108 +1136,148 @@ def str_to_intlist(v):
     v_list = [int(i.strip()) for i in v.strip().split(',')]
     return v_list
 
+#----------------------------------------------------------------------------
+# Factor-grid subsets of fully factorized datasets (dSprites, 3DShapes).
+
+SUBSET_CHUNK_SIZE = 4096
+
+
+def factor_subset_indices(full_factor_sizes, latents_static, use_latents):
+    # Flat indices of all images that vary the factors in use_latents and
+    # keep the others at latents_static, in np.ndindex order.
+    full_factor_sizes = np.asarray(full_factor_sizes, dtype=np.int64)
+    factor_bases = np.prod(full_factor_sizes) // np.cumprod(full_factor_sizes)
+    latents_base = np.array(latents_static, dtype=np.int64)
+    latents_base[use_latents] = 0
+    grid = np.indices(full_factor_sizes[use_latents], dtype=np.int64)
+    grid = grid.reshape(len(use_latents), -1)
+    return np.sum(factor_bases * latents_base) + np.dot(
+        factor_bases[use_latents], grid)
+
+
+def iterate_h5_rows(data, indices, chunk_size=SUBSET_CHUNK_SIZE):
+    # Yield the rows of an h5py dataset at the given sorted indices.
+    for begin in range(0, indices.size, chunk_size):
+        idx = indices[begin:begin + chunk_size]
+        lo, hi = int(idx[0]), int(idx[-1]) + 1
+        if hi - lo <= 4 * idx.size:
+            yield data[lo:hi][idx - lo]  # dense: one contiguous read
+        else:
+            yield data[idx]
+
+
+def iterate_npz_rows(npz_filename, key, indices, chunk_size=SUBSET_CHUNK_SIZE):
+    # Yield the rows of array `key` in an .npz at the given sorted indices,
+    # decompressing the member sequentially one chunk of rows at a time.
+    with zipfile.ZipFile(npz_filename) as zf, zf.open(key + '.npy') as f:
+        shape, dtype = read_npy_header(f)
+        row_shape = shape[1:]
+        row_bytes = int(np.prod(row_shape)) * dtype.itemsize
+        pos = 0
+        for begin in range(0, int(indices[-1]) + 1, chunk_size):
+            end = min(begin + chunk_size, shape[0])
+            block = np.frombuffer(f.read((end - begin) * row_bytes), dtype)
+            block = block.reshape((end - begin, ) + row_shape)
+            stop = np.searchsorted(indices, end)
+            if stop > pos:
+                yield block[indices[pos:stop] - begin]
+                pos = stop
+
+
+def read_npy_header(f):
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    if fortran_order:
+        error('Fortran-ordered arrays are not supported')
+    return shape, dtype
+
+
+def create_factor_subset(tfrecord_dir, iterate_rows, image_shape, labels,
+                         indices, shuffle, data_file, to_chw,
+                         chunk_size=SUBSET_CHUNK_SIZE,
+                         export_format='tfrecords'):
+    resolution = image_shape[0]
+    channels = image_shape[2] if len(image_shape) == 3 else 1
+    if image_shape[1] != resolution:
+        error('Input images must have the same width and height')
+    if resolution != 2**int(np.floor(np.log2(resolution))):
+        error('Input image resolution must be a power-of-two')
+    if channels not in [1, 3]:
+        error('Input images must be stored as RGB or grayscale')
+    print('Selected %d images' % indices.size)
+
+    # Rows are read in sorted order; dest maps them back to subset order.
+    dest = np.argsort(indices, kind='stable')
+    with create_exporter(tfrecord_dir, indices.size,
+                         export_format=export_format) as tfr:
+        images = np.lib.format.open_memmap(
+            tfr.tfr_prefix + data_file, mode='w+', dtype=np.uint8,
+            shape=(indices.size, channels, resolution, resolution))
+        pos = 0
+        for rows in iterate_rows(indices[dest], chunk_size):
+            images[dest[pos:pos + len(rows)]] = to_chw(rows)
+            pos += len(rows)
+        assert pos == indices.size
+
+        order = tfr.choose_shuffled_order() if shuffle else np.arange(
+            indices.size)
+        for begin in range(0, order.size, chunk_size):
+            tfr.add_images(images[order[begin:begin + chunk_size]])
+        tfr.add_labels(labels[indices[order]])
+        images.flush()
+        del images
+
 def create_subset_from_dsprites_npz(tfrecord_dir, dsprites_filename, shuffle,
                                     latents_static='[2,3,20,15,15]',
-                                    use_latents='[0,1,2,3,4]'):
+                                    use_latents='[0,1,2,3,4]',
+                                    chunk_size=SUBSET_CHUNK_SIZE,
+                                    export_format='tfrecords'):
     latents_static = str_to_intlist(latents_static)
     use_latents = str_to_intlist(use_latents)
     print('Loading images from "%s"' % dsprites_filename)
     data = np.load(dsprites_filename, encoding='latin1', allow_pickle=True)
-    images = data['imgs'] * 255
     labels = data['latents_classes']  # [color(0, discarded), shape(3), scale(6), orientation(40), x(32), y(32)]
-    img = images[0]
-    resolution = img.shape[0]
-    channels = img.shape[2] if img.ndim == 3 else 1
-    if img.shape[1] != resolution:
-        error('Input images must have the same width and height')
-    if resolution != 2**int(np.floor(np.log2(resolution))):
-        error('Input image resolution must be a power-of-two')
-    if channels not in [1, 3]:
-        error('Input images must be stored as RGB or grayscale')
     labels = labels[:, 1:]
+    with zipfile.ZipFile(dsprites_filename) as zf, zf.open('imgs.npy') as f:
+        image_shape = read_npy_header(f)[0][1:]
     full_factor_sizes = np.array([3, 6, 40, 32, 32])
-    factor_bases = np.prod(full_factor_sizes) // np.cumprod(full_factor_sizes)
-    # [245760, 40960, 1024, 32, 1]
-
-    latents_cur = np.array(latents_static)
-    images_af = []
-    labels_af = []
+    # factor bases: [245760, 40960, 1024, 32, 1]
     print(use_latents)
-    for modified_values in np.ndindex(tuple(full_factor_sizes[use_latents])):
-        latents_cur[use_latents] = modified_values
-        img_idx = np.sum(factor_bases * latents_cur)
-        images_af.append(images[img_idx])
-        labels_af.append(labels[img_idx])
-    images_af = np.array(images_af)
-    labels_af = np.array(labels_af)
-
-    with TFRecordExporter(tfrecord_dir, images_af.shape[0]) as tfr:
-        order = tfr.choose_shuffled_order() if shuffle else np.arange(
-            images_af.shape[0])
-        for idx in range(order.size):
-            img = images_af[order[idx]]
-            if channels == 1:
-                img = img[np.newaxis, :, :]  # HW => CHW
-            else:
-                img = img.transpose([2, 0, 1])  # HWC => CHW
-
-            tfr.add_image(img)
-        tfr.add_labels(labels_af[order])
-        with open(tfr.tfr_prefix + 'dsprites_subset_np.data', 'wb') as f:
-            np.save(f, np.reshape(images_af, [images_af.shape[0], 1,
-                                              images_af.shape[1],
-                                              images_af.shape[2]]))
+    indices = factor_subset_indices(full_factor_sizes, latents_static,
+                                    use_latents)
+    iterate_rows = lambda idx, size: iterate_npz_rows(dsprites_filename,
+                                                      'imgs', idx, size)
+    to_chw = lambda rows: (rows * np.uint8(255))[:, np.newaxis]
+    create_factor_subset(tfrecord_dir, iterate_rows, image_shape, labels,
+                         indices, shuffle, 'dsprites_subset_np.data', to_chw,
+                         chunk_size, export_format=export_format)
 
 #----------------------------------------------------------------------------
 def create_subset_from_shape3d(tfrecord_dir, filename, shuffle,
                                     latents_static='[5,5,5,4,2,8]',
-                                    use_latents='[0,1,2,3,4,5]'):
+                                    use_latents='[0,1,2,3,4,5]',
+                                    chunk_size=SUBSET_CHUNK_SIZE,
+                                    export_format='tfrecords'):
     latents_static = str_to_intlist(latents_static)
     use_latents = str_to_intlist(use_latents)
     print('Loading images from "%s"' % filename)
-    dataset_zip = h5py.File(filename, 'r')
-    images = dataset_zip['images'][:]  # array shape [480000,64,64,3], uint8 in range(256)
-    labels = dataset_zip['labels']  # array shape [480000,6], float64
-    img = images[0]
-    resolution = img.shape[0]
-    channels = img.shape[2] if img.ndim == 3 else 1
-    if img.shape[1] != resolution:
-        error('Input images must have the same width and height')
-    if resolution != 2**int(np.floor(np.log2(resolution))):
-        error('Input image resolution must be a power-of-two')
-    if channels not in [1, 3]:
-        error('Input images must be stored as RGB or grayscale')
-    labels = labels[:, 1:]
-    full_factor_sizes = np.array([10, 10, 10, 8, 4, 15])
-    factor_bases = np.prod(full_factor_sizes) // np.cumprod(full_factor_sizes)
-    # [48000, 4800, 480, 60, 15, 1]
-
-    latents_cur = np.array(latents_static)
-    images_af = []
-    labels_af = []
-    print(use_latents)
-    for modified_values in np.ndindex(tuple(full_factor_sizes[use_latents])):
-        latents_cur[use_latents] = modified_values
-        img_idx = np.sum(factor_bases * latents_cur)
-        images_af.append(images[img_idx])
-        labels_af.append(labels[img_idx])
-    images_af = np.array(images_af)
-    labels_af = np.array(labels_af)
-
-    with TFRecordExporter(tfrecord_dir, images_af.shape[0]) as tfr:
-        order = tfr.choose_shuffled_order() if shuffle else np.arange(
-            images_af.shape[0])
-        for idx in range(order.size):
-            img = images_af[order[idx]]
-            if channels == 1:
-                img = img[np.newaxis, :, :]  # HW => CHW
-            else:
-                img = img.transpose([2, 0, 1])  # HWC => CHW
-
-            tfr.add_image(img)
-        tfr.add_labels(labels_af[order])
-        with open(tfr.tfr_prefix + 'shape3d_subset_np.data', 'wb') as f:
-            np.save(f, np.transpose(images_af, [0, 3, 1, 2]))
+    with h5py.File(filename, 'r') as dataset_zip:
+        images = dataset_zip['images']  # array shape [480000,64,64,3], uint8 in range(256)
+        labels = dataset_zip['labels'][:, 1:]  # array shape [480000,6], float64
+        full_factor_sizes = np.array([10, 10, 10, 8, 4, 15])
+        # factor bases: [48000, 4800, 480, 60, 15, 1]
+        print(use_latents)
+        indices = factor_subset_indices(full_factor_sizes, latents_static,
+                                        use_latents)
+        iterate_rows = lambda idx, size: iterate_h5_rows(images, idx, size)
+        to_chw = lambda rows: rows.transpose([0, 3, 1, 2])  # NHWC => NCHW
+        create_factor_subset(tfrecord_dir, iterate_rows, images.shape[1:],
+                             labels, indices, shuffle,
+                             'shape3d_subset_np.data', to_chw, chunk_size,
+                             export_format=export_format)
 
 #----------------------------------------------------------------------------
 
@@ -848,7 +1293,8 @@ def convert_to_shape(labels):
 #----------------------------------------------------------------------------
 
 
-def create_from_hdf5(tfrecord_dir, hdf5_filename, shuffle):
+def create_from_hdf5(tfrecord_dir, hdf5_filename, shuffle,
+                     export_format='tfrecords'):
     print('Loading HDF5 archive from "%s"' % hdf5_filename)
     import h5py  # conda install h5py
     with h5py.File(hdf5_filename, 'r') as hdf5_file:
@@ -856,7 +1302,8 @@ def create_from_hdf5(tfrecord_dir, hdf5_filename, shuffle):
             value for key, value in hdf5_file.items() if key.startswith('data')
         ],
                         key=lambda lod: lod.shape[3])
-        with TFRecordExporter(tfrecord_dir, hdf5_data.shape[0]) as tfr:
+        with create_exporter(tfrecord_dir, hdf5_data.shape[0],
+                             export_format=export_format) as tfr:
             order = tfr.choose_shuffled_order() if shuffle else np.arange(
                 hdf5_data.shape[0])
             for idx in range(order.size):
@@ -877,6 +1324,19 @@ def execute_cmdline(argv):
         'Tool for creating multi-resolution TFRecords datasets for StyleGAN and ProGAN.',
         epilog='Type "%s <command> -h" for more information.' % prog)
 
+    parser.add_argument(
+        '--format',
+        help='On-disk format written by create_* commands (default: tfrecords)',
+        choices=sorted(EXPORT_FORMATS.keys()),
+        default='tfrecords')
+    parser.add_argument(
+        '--num_workers',
+        help='Worker processes encoding images in create_* commands, '
+        '0 = encode on the main thread; extract and compare use one per '
+        'CPU when 0 (default: 0)',
+        type=int,
+        default=0)
+
     subparsers = parser.add_subparsers(dest='command')
     subparsers.required = True
 
@@ -896,6 +1356,10 @@ def execute_cmdline(argv):
                     'extract datasets/mnist mnist-images')
     p.add_argument('tfrecord_dir', help='Directory containing dataset')
     p.add_argument('output_dir', help='Directory to extract the images into')
+    p.add_argument('--minibatch_size',
+                   help='Images per minibatch (default: %d)' % VERIFY_BATCH_SIZE,
+                   type=int,
+                   default=VERIFY_BATCH_SIZE)
 
     p = add_command('compare', 'Compare two datasets.',
                     'compare datasets/mydataset datasets/mnist')
@@ -906,6 +1370,42 @@ def execute_cmdline(argv):
                    help='Ignore labels (default: 0)',
                    type=int,
                    default=0)
+    p.add_argument('--minibatch_size',
+                   help='Images per minibatch (default: %d)' % VERIFY_BATCH_SIZE,
+                   type=int,
+                   default=VERIFY_BATCH_SIZE)
+    p.add_argument('--verify_manifest',
+                   help='Check the stored manifest content hashes against '
+                   'the records first (default: 0)',
+                   type=int,
+                   default=0)
+
+    p = add_command('convert_to_mmap',
+                    'Convert TFRecords dataset to memory-mapped format.',
+                    'convert_to_mmap datasets/mnist datasets/mnist-mmap')
+    p.add_argument('tfrecord_dir', help='Directory containing dataset')
+    p.add_argument('output_dir', help='New dataset directory to be created')
+
+    p = add_command(
+        'benchmark_pyramid',
+        'Compare per-image and batched mip pyramid construction.',
+        'benchmark_pyramid --resolution 256 --num_images 1024')
+    p.add_argument('--resolution',
+                   help='Image resolution (default: 256)',
+                   type=int,
+                   default=256)
+    p.add_argument('--channels',
+                   help='Image channels (default: 3)',
+                   type=int,
+                   default=3)
+    p.add_argument('--num_images',
+                   help='Number of random images (default: 1024)',
+                   type=int,
+                   default=1024)
+    p.add_argument('--batch_size',
+                   help='Images per batch (default: 64)',
+                   type=int,
+                   default=64)
 
     p = add_command('create_mnist', 'Create dataset for MNIST.',
                     'create_mnist datasets/mnist ~/downloads/mnist')
@@ -1045,6 +1545,10 @@ def execute_cmdline(argv):
                    help='Dimensions used',
                    type=str,
                    default='[0,1,2,3,4]')
+    p.add_argument('--chunk_size',
+                   help='Images read and exported per chunk (default: %d)' % SUBSET_CHUNK_SIZE,
+                   type=int,
+                   default=SUBSET_CHUNK_SIZE)
 
     p = add_command(
         'create_subset_from_shape3d', 'Create dataset from a shape3d with sub dimensions.',
@@ -1064,6 +1568,10 @@ def execute_cmdline(argv):
                    help='Dimensions used',
                    type=str,
                    default='[0,1,2,3,4,5]')
+    p.add_argument('--chunk_size',
+                   help='Images read and exported per chunk (default: %d)' % SUBSET_CHUNK_SIZE,
+                   type=int,
+                   default=SUBSET_CHUNK_SIZE)
 
     # p = add_command(    'create_dsprites_shape_labels_from_tfr', 'Create shape labels from a dsprites_tfr_label.',
     # 'create_from_dsprites_npz datasets/mydataset dsprites_py3.npz')
@@ -1084,6 +1592,15 @@ def execute_cmdline(argv):
     args = parser.parse_args(argv[1:] if len(argv) > 1 else ['-h'])
     func = globals()[args.command]
     del args.command
+    global export_num_workers  # pylint: disable=global-statement
+    export_num_workers = args.num_workers
+    del args.num_workers
+    export_format = args.format
+    del args.format
+    if 'export_format' in inspect.signature(func).parameters:
+        args.export_format = export_format
+    elif export_format != 'tfrecords':
+        error('Command "%s" does not support --format' % func.__name__)
     func(**vars(args))
 
 
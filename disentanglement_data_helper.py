@@ -34,11 +34,22 @@ class DisentangleDataHelper:
         assert self.factor_bases[-1] == 1
 
         self.label_file = glob.glob(os.path.join(dataset_dir, '*.labels'))[0]
-        self.np_labels = np.load(self.label_file)
+        self.np_labels = np.load(self.label_file, mmap_mode='r')
 
         self.data_file = glob.glob(os.path.join(dataset_dir, '*.data'))[0]
-        self.np_data = np.load(self.data_file)
+        self.np_data = np.load(self.data_file, mmap_mode='r')
         self.n_data = self.np_data.shape[0]
+        assert self.n_data == np.prod(self.factor_sizes)
+
+        # Lookup tables: data index => factor values, and uint8 pixel => [-1, 1].
+        latents_dtype = np.min_scalar_type(np.max(self.factor_sizes) - 1)
+        self.latents_table = np.stack(np.unravel_index(np.arange(self.n_data), self.factor_sizes), axis=1).astype(latents_dtype)
+        self.drange_table = misc.adjust_dynamic_range(np.arange(256, dtype=np.uint8), [0, 255], [-1., 1.]).astype(np.float32)
+
+    def to_net_range(self, images):
+        if images.dtype == np.uint8:
+            return self.drange_table[images]
+        return misc.adjust_dynamic_range(images, [0, 255], [-1., 1.]).astype(np.float32)
 
     def sample_factors(self, num, random_state):
         idxs = random_state.randint(self.n_data, size=num)
@@ -46,44 +57,43 @@ class DisentangleDataHelper:
 
     def sample_observations_from_factors(self, factors, random_state):
         idxs = self.batch_latents_to_data_indices(factors)
-        images = self.np_data[idxs]
-        images = misc.adjust_dynamic_range(images, [0, 255], [-1., 1.])
-        return images
+        return self.to_net_range(self.np_data[idxs])
 
     def sample_observations(self, num, random_state):
         idxs = random_state.randint(self.n_data, size=num)
-        images = self.np_data[idxs]
-        images = misc.adjust_dynamic_range(images, [0, 255], [-1., 1.])
-        return images
+        return self.to_net_range(self.np_data[idxs])
+
+    def sample_fixed_factor_batches(self, num_batches, batch_size, factor_index, random_state):
+        """Sample num_batches batches that each keep one factor fixed.
+
+        factor_index is a single factor or one factor per batch. Returns a
+        float32 array [num_batches, batch_size, C, H, W] in [-1, 1].
+        """
+        factor_index = np.broadcast_to(factor_index, [num_batches])
+        factors = self.sample_factors(num_batches * batch_size, random_state)
+        factors = factors.reshape(num_batches, batch_size, self.num_factors)
+        batch_idx = np.arange(num_batches)
+        factors[batch_idx, :, factor_index] = factors[batch_idx, 0, factor_index][:, np.newaxis]
+        idxs = self.batch_latents_to_data_indices(factors.reshape(-1, self.num_factors))
+        images = self.to_net_range(self.np_data[idxs])
+        return images.reshape((num_batches, batch_size) + images.shape[1:])
 
     def get_data(self, idx):
         return self.np_data[idx]
 
     def data_index_to_latent(self, idx):
-        cur_latent = []
-        tmp_idx = idx
-        for dim in range(len(self.factor_sizes)):
-            cur_latent.append(tmp_idx // self.factor_bases[dim])
-            tmp_idx = tmp_idx % self.factor_bases[dim]
-        return np.array(cur_latent)
+        return self.latents_table[idx].astype(np.int64)
 
     def batch_data_indices_to_latents(self, idxs):
-        cur_latents = []
-        tmp_idxs = idxs
-        for dim in range(len(self.factor_sizes)):
-            cur_latents.append(tmp_idxs // self.factor_bases[dim])
-            tmp_idxs = tmp_idxs % self.factor_bases[dim]
-        # cur_latents: [n_factors, n_idxs]
-        cur_latents = np.transpose(np.array(cur_latents), [1, 0])
-        assert cur_latents.shape == (len(idxs), len(self.factor_sizes))
-        return np.array(cur_latents)
+        # cur_latents: [n_idxs, n_factors]
+        return self.latents_table[idxs].astype(np.int64)
 
     def latent_to_data_index(self, latent):
-        idx = np.sum(self.factor_bases * latent)
+        idx = np.dot(latent, self.factor_bases)
         return idx
 
     def batch_latents_to_data_indices(self, latents):
-        idxs = np.sum(self.factor_bases * latents, axis=1)
+        idxs = np.dot(latents, self.factor_bases)
         return idxs
 
     def sample(self, num, random_state):
@@ -9,6 +9,9 @@ from . import network
 from . import optimizer
 from . import tfutil
 from . import custom_ops
+from . import snapshot
+from . import frozen
+from . import profiler
 
 from .tfutil import *
 from .network import Network
@@ -25,6 +25,7 @@ cuda_cache_path = os.path.join(os.path.dirname(__file__), '_cudacache')
 cuda_cache_version_tag = 'v1'
 do_not_hash_included_headers = False # Speed up compilation by assuming that headers included by the CUDA code never change. Unsafe!
 verbose = True # Print status messages to stdout.
+force_ref_impl = False # Use the reference TensorFlow implementation of all custom ops, e.g. to run on CPU without nvcc.
 
 compiler_bindir_search_path = [
     'C:/Program Files (x86)/Microsoft Visual Studio/2017/Community/VC/Tools/MSVC/14.14.26428/bin/Hostx64/x64',
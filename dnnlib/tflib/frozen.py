@@ -0,0 +1,131 @@
+# Copyright (c) 2019, NVIDIA Corporation. All rights reserved.
+#
+# This work is made available under the Nvidia Source Code License-NC.
+# To view a copy of this license, visit
+# https://nvlabs.github.io/stylegan2/license.html
+
+"""Frozen inference graphs exported from networks.
+
+export_frozen() evaluates a network for a fixed set of dynamic kwargs (e.g.
+is_validation=True), folds all variables -- including lod and noise inputs --
+into constants, strips training-only and identity nodes and constant-folds
+the result into a standalone GraphDef. FrozenNetwork loads such a file into a
+private graph and session and mimics the array-in, array-out part of
+Network.run()."""
+
+import json
+import time
+import numpy as np
+import tensorflow as tf
+
+from typing import Any
+
+from . import tfutil
+from .. import util
+
+#----------------------------------------------------------------------------
+# Export.
+
+def export_frozen(net, pb_file: str, num_outputs: int = None, output_transform: dict = None, **dynamic_kwargs) -> dict:
+    """Write net.get_output_for(*inputs, **dynamic_kwargs) as a frozen GraphDef to pb_file and its metadata to pb_file + '.json'.
+
+    Args:
+        num_outputs:        Keep only the first num_outputs outputs, e.g. 1 for images without attention maps. None = keep all.
+        output_transform:   Same as in Network.run(), baked into the exported graph.
+    """
+    from tensorflow.tools.graph_transforms import TransformGraph # pylint: disable=import-outside-toplevel
+    assert output_transform is None or util.is_top_level_function(output_transform["func"])
+
+    with tfutil.absolute_name_scope(net.scope + "/_Frozen"), tf.control_dependencies(None):
+        in_expr = [tf.placeholder(tf.float32, shape=[None] + shape[1:], name=name) for name, shape in zip(net.input_names, net.input_shapes)]
+        out_expr = net.get_output_for(*in_expr, return_as_list=True, **dynamic_kwargs)
+        if output_transform is not None:
+            out_kwargs = dict(output_transform)
+            out_expr = out_kwargs.pop("func")(*out_expr, **out_kwargs)
+            out_expr = [out_expr] if tfutil.is_tf_expression(out_expr) else list(out_expr)
+        out_expr = out_expr[:num_outputs]
+
+    in_names = [expr.op.name for expr in in_expr]
+    out_names = [expr.op.name for expr in out_expr]
+    graph_def = tf.graph_util.extract_sub_graph(tf.get_default_graph().as_graph_def(), out_names)
+    num_nodes_source = len(graph_def.node)
+    graph_def = tf.graph_util.convert_variables_to_constants(tf.get_default_session(), graph_def, out_names)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=in_names + out_names)
+    graph_def = TransformGraph(graph_def, in_names, out_names, [
+        "strip_unused_nodes",
+        "remove_nodes(op=Identity, op=CheckNumerics)",
+        "fold_constants(ignore_errors=true)",
+        "fold_batch_norms",
+        "sort_by_execution_order"])
+
+    with open(pb_file, "wb") as f:
+        f.write(graph_def.SerializeToString())
+    meta = dict(
+        name=net.name,
+        build_func_name=net._build_func_name, # pylint: disable=protected-access
+        dynamic_kwargs={key: repr(value) for key, value in dynamic_kwargs.items()},
+        input_names=in_names,
+        input_shapes=[[None] + shape[1:] for shape in net.input_shapes],
+        output_names=out_names,
+        num_nodes_source=num_nodes_source,
+        num_nodes_frozen=len(graph_def.node))
+    with open(pb_file + ".json", "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+#----------------------------------------------------------------------------
+# Loading and running.
+
+class FrozenNetwork:
+    """Inference-only network loaded from a file written by export_frozen().
+    Uses its own tf.Graph and tf.Session, independent of the default session."""
+
+    def __init__(self, pb_file: str, config_dict: dict = None):
+        time_begin = time.time()
+        with open(pb_file + ".json") as f:
+            self.meta = json.load(f)
+        graph_def = tf.GraphDef()
+        with open(pb_file, "rb") as f:
+            graph_def.ParseFromString(f.read())
+
+        self.name = self.meta["name"]
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+            self.session = tfutil.create_session(config_dict)
+        self.input_shapes = self.meta["input_shapes"]
+        self.num_inputs = len(self.input_shapes)
+        self._in_expr = [self.graph.get_tensor_by_name(name + ":0") for name in self.meta["input_names"]]
+        self._out_expr = [self.graph.get_tensor_by_name(name + ":0") for name in self.meta["output_names"]]
+        self.load_sec = time.time() - time_begin
+
+    def close(self) -> None:
+        self.session.close()
+
+    def run(self, *in_arrays: np.ndarray, minibatch_size: int = None, print_progress: bool = False) -> Any:
+        """Run the frozen graph for the given NumPy arrays, in minibatches if requested.
+        Returns a single array or a tuple of arrays, like Network.run()."""
+        assert len(in_arrays) == self.num_inputs
+        assert not all(arr is None for arr in in_arrays)
+        num_items = in_arrays[0].shape[0]
+        if minibatch_size is None:
+            minibatch_size = num_items
+
+        out_arrays = None
+        for mb_begin in range(0, num_items, minibatch_size):
+            if print_progress:
+                print("\r%d / %d" % (mb_begin, num_items), end="")
+            mb_end = min(mb_begin + minibatch_size, num_items)
+            mb_num = mb_end - mb_begin
+            mb_in = [src[mb_begin : mb_end] if src is not None else np.zeros([mb_num] + shape[1:]) for src, shape in zip(in_arrays, self.input_shapes)]
+            mb_out = self.session.run(self._out_expr, dict(zip(self._in_expr, mb_in)))
+            if out_arrays is None:
+                out_arrays = [np.empty([num_items] + list(expr.shape[1:]), expr.dtype) for expr in mb_out]
+            for dst, src in zip(out_arrays, mb_out):
+                dst[mb_begin : mb_end] = src
+
+        if print_progress:
+            print("\r%d / %d" % (num_items, num_items))
+        return out_arrays[0] if len(out_arrays) == 1 else tuple(out_arrays)
+
+#----------------------------------------------------------------------------
@@ -9,8 +9,11 @@
 import types
 import inspect
 import re
-import uuid
 import sys
+import time
+import hashlib
+import queue
+import threading
 import numpy as np
 import tensorflow as tf
 
@@ -24,6 +27,11 @@ from .tfutil import TfExpression, TfExpressionEx
 
 _import_handlers = []  # Custom import handlers for dealing with legacy data in pickle import.
 _import_module_src = dict()  # Source code for temporary modules created during pickle import.
+_import_module_cache = dict()  # SHA-1 of module source => temporary module, shared by all networks imported with that source.
+_import_stats = util.EasyDict(networks=0, module_cache_hits=0, exec_sec=0.0, build_sec=0.0, set_vars_sec=0.0)  # Cumulative pickle import timing.
+run_cache_max_entries = None  # Max number of Network.run() graphs cached per network, None = unbounded. Eviction frees no graph memory.
+run_cache_warn_entries = 32  # Warn when an unbounded Network.run() cache reaches this many graphs, and again at every doubling.
+_RUN_CACHE_MAX_EVICTED_KEYS = 1024  # Evicted keys remembered per network for detecting rebuilds.
 
 
 def import_handler(handler_func):
@@ -32,6 +40,40 @@ def import_handler(handler_func):
     return handler_func
 
 
+def _get_import_module(module_src: str) -> types.ModuleType:
+    """Return the temporary module for the given build module source, exec'ing it only the first time it is seen."""
+    key = hashlib.sha1(module_src.encode("utf-8")).hexdigest()
+    module = _import_module_cache.get(key, None)
+    if module is not None:
+        _import_stats.module_cache_hits += 1
+        return module
+
+    module_name = "_tflib_network_import_" + key
+    module = types.ModuleType(module_name)
+    sys.modules[module_name] = module
+    _import_module_src[module] = module_src
+    exec(compile(module_src, module_name, "exec"), module.__dict__) # pylint: disable=exec-used
+    _import_module_cache[key] = module
+    return module
+
+
+def get_import_stats() -> dict:
+    """Cumulative timing breakdown of network pickle imports in this process: number of networks,
+    module cache hits, and seconds spent exec'ing build modules, building graphs and setting variables.
+    Assignments deferred by tfutil.batch_set_vars() are not included in set_vars_sec."""
+    return dict(_import_stats)
+
+
+def reset_import_stats() -> None:
+    for key in _import_stats:
+        _import_stats[key] = type(_import_stats[key])(0)
+
+
+def format_import_stats(stats: dict) -> str:
+    return "%d networks, %d module cache hits, exec %.2fs, graph build %.2fs, set vars %.2fs" % (
+        stats["networks"], stats["module_cache_hits"], stats["exec_sec"], stats["build_sec"], stats["set_vars_sec"])
+
+
 class Network:
     """Generic network abstraction.
 
@@ -120,7 +162,9 @@ class Network:
         self._build_func = None  # User-supplied build function that constructs the network.
         self._build_func_name = None  # Name of the build function.
         self._build_module_src = None  # Full source code of the module containing the build function.
-        self._run_cache = dict()  # Cached graph data for Network.run().
+        self._run_cache = OrderedDict()  # Cached graph data for Network.run(), in least recently used order.
+        self._run_cache_stats = util.EasyDict(hits=0, misses=0, evictions=0, rebuilds=0, graph_nodes_added=0)
+        self._run_cache_evicted = OrderedDict()  # Recently evicted key => number of times it was rebuilt since.
 
     def _init_graph(self) -> None:
         # Collect inputs.
@@ -255,6 +299,10 @@ class Network:
 
     def __getstate__(self) -> dict:
         """Pickle export."""
+        return self._get_state(tfutil.run(list(self.own_vars.values())))
+
+    def _get_state(self, var_values: List[np.ndarray]) -> dict:
+        """Pickle export with variable values fetched by the caller, see snapshot.capture_states()."""
         state = dict()
         state["version"]            = 4
         state["name"]               = self.name
@@ -262,7 +310,7 @@ class Network:
         state["components"]         = dict(self.components)
         state["build_module_src"]   = self._build_module_src
         state["build_func_name"]    = self._build_func_name
-        state["variables"]          = list(zip(self.own_vars.keys(), tfutil.run(list(self.own_vars.values()))))
+        state["variables"]          = list(zip(self.own_vars.keys(), var_values))
         return state
 
     def __setstate__(self, state: dict) -> None:
@@ -283,21 +331,26 @@ class Network:
         self._build_module_src = state["build_module_src"]
         self._build_func_name = state["build_func_name"]
 
-        # Create temporary module from the imported source code.
-        module_name = "_tflib_network_import_" + uuid.uuid4().hex
-        module = types.ModuleType(module_name)
-        sys.modules[module_name] = module
-        _import_module_src[module] = self._build_module_src
-        exec(self._build_module_src, module.__dict__) # pylint: disable=exec-used
-
-        # Locate network build function in the temporary module.
+        # Locate network build function in the temporary module created from the imported source code.
+        t0 = time.time()
+        module = _get_import_module(self._build_module_src)
         self._build_func = util.get_obj_from_module(module, self._build_func_name)
         assert callable(self._build_func)
 
         # Init TensorFlow graph.
+        t1 = time.time()
         self._init_graph()
-        self.reset_own_vars()
-        tfutil.set_vars({self.find_var(name): value for name, value in state["variables"]})
+        state_vars = dict(state["variables"])
+        uninitialized = [var for name, var in self.own_vars.items() if name not in state_vars]
+        if len(uninitialized) > 0:
+            tfutil.run([var.initializer for var in uninitialized])
+        t2 = time.time()
+        tfutil.set_vars({self.find_var(name): value for name, value in state_vars.items()})
+        t3 = time.time()
+        _import_stats.networks += 1
+        _import_stats.exec_sec += t1 - t0
+        _import_stats.build_sec += t2 - t1
+        _import_stats.set_vars_sec += t3 - t2
 
     def clone(self, name: str = None, **new_static_kwargs) -> "Network":
         """Create a clone of this network with its own copy of the variables."""
@@ -314,10 +367,28 @@ class Network:
         net.copy_vars_from(self)
         return net
 
+    def replica(self, name: str = None, **new_static_kwargs) -> "Network":
+        """Create a replica of this network that shares its variables and components.
+        Unlike clone(), no variables are created or copied: get_output_for() of the replica builds another
+        tower that reads the variables of this network, e.g. on another device. Ops that assign to variables
+        through the replica (such as re-initializing noise inputs) therefore affect this network as well.
+        new_static_kwargs must not change the set of variables created by the build function."""
+        # pylint: disable=protected-access
+        net = object.__new__(Network)
+        net._init_fields()
+        for field in ["scope", "components", "num_inputs", "num_outputs", "input_shapes", "output_shapes", "input_shape", "output_shape",
+                      "input_templates", "output_templates", "input_names", "output_names", "own_vars", "vars", "trainables",
+                      "var_global_to_local", "_build_func", "_build_func_name", "_build_module_src"]:
+            setattr(net, field, getattr(self, field))
+        net.name = name if name is not None else self.name
+        net.static_kwargs = util.EasyDict(self.static_kwargs)
+        net.static_kwargs.update(new_static_kwargs)
+        return net
+
     def copy_own_vars_from(self, src_net: "Network") -> None:
         """Copy the values of all variables from the given network, excluding sub-networks."""
         names = [name for name in self.own_vars.keys() if name in src_net.own_vars]
-        tfutil.set_vars(tfutil.run({self.vars[name]: src_net.vars[name] for name in names}))
+        tfutil.set_vars({self.vars[name]: src_net.vars[name] for name in names})
 
     def copy_vars_from(self, src_net: "Network") -> None:
         """Copy the values of all variables from the given network, including sub-networks."""
@@ -330,16 +401,16 @@ class Network:
                 list(src_net.vars.keys())[1].startswith(suspected_old_name):
             names = [name.replace(suspected_new_name, '') for name in self.vars.keys() if name.replace(suspected_new_name, suspected_old_name) in src_net.vars]
             # print('names:', names)
-            tfutil.set_vars(tfutil.run({self.vars[suspected_new_name+name] if name!='lod' else self.vars[name] : src_net.vars[suspected_old_name+name] if name!='lod' else src_net.vars[name] for name in names}))
+            tfutil.set_vars({self.vars[suspected_new_name+name] if name!='lod' else self.vars[name] : src_net.vars[suspected_old_name+name] if name!='lod' else src_net.vars[name] for name in names})
         else:
             names = [name for name in self.vars.keys() if name in src_net.vars]
             # print('names:', names)
-            tfutil.set_vars(tfutil.run({self.vars[name]: src_net.vars[name] for name in names}))
+            tfutil.set_vars({self.vars[name]: src_net.vars[name] for name in names})
 
     def copy_trainables_from(self, src_net: "Network") -> None:
         """Copy the values of all trainable variables from the given network, including sub-networks."""
         names = [name for name in self.trainables.keys() if name in src_net.trainables]
-        tfutil.set_vars(tfutil.run({self.vars[name]: src_net.vars[name] for name in names}))
+        tfutil.set_vars({self.vars[name]: src_net.vars[name] for name in names})
 
     def convert(self, new_func_name: str, new_name: str = None, **new_static_kwargs) -> "Network":
         """Create new network with the given parameters, and copy all variables from this network."""
@@ -353,16 +424,35 @@ class Network:
         net.copy_vars_from(self)
         return net
 
-    def setup_as_moving_average_of(self, src_net: "Network", beta: TfExpressionEx = 0.99, beta_nontrainable: TfExpressionEx = 0.0) -> tf.Operation:
+    def setup_as_moving_average_of(self, src_net: "Network", beta: TfExpressionEx = 0.99, beta_nontrainable: TfExpressionEx = 0.0,
+                                   stride: int = 1, fused: bool = False) -> tf.Operation:
         """Construct a TensorFlow op that updates the variables of this network
-        to be slightly closer to those of the given network."""
+        to be slightly closer to those of the given network.
+
+        With stride > 1 the op is meant to be run only every stride steps and
+        decays with beta**stride, which is exact while src_net stays constant
+        and close to per-step updates when it changes slowly. With fused=True
+        the variables are flattened into one vector per (trainable, dtype) group,
+        i.e. per beta and dtype, and interpolated with a single lerp instead of
+        one lerp per variable."""
+        assert stride >= 1
         with tfutil.absolute_name_scope(self.scope + "/_MovingAvg"):
-            ops = []
+            betas = [beta ** stride if stride > 1 else beta, beta_nontrainable ** stride if stride > 1 else beta_nontrainable]
+            groups = OrderedDict() # (is_trainable, dtype) => [(var, src_var), ...]
             for name, var in self.vars.items():
                 if name in src_net.vars:
-                    cur_beta = beta if name in self.trainables else beta_nontrainable
-                    new_value = tfutil.lerp(src_net.vars[name], var, cur_beta)
-                    ops.append(var.assign(new_value))
+                    groups.setdefault((name in self.trainables, var.dtype.base_dtype), []).append((var, src_net.vars[name]))
+
+            ops = []
+            for (is_trainable, _dtype), pairs in groups.items():
+                cur_beta = betas[0] if is_trainable else betas[1]
+                if not fused or len(pairs) == 1:
+                    ops += [var.assign(tfutil.lerp(src_var, var, cur_beta)) for var, src_var in pairs]
+                    continue
+                flat_src = tf.concat([tf.reshape(src_var, [-1]) for _var, src_var in pairs], axis=0)
+                flat_dst = tf.concat([tf.reshape(var, [-1]) for var, _src_var in pairs], axis=0)
+                new_values = tf.split(tfutil.lerp(flat_src, flat_dst, cur_beta), [var.shape.num_elements() for var, _src_var in pairs])
+                ops += [var.assign(tf.reshape(value, var.shape)) for (var, _src_var), value in zip(pairs, new_values)]
             return tf.group(*ops)
 
     def run(self,
@@ -374,6 +464,9 @@ class Network:
             minibatch_size: int = None,
             num_gpus: int = 1,
             assume_frozen: bool = False,
+            tower_mode: str = "clone",
+            pipeline_depth: int = 0,
+            static_shapes: bool = False,
             **dynamic_kwargs) -> Union[np.ndarray, Tuple[np.ndarray, ...], List[np.ndarray]]:
         """Run this network for the given NumPy array(s), and return the output(s) as NumPy array(s).
 
@@ -389,6 +482,13 @@ class Network:
             minibatch_size:     Maximum minibatch size to use, None = disable batching.
             num_gpus:           Number of GPUs to use.
             assume_frozen:      Improve multi-GPU performance by assuming that the trainable parameters will remain changed between calls.
+            tower_mode:         How assume_frozen builds the per-GPU towers: "clone" = give every tower its own copy of the variables on its
+                                device (see clone()), "replica" = share the variables of this network (see replica()).
+            pipeline_depth:     Number of minibatches to stage ahead / drain behind in background threads, 0 = run synchronously.
+                                Overlaps input preparation and output copy-out with session execution when there are several minibatches.
+            static_shapes:      Build the graph with fully static input shapes and pad every minibatch to minibatch_size, stripping the
+                                padding from the outputs. Enables shape-specialized kernels and constant folding. Only valid for networks
+                                that process each item independently (no minibatch statistics).
             dynamic_kwargs:     Additional keyword arguments to be passed into the network build function.
         """
         assert len(in_arrays) == self.num_inputs
@@ -399,9 +499,19 @@ class Network:
         num_items = in_arrays[0].shape[0]
         if minibatch_size is None:
             minibatch_size = num_items
+        in_shapes = [None] * self.num_inputs
+        if static_shapes:
+            assert minibatch_size % num_gpus == 0
+            in_shapes = [[minibatch_size] + list(src.shape[1:] if src is not None else shape[1:]) for src, shape in zip(in_arrays, self.input_shapes)]
+            assert all(dim is not None for shape in in_shapes for dim in shape)
 
         # Construct unique hash key from all arguments that affect the TensorFlow graph.
         key = dict(input_transform=input_transform, output_transform=output_transform, num_gpus=num_gpus, assume_frozen=assume_frozen, dynamic_kwargs=dynamic_kwargs)
+        if assume_frozen:
+            assert tower_mode in ["replica", "clone"]
+            key["tower_mode"] = tower_mode
+        if static_shapes:
+            key["static_shapes"] = in_shapes
         def unwind_key(obj):
             if isinstance(obj, dict):
                 return [(key, unwind_key(value)) for key, value in sorted(obj.items())]
@@ -411,16 +521,22 @@ class Network:
         key = repr(unwind_key(key))
 
         # Build graph.
-        if key not in self._run_cache:
+        if key in self._run_cache:
+            self._run_cache.move_to_end(key)
+            self._run_cache_stats.hits += 1
+        else:
+            self._run_cache_stats.misses += 1
+            self._note_run_cache_rebuild(key)
+            num_ops_before = len(tf.get_default_graph().get_operations())
             with tfutil.absolute_name_scope(self.scope + "/_Run"), tf.control_dependencies(None):
                 with tf.device("/cpu:0"):
-                    in_expr = [tf.placeholder(tf.float32, name=name) for name in self.input_names]
+                    in_expr = [tf.placeholder(tf.float32, shape=shape, name=name) for name, shape in zip(self.input_names, in_shapes)]
                     in_split = list(zip(*[tf.split(x, num_gpus) for x in in_expr]))
 
                 out_split = []
                 for gpu in range(num_gpus):
                     with tf.device("/gpu:%d" % gpu):
-                        net_gpu = self.clone() if assume_frozen else self
+                        net_gpu = (self.clone() if tower_mode == "clone" else self.replica()) if assume_frozen else self
                         in_gpu = in_split[gpu]
 
                         if input_transform is not None:
@@ -442,22 +558,48 @@ class Network:
                 with tf.device("/cpu:0"):
                     out_expr = [tf.concat(outputs, axis=0) for outputs in zip(*out_split)]
                     self._run_cache[key] = in_expr, out_expr
+            self._run_cache_stats.graph_nodes_added += len(tf.get_default_graph().get_operations()) - num_ops_before
+            while run_cache_max_entries is not None and len(self._run_cache) > max(run_cache_max_entries, 1):
+                evicted_key, _ = self._run_cache.popitem(last=False)
+                self._run_cache_evicted[evicted_key] = self._run_cache_evicted.pop(evicted_key, 0)
+                while len(self._run_cache_evicted) > _RUN_CACHE_MAX_EVICTED_KEYS:
+                    self._run_cache_evicted.popitem(last=False)
+                self._run_cache_stats.evictions += 1
+            num_entries = len(self._run_cache)
+            if run_cache_max_entries is None and run_cache_warn_entries is not None and num_entries >= run_cache_warn_entries and num_entries % run_cache_warn_entries == 0 \
+                    and (num_entries // run_cache_warn_entries) & (num_entries // run_cache_warn_entries - 1) == 0:
+                print("Warning: %s.run() has built %d distinct graphs; each new combination of run() arguments grows the TensorFlow graph. "
+                    "Consider reusing run() arguments. Key: %s" % (self.name, num_entries, key))
 
         # Run minibatches.
         in_expr, out_expr = self._run_cache[key]
         out_arrays = [np.empty([num_items] + expr.shape.as_list()[1:], expr.dtype.name) for expr in out_expr]
 
-        for mb_begin in range(0, num_items, minibatch_size):
-            if print_progress:
-                print("\r%d / %d" % (mb_begin, num_items), end="")
-
-            mb_end = min(mb_begin + minibatch_size, num_items)
+        def make_feed(mb_begin, mb_end):
             mb_num = mb_end - mb_begin
             mb_in = [src[mb_begin : mb_end] if src is not None else np.zeros([mb_num] + shape[1:]) for src, shape in zip(in_arrays, self.input_shapes)]
-            mb_out = tf.get_default_session().run(out_expr, dict(zip(in_expr, mb_in)))
+            if static_shapes and mb_num < minibatch_size: # pad the ragged last minibatch by repeating its last item
+                mb_in = [np.concatenate([x, np.repeat(x[-1:], minibatch_size - mb_num, axis=0)]) for x in mb_in]
+            return dict(zip(in_expr, mb_in))
 
+        def copy_out(mb_begin, mb_end, mb_out):
             for dst, src in zip(out_arrays, mb_out):
-                dst[mb_begin: mb_end] = src
+                dst[mb_begin: mb_end] = src[:mb_end - mb_begin]
+
+        def report_progress(mb_begin):
+            if print_progress:
+                print("\r%d / %d" % (mb_begin, num_items), end="")
+
+        mb_ranges = [(mb_begin, min(mb_begin + minibatch_size, num_items)) for mb_begin in range(0, num_items, minibatch_size)]
+        if pipeline_depth > 0 and len(mb_ranges) > 1:
+            def make_feed_f32(mb_begin, mb_end): # convert in the staging thread rather than inside session.run()
+                return {expr: np.ascontiguousarray(arr, dtype=np.float32) for expr, arr in make_feed(mb_begin, mb_end).items()}
+            _run_pipelined(out_expr, mb_ranges, make_feed_f32, copy_out, report_progress, pipeline_depth)
+        else:
+            for mb_begin, mb_end in mb_ranges:
+                report_progress(mb_begin)
+                mb_out = tf.get_default_session().run(out_expr, make_feed(mb_begin, mb_end))
+                copy_out(mb_begin, mb_end, mb_out)
 
         # Done.
         if print_progress:
@@ -467,6 +609,23 @@ class Network:
             out_arrays = out_arrays[0] if len(out_arrays) == 1 else tuple(out_arrays)
         return out_arrays
 
+    def get_run_cache_stats(self) -> dict:
+        """Statistics of the Network.run() graph cache: number of cached graphs, hits, misses, evictions,
+        rebuilds of previously evicted keys, and the number of graph nodes added by cache misses.
+        TensorFlow graphs are append-only, so nodes of evicted entries stay in the graph until it is reset."""
+        return dict(self._run_cache_stats, entries=len(self._run_cache))
+
+    def _note_run_cache_rebuild(self, key: str) -> None:
+        if key not in self._run_cache_evicted:
+            return
+        self._run_cache_stats.rebuilds += 1
+        self._run_cache_evicted[key] += 1
+        num_rebuilds = self._run_cache_evicted[key]
+        if num_rebuilds & (num_rebuilds - 1) == 0: # warn on the 1st, 2nd, 4th, 8th, ... rebuild
+            print("Warning: %s.run() rebuilt an evicted graph %d times (%d cached, max %s); each rebuild grows the TensorFlow graph. "
+                "Consider raising tflib.network.run_cache_max_entries or reusing run() arguments. Key: %s"
+                % (self.name, num_rebuilds, len(self._run_cache), run_cache_max_entries, key))
+
     def list_ops(self) -> List[TfExpression]:
         include_prefix = self.scope + "/"
         exclude_prefix = include_prefix + "_"
@@ -563,6 +722,79 @@ class Network:
 
                 tf.summary.histogram(name, var)
 
+#----------------------------------------------------------------------------
+# Pipelined minibatch execution for Network.run().
+
+def _run_pipelined(fetches, mb_ranges, make_feed, copy_out, report_progress, depth):
+    """Run fetches for each minibatch range in the default session, with feed preparation and output
+    copy-out in background threads connected by queues of the given depth. Session calls stay on the
+    calling thread, since the default session is thread-local."""
+    sess = tf.get_default_session()
+    feed_queue = queue.Queue(depth)
+    out_queue = queue.Queue(depth)
+    stop = threading.Event()
+    errors = []
+
+    def put(q, item): # => False if the pipeline was stopped
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(q): # => None if the pipeline was stopped
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def stage_feeds():
+        try:
+            for mb_range in mb_ranges:
+                if not put(feed_queue, (mb_range, make_feed(*mb_range))):
+                    return
+        except BaseException as e: # pylint: disable=broad-except
+            errors.append(e)
+        put(feed_queue, None)
+
+    def drain_outputs():
+        try:
+            while True:
+                item = get(out_queue)
+                if item is None:
+                    return
+                copy_out(*item)
+        except BaseException as e: # pylint: disable=broad-except
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=stage_feeds, daemon=True), threading.Thread(target=drain_outputs, daemon=True)]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = get(feed_queue)
+            if item is None:
+                break
+            (mb_begin, mb_end), feed = item
+            report_progress(mb_begin)
+            mb_out = sess.run(fetches, feed)
+            if not put(out_queue, (mb_begin, mb_end, mb_out)):
+                break
+    except:
+        stop.set()
+        raise
+    finally:
+        put(out_queue, None)
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
 #----------------------------------------------------------------------------
 # Backwards-compatible emulation of legacy output transformation in Network.run().
 
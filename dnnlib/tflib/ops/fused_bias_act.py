@@ -65,6 +65,8 @@ def fused_bias_act(x, b=None, axis=1, act='linear', alpha=None, gain=None, impl=
         'ref':  _fused_bias_act_ref,
         'cuda': _fused_bias_act_cuda,
     }
+    if custom_ops.force_ref_impl:
+        impl = 'ref'
     return impl_dict[impl](x=x, b=b, axis=axis, act=act, alpha=alpha, gain=gain)
 
 #----------------------------------------------------------------------------
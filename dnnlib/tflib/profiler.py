@@ -0,0 +1,161 @@
+# Copyright (c) 2019, NVIDIA Corporation. All rights reserved.
+#
+# This work is made available under the Nvidia Source Code License-NC.
+# To view a copy of this license, visit
+# https://nvlabs.github.io/stylegan2/license.html
+
+"""Per-layer FLOPs, parameter and activation-memory profile of a Network.
+
+Layers are the ones reported by Network.list_layers(). The network is
+instantiated for a concrete minibatch size, every op of that instance is
+assigned to the innermost layer whose scope contains it, and FLOPs are taken
+from TensorFlow's registered op statistics, falling back to one FLOP per
+output element for ops without a registered estimate (e.g. custom CUDA ops).
+Optionally, per-layer execution time is measured from RunMetadata step stats."""
+
+import json
+import numpy as np
+import tensorflow as tf
+
+from typing import List
+
+from tensorflow.python.framework import ops as tf_ops # pylint: disable=no-name-in-module
+
+from . import tfutil
+from .. import util
+
+# Ops that only move or reinterpret data and are not counted as compute.
+_FREE_OP_TYPES = {"Const", "Identity", "Placeholder", "Reshape", "Shape", "Squeeze", "ExpandDims", "StridedSlice", "Pack", "Unpack",
+                  "ReadVariableOp", "VariableV2", "VarHandleOp", "NoOp", "StopGradient", "Fill", "ZerosLike", "OnesLike", "Range", "Cast"}
+
+_OTHER_LAYER = "(other)"
+
+#----------------------------------------------------------------------------
+
+def _num_elements(tensor: tf.Tensor) -> int:
+    shape = tensor.shape
+    if shape.ndims is None or not shape.is_fully_defined():
+        return 0
+    return int(np.prod(shape.as_list(), dtype=np.int64))
+
+def _tensor_bytes(tensor: tf.Tensor) -> int:
+    return _num_elements(tensor) * tensor.dtype.size
+
+def estimate_op_flops(op: tf.Operation) -> int:
+    """FLOPs of a single op with fully defined shapes."""
+    if op.type in _FREE_OP_TYPES or op.type.startswith("Variable"):
+        return 0
+    try:
+        stats = tf_ops.get_stats_for_node_def(op.graph, op.node_def, "flops")
+        if stats.value is not None:
+            return int(stats.value)
+    except (ValueError, LookupError):
+        pass
+    return sum(_num_elements(out) for out in op.outputs)
+
+def _assign_layer(op_name: str, layer_names: List[str]) -> str:
+    # layer_names are sorted by decreasing length, so the innermost layer wins.
+    for name in layer_names:
+        if op_name == name or op_name.startswith(name + "/"):
+            return name
+    return _OTHER_LAYER
+
+#----------------------------------------------------------------------------
+
+def profile_layers(net, minibatch_size: int = 1, num_timing_runs: int = 0, **dynamic_kwargs) -> List[dict]:
+    """Return one dict per layer with flops, param_bytes, activation_bytes, output_bytes and, if
+    num_timing_runs > 0, the average measured time_ms. activation_bytes is the total size of all
+    tensors produced inside the layer, i.e. what a training step keeps alive for backprop."""
+    layers = net.list_layers()
+    rows = {name: util.EasyDict(layer=name, num_params=0, param_bytes=0, flops=0, activation_bytes=0, output_bytes=0, output_shape=None, num_ops=0, time_ms=None)
+            for name, _output, _trainables in layers}
+    rows[_OTHER_LAYER] = util.EasyDict(layer=_OTHER_LAYER, num_params=0, param_bytes=0, flops=0, activation_bytes=0, output_bytes=0, output_shape=None, num_ops=0, time_ms=None)
+    for name, _output, trainables in layers:
+        rows[name].num_params = sum(int(np.prod(var.shape.as_list())) for var in trainables)
+        rows[name].param_bytes = sum(int(np.prod(var.shape.as_list())) * var.dtype.size for var in trainables)
+
+    # Instantiate the network for the given minibatch size in a separate name scope.
+    graph = tf.get_default_graph()
+    num_ops_before = len(graph.get_operations())
+    profile_scope = graph.unique_name(net.scope + "/_Profile")
+    with tfutil.absolute_name_scope(profile_scope), tf.control_dependencies(None):
+        in_expr = [tf.placeholder(tf.float32, shape=[minibatch_size] + shape[1:], name=name) for name, shape in zip(net.input_names, net.input_shapes)]
+        out_expr = net.get_output_for(*in_expr, return_as_list=True, **dynamic_kwargs)
+    profile_ops = graph.get_operations()[num_ops_before:]
+    op_prefix = profile_scope + "/" + net.name + "/"
+
+    layer_names = sorted(rows.keys(), key=len, reverse=True)
+    op_layers = dict()
+    for op in profile_ops:
+        if not op.name.startswith(op_prefix):
+            continue
+        row = rows[_assign_layer(op.name[len(op_prefix):], layer_names)]
+        op_layers[op.name] = row
+        row.num_ops += 1
+        row.flops += estimate_op_flops(op)
+        if op.type not in _FREE_OP_TYPES:
+            row.activation_bytes += sum(_tensor_bytes(out) for out in op.outputs)
+        if op.outputs:
+            row.output_bytes = _tensor_bytes(op.outputs[0])
+            row.output_shape = op.outputs[0].shape.as_list() if op.outputs[0].shape.ndims is not None else None
+
+    # Measure per-layer execution time from step stats.
+    if num_timing_runs > 0:
+        rnd = np.random.RandomState(123)
+        feed_dict = {expr: rnd.randn(*expr.shape.as_list()).astype(np.float32) for expr in in_expr}
+        tfutil.run(out_expr, feed_dict) # warm up
+        run_options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        micros = dict()
+        for _run in range(num_timing_runs):
+            run_metadata = tf.RunMetadata()
+            tfutil.run(out_expr, feed_dict, options=run_options, run_metadata=run_metadata)
+            for dev_stats in run_metadata.step_stats.dev_stats:
+                if "/stream:" in dev_stats.device and not dev_stats.device.endswith("/stream:all"):
+                    continue # per-stream GPU stats duplicate stream:all
+                if "GPU" in dev_stats.device and "/stream:" not in dev_stats.device:
+                    continue # kernel launch times; kernel durations are in stream:all
+                for node_stats in dev_stats.node_stats:
+                    node_name = node_stats.node_name.split(":")[0]
+                    if node_name in op_layers:
+                        row = op_layers[node_name]
+                        micros[row.layer] = micros.get(row.layer, 0) + node_stats.all_end_rel_micros
+        for row in rows.values():
+            row.time_ms = micros.get(row.layer, 0) / num_timing_runs / 1000.0
+
+    return [rows[name] for name, _output, _trainables in layers] + ([rows[_OTHER_LAYER]] if rows[_OTHER_LAYER].num_ops > 0 else [])
+
+#----------------------------------------------------------------------------
+
+def _format_count(value: float) -> str:
+    for unit, scale in [("G", 1e9), ("M", 1e6), ("k", 1e3)]:
+        if value >= scale:
+            return "%.2f%s" % (value / scale, unit)
+    return "%d" % value
+
+def print_profile(profile: List[dict], title: str = None) -> None:
+    """Print a summary table of profile_layers() in the style of Network.print_layers()."""
+    has_time = any(row.time_ms is not None for row in profile)
+    total_flops = max(sum(row.flops for row in profile), 1)
+    rows = [[title if title is not None else "Layer", "Params", "ParamMB", "FLOPs", "FLOPs%", "ActMB", "OutputShape"] + (["ms"] if has_time else [])]
+    rows += [["---"] * len(rows[0])]
+    for row in profile:
+        rows += [[row.layer, _format_count(row.num_params) if row.num_params > 0 else "-", "%.2f" % (row.param_bytes / 2**20), _format_count(row.flops),
+                  "%.1f" % (100.0 * row.flops / total_flops), "%.2f" % (row.activation_bytes / 2**20), str(row.output_shape)] +
+                 (["%.3f" % row.time_ms] if has_time else [])]
+    rows += [["---"] * len(rows[0])]
+    rows += [["Total", _format_count(sum(row.num_params for row in profile)), "%.2f" % (sum(row.param_bytes for row in profile) / 2**20),
+              _format_count(sum(row.flops for row in profile)), "100.0", "%.2f" % (sum(row.activation_bytes for row in profile) / 2**20), ""] +
+             (["%.3f" % sum(row.time_ms for row in profile)] if has_time else [])]
+
+    widths = [max(len(cell) for cell in column) for column in zip(*rows)]
+    print()
+    for row in rows:
+        print("  ".join(cell + " " * (width - len(cell)) for cell, width in zip(row, widths)))
+    print()
+
+def save_profile_json(profile: List[dict], filename: str, **meta) -> None:
+    """Write profile_layers() output, plus optional metadata such as the network name, as JSON."""
+    with open(filename, "w") as f:
+        json.dump(dict(meta, layers=[dict(row) for row in profile]), f, indent=2)
+
+#----------------------------------------------------------------------------
@@ -0,0 +1,239 @@
+# Copyright (c) 2019, NVIDIA Corporation. All rights reserved.
+#
+# This work is made available under the Nvidia Source Code License-NC.
+# To view a copy of this license, visit
+# https://nvlabs.github.io/stylegan2/license.html
+
+"""Split network snapshots: per-network graph specs plus one memory-mapped weight blob.
+
+File layout:
+    b'TFLIBSNP'         magic
+    uint64              byte size of the JSON index
+    JSON index          version, network names and spec locations, weight blob location
+    spec pickles        one per network, variables replaced by references into the blob
+    weight blob         raw C-order arrays, each aligned to WEIGHT_ALIGN bytes
+
+Loading a network only reads its spec; its weights are fed to tfutil.set_vars()
+directly from np.memmap views, so networks that are not requested are never read."""
+
+import copyreg
+import io
+import json
+import os
+import pickle
+import struct
+import numpy as np
+
+from . import network
+from . import tfutil
+
+SNAPSHOT_MAGIC = b'TFLIBSNP'
+SNAPSHOT_VERSION = 1
+WEIGHT_ALIGN = 64
+
+#----------------------------------------------------------------------------
+# Writing.
+
+def _align(offset):
+    return (offset + WEIGHT_ALIGN - 1) // WEIGHT_ALIGN * WEIGHT_ALIGN
+
+class _WeightBlob:
+    def __init__(self):
+        self.arrays = [] # [(offset, array), ...]
+        self.size = 0
+
+    def add(self, value):
+        value = np.asarray(value, order='C') # ascontiguousarray() would promote scalars to 1-D
+        offset = _align(self.size)
+        self.arrays.append((offset, value))
+        self.size = offset + value.nbytes
+        return _WeightRef(offset, value.dtype.str, value.shape)
+
+    def write(self, file):
+        pos = 0
+        for offset, value in self.arrays:
+            file.write(b'\0' * (offset - pos))
+            file.write(value.tobytes())
+            pos = offset + value.nbytes
+
+class _WeightRef:
+    def __init__(self, offset, dtype, shape):
+        self.pid = ('weights', int(offset), dtype, [int(dim) for dim in shape])
+
+def capture_states(obj):
+    """Return {id(net): state} for every network in obj and its components, fetching all variables in one session call."""
+    nets = []
+    def visit(x):
+        if isinstance(x, (tuple, list)):
+            for item in x:
+                visit(item)
+        elif isinstance(x, network.Network) and all(net is not x for net in nets):
+            nets.append(x)
+            for comp in x.components.values():
+                visit(comp)
+    visit(obj)
+    values = tfutil.run([list(net.own_vars.values()) for net in nets])
+    return {id(net): net._get_state(var_values) for net, var_values in zip(nets, values)} # pylint: disable=protected-access
+
+def restore_networks(obj, states):
+    """Instantiate the networks in obj in the current default graph from capture_states(), like pickling
+    obj and loading it again but without the serialization round trip. Shared components are restored once."""
+    restored = dict()
+    def restore(x):
+        if isinstance(x, (tuple, list)):
+            return type(x)(restore(item) for item in x)
+        if isinstance(x, network.Network):
+            if id(x) not in restored:
+                state = dict(states[id(x)])
+                state['components'] = {name: restore(comp) for name, comp in state['components'].items()}
+                net = object.__new__(type(x))
+                net.__setstate__(state)
+                restored[id(x)] = net
+            return restored[id(x)]
+        return x
+    with tfutil.batch_set_vars():
+        return restore(obj)
+
+class NetworkPickler(pickle.Pickler):
+    """Pickler that takes network states from capture_states() instead of reading variables from the session.
+    The output is identical to pickle.dump() and can be written without a default session, e.g. on another thread."""
+    def __init__(self, file, states):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.states = states
+        self.dispatch_table = copyreg.dispatch_table.copy()
+        self.dispatch_table[network.Network] = self._reduce_network
+
+    def _get_state(self, net):
+        return self.states[id(net)]
+
+    def _reduce_network(self, net):
+        return copyreg.__newobj__, (type(net),), self._get_state(net)
+
+class _SpecPickler(NetworkPickler):
+    def __init__(self, file, states, blob):
+        super().__init__(file, states)
+        self.blob = blob
+
+    def _get_state(self, net):
+        state = dict(super()._get_state(net))
+        state['variables'] = [(name, self.blob.add(value)) for name, value in state['variables']]
+        return state
+
+    def persistent_id(self, obj):
+        return obj.pid if isinstance(obj, _WeightRef) else None
+
+def save_networks(networks, path):
+    """Save a network or a tuple of networks in the split snapshot format."""
+    is_tuple = isinstance(networks, (tuple, list))
+    networks = list(networks) if is_tuple else [networks]
+    assert all(isinstance(net, network.Network) for net in networks)
+
+    states = capture_states(networks)
+    blob = _WeightBlob()
+    specs = []
+    for net in networks:
+        with io.BytesIO() as f:
+            _SpecPickler(f, states, blob).dump(net)
+            specs.append(f.getvalue())
+
+    entries = []
+    spec_offset = 0
+    for net, spec in zip(networks, specs):
+        entries.append(dict(name=net.name, spec_offset=spec_offset, spec_size=len(spec)))
+        spec_offset += len(spec)
+    index = dict(version=SNAPSHOT_VERSION, is_tuple=is_tuple, networks=entries, weights_offset=_align(spec_offset), weights_size=blob.size)
+    index_bytes = json.dumps(index).encode('utf-8')
+    header_size = len(SNAPSHOT_MAGIC) + 8 + len(index_bytes)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack('<Q', len(index_bytes)))
+        f.write(index_bytes)
+        f.write(b'\0' * (_align(header_size) - header_size))
+        for spec in specs:
+            f.write(spec)
+        f.write(b'\0' * (index['weights_offset'] - spec_offset))
+        blob.write(f)
+    os.replace(tmp_path, path)
+
+#----------------------------------------------------------------------------
+# Reading.
+
+class _SpecUnpickler(pickle.Unpickler):
+    def __init__(self, file, weights):
+        super().__init__(file, encoding='latin1')
+        self.weights = weights
+
+    def persistent_load(self, pid):
+        tag, offset, dtype, shape = pid
+        assert tag == 'weights'
+        dtype = np.dtype(dtype)
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        return self.weights[offset : offset + nbytes].view(dtype).reshape(shape)
+
+def is_snapshot_file(path):
+    """Return True if path is a local file in the split snapshot format."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+def read_index(path):
+    """Return (index, data_offset) of a snapshot; spec and weight offsets in the index are relative to data_offset."""
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise IOError('Not a network snapshot: %s' % path)
+        index_size, = struct.unpack('<Q', f.read(8))
+        index = json.loads(f.read(index_size).decode('utf-8'))
+    if index['version'] > SNAPSHOT_VERSION:
+        raise IOError('Unsupported network snapshot version %d: %s' % (index['version'], path))
+    return index, _align(len(SNAPSHOT_MAGIC) + 8 + index_size)
+
+def select_entries(entries, only):
+    """Resolve network names or tuple positions to entries of a snapshot index, keeping the order of only."""
+    selected = []
+    for key in only:
+        if isinstance(key, int):
+            selected.append(entries[key])
+            continue
+        matches = [entry for entry in entries if entry['name'] == key]
+        if len(matches) == 0:
+            raise KeyError('Network "%s" not found; available: %s' % (key, ', '.join(entry['name'] for entry in entries)))
+        selected.append(matches[0])
+    return selected
+
+def load_networks(path, only=None):
+    """Load networks from a split snapshot.
+
+    only=None returns the saved object (a network or a tuple). Otherwise only
+    is a list of network names or tuple positions and a tuple of the selected
+    networks is returned in that order; a single name returns the network itself."""
+    index, data_offset = read_index(path)
+    entries = index['networks']
+    if only is not None:
+        entries = select_entries(entries, [only] if isinstance(only, (str, int)) else only)
+
+    weights = None
+    if index['weights_size'] > 0:
+        weights = np.memmap(path, dtype=np.uint8, mode='r', offset=data_offset + index['weights_offset'], shape=(index['weights_size'],))
+
+    networks = []
+    with open(path, 'rb') as f, tfutil.batch_set_vars():
+        for entry in entries:
+            f.seek(data_offset + entry['spec_offset'])
+            with io.BytesIO(f.read(entry['spec_size'])) as spec:
+                networks.append(_SpecUnpickler(spec, weights).load())
+
+    if only is None:
+        return tuple(networks) if index['is_tuple'] else networks[0]
+    return networks[0] if isinstance(only, (str, int)) else tuple(networks)
+
+def convert_pkl(src, dst):
+    """Convert a network pickle into the split snapshot format."""
+    with open(src, 'rb') as f:
+        networks = pickle.load(f, encoding='latin1')
+    save_networks(networks, dst)
+    return networks
+
+#----------------------------------------------------------------------------
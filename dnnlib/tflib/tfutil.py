@@ -7,6 +7,8 @@
 """Miscellaneous helper utils for Tensorflow."""
 
 import os
+import contextlib
+import weakref
 import numpy as np
 import tensorflow as tf
 
@@ -191,32 +193,94 @@ def init_uninitialized_vars(target_vars: List[tf.Variable] = None) -> None:
     run([var.initializer for var in init_vars])
 
 
+_assign_ops = weakref.WeakKeyDictionary()  # tf.Graph => {(dst_var_name, src_var_name or None): assign op}
+_pending_assigns = None  # dst_var_name => (assign op, feed value or None, src_var_name or None) while inside batch_set_vars().
+
+
+def _get_assign_op(var: tf.Variable, src_var: tf.Variable = None) -> tf.Tensor:
+    """Return the persistent op that assigns to var from a feedable placeholder (src_var=None) or from src_var."""
+    graph = tf.get_default_graph()
+    graph_ops = _assign_ops.setdefault(graph, dict())
+    key = (var.name, None if src_var is None else src_var.name)
+    op = graph_ops.get(key, None)
+    if op is None:
+        if src_var is None:
+            try:
+                op = graph.get_tensor_by_name(var.name.replace(":0", "/setter:0"))  # look for existing op
+            except KeyError:
+                with absolute_name_scope(var.name.split(":")[0]):
+                    with tf.control_dependencies(None):  # ignore surrounding control_dependencies
+                        op = tf.assign(var, tf.placeholder(var.dtype, var.shape, "new_value"), name="setter")  # create new setter
+        else:
+            with absolute_name_scope(var.name.split(":")[0]):
+                with tf.control_dependencies(None):
+                    op = tf.assign(var, src_var, name="copier")
+        graph_ops[key] = op
+    return op
+
+
 def set_vars(var_to_value_dict: dict) -> None:
     """Set the values of given tf.Variables.
 
     Equivalent to the following, but more efficient and does not bloat the tf graph:
     tflib.run([tf.assign(var, value) for var, value in var_to_value_dict.items()]
+
+    Values can be NumPy arrays or other tf.Variables; the latter are copied on the device without a
+    round trip through NumPy. Assign ops are created once per variable (pair) and cached. Inside
+    batch_set_vars(), the assignments are deferred and merged with all others into one session call.
     """
     assert_tf_initialized()
-    ops = []
-    feed_dict = {}
+    assigns = dict()
 
     for var, value in var_to_value_dict.items():
         assert is_tf_expression(var)
+        if isinstance(value, tf.Variable):
+            assigns[var.name] = (_get_assign_op(var, value), None, value.name)
+        else:
+            assigns[var.name] = (_get_assign_op(var), value, None)
+
+    if _pending_assigns is not None:
+        # Assigns in one session call are unordered, so flush first if this call would race with a pending one:
+        # a copy from a variable that is still pending, or a write to a variable that a pending copy reads.
+        src_names = [src_name for _op, _value, src_name in assigns.values() if src_name is not None]
+        pending_src_names = set(src_name for _op, _value, src_name in _pending_assigns.values() if src_name is not None)
+        if any(name in _pending_assigns for name in src_names) or any(name in pending_src_names for name in assigns):
+            _run_assigns(_pending_assigns)
+            _pending_assigns.clear()
+        _pending_assigns.update(assigns)
+        return
+    _run_assigns(assigns)
 
-        try:
-            setter = tf.get_default_graph().get_tensor_by_name(var.name.replace(":0", "/setter:0"))  # look for existing op
-        except KeyError:
-            with absolute_name_scope(var.name.split(":")[0]):
-                with tf.control_dependencies(None):  # ignore surrounding control_dependencies
-                    setter = tf.assign(var, tf.placeholder(var.dtype, var.shape, "new_value"), name="setter")  # create new setter
-
-        ops.append(setter)
-        feed_dict[setter.op.inputs[1]] = value
 
+def _run_assigns(assigns: dict) -> None:
+    if len(assigns) == 0:
+        return
+    ops = [op for op, _value, _src_name in assigns.values()]
+    feed_dict = {op.op.inputs[1]: value for op, value, _src_name in assigns.values() if value is not None}
     run(ops, feed_dict)
 
 
+@contextlib.contextmanager
+def batch_set_vars():
+    """Defer all set_vars() calls in the block, including the ones made by Network.__setstate__()
+    and Network.copy_vars_from(), and execute them in a single session call on exit. Variables
+    set inside the block must not be read before it ends. Copies between variables keep their
+    order relative to other set_vars() calls in the block, at the cost of an extra session call
+    where they would otherwise race. Nested blocks join the outermost one."""
+    global _pending_assigns
+    if _pending_assigns is not None:
+        yield
+        return
+    _pending_assigns = dict()
+    try:
+        yield
+        assigns = _pending_assigns
+        _pending_assigns = None
+        _run_assigns(assigns)
+    finally:
+        _pending_assigns = None
+
+
 def create_var_with_large_initial_value(initial_value: np.ndarray, *args, **kwargs):
     """Create tf.Variable with large initial value without bloating the tf graph."""
     assert_tf_initialized()
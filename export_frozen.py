@@ -0,0 +1,66 @@
+#!/usr/bin/python
+#-*- coding: utf-8 -*-
+
+# >.>.>.>.>.>.>.>.>.>.>.>.>.>.>.>.
+# Licensed under the Apache License, Version 2.0 (the "License")
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# --- File Name: export_frozen.py
+# .<.<.<.<.<.<.<.<.<.<.<.<.<.<.<.<
+"""
+Export generator networks (e.g. Gs of VC2, G of VAEs) as frozen,
+constant-folded inference graphs. Load them with tflib.frozen.FrozenNetwork.
+"""
+
+import argparse
+import os
+
+import dnnlib.tflib as tflib
+from training import misc
+from run_benchmark import _run_kwargs
+
+
+def export(network_pkl, nets, out_dir, return_atts, uint8):
+    tflib.init_tf()
+    print('Loading networks from "%s"...' % network_pkl)
+    networks = misc.load_pkl(network_pkl, only=nets)
+    os.makedirs(out_dir, exist_ok=True)
+    for net in networks:
+        kwargs = _run_kwargs(net)
+        if return_atts:
+            kwargs['return_atts'] = True
+        if uint8:
+            kwargs['output_transform'] = dict(func=tflib.convert_images_to_uint8, nchw_to_nhwc=True)
+        pb_file = os.path.join(out_dir, '%s-%s-frozen.pb' % (os.path.splitext(os.path.basename(network_pkl))[0], net.name))
+        meta = tflib.frozen.export_frozen(net, pb_file, num_outputs=None if return_atts else 1, **kwargs)
+        print('%s -> %s (%d -> %d nodes)' % (net.name, pb_file, meta['num_nodes_source'], meta['num_nodes_frozen']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export networks as frozen inference graphs.')
+    parser.add_argument('--network',
+                        help='Network pickle or split snapshot.',
+                        dest='network_pkl',
+                        type=str,
+                        required=True)
+    parser.add_argument('--nets',
+                        help='Comma-separated network names to export.',
+                        type=lambda x: x.split(','),
+                        default='Gs')
+    parser.add_argument('--out_dir',
+                        help='Output directory.',
+                        type=str,
+                        default='frozen')
+    parser.add_argument('--return_atts',
+                        help='Also export attention maps (VC2 generators).',
+                        action='store_true')
+    parser.add_argument('--uint8',
+                        help='Bake conversion to uint8 NHWC images into the graph.',
+                        action='store_true')
+    args = parser.parse_args()
+    export(**vars(args))
+
+
+if __name__ == "__main__":
+    main()
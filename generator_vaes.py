@@ -91,6 +91,7 @@ def generate_grids(network,
     G_kwargs.is_validation = True
     G_kwargs.randomize_noise = True
     G_kwargs.minibatch_size=8
+    G_kwargs.pipeline_depth=2
 
     distance_measure = misc.load_pkl(
         'http://d36zk2xti64re0.cloudfront.net/stylegan1/networks/metrics/vgg16_zhang_perceptual.pkl'
@@ -173,6 +174,7 @@ def plot_rot_fn(network,
     G_kwargs.is_validation = True
     G_kwargs.randomize_noise = True
     G_kwargs.minibatch_size=8
+    G_kwargs.pipeline_depth=2
 
     distance_measure = misc.load_pkl(
         'http://d36zk2xti64re0.cloudfront.net/stylegan1/networks/metrics/vgg16_zhang_perceptual.pkl'
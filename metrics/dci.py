@@ -56,7 +56,7 @@ class DCIMetric(metric_base.MetricBase):
         self.drange_net = drange_net
 
     def _evaluate(self, I_net, **kwargs):
-        representation_model = I_net.clone(is_validation=True)
+        representation_model = self._make_tower(I_net, is_validation=True)
         random_state = np.random.RandomState(123)
         # mus_train are of shape [num_codes, num_train], while ys_train are of shape
         # [num_factors, num_train].
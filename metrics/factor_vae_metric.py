@@ -45,7 +45,7 @@ class FactorVAEMetric(metric_base.MetricBase):
         self.drange_net = drange_net
 
     def _evaluate(self, I_net, **kwargs):
-        representation_model = I_net.clone(is_validation=True)
+        representation_model = self._make_tower(I_net, is_validation=True)
         random_state = np.random.RandomState(123)
         global_variances = self._compute_variances(representation_model,
                                                    self.num_variance_estimate, random_state)
@@ -124,38 +124,36 @@ class FactorVAEMetric(metric_base.MetricBase):
 
     def _generate_training_batch(self, representation_model,
                                  batch_size, num_points, random_state,
-                                 global_variances, active_dims):
+                                 global_variances, active_dims, points_per_chunk=16):
         votes = np.zeros((self.ground_truth_data.num_factors, global_variances.shape[0]),
                          dtype=np.int64)
-        for _ in range(num_points):
-            factor_index, argmin = self._generate_training_sample(representation_model,
-                                                             batch_size, random_state,
-                                                             global_variances,
-                                                             active_dims)
-            votes[factor_index, argmin] += 1
+        for begin in range(0, num_points, points_per_chunk):
+            num_chunk = min(points_per_chunk, num_points - begin)
+            factor_index, argmin = self._generate_training_samples(representation_model,
+                                                              num_chunk, batch_size, random_state,
+                                                              global_variances,
+                                                              active_dims)
+            np.add.at(votes, (factor_index, argmin), 1)
         return votes
 
-    def _generate_training_sample(self, representation_model,
-                                  batch_size, random_state, global_variances,
-                                  active_dims):
-        # Select random coordinate to keep fixed.
-        factor_index = random_state.randint(self.ground_truth_data.num_factors)
-        # Sample two mini batches of latent variables.
-        factors = self.ground_truth_data.sample_factors(batch_size, random_state)
-        # Fix the selected factor across mini-batch.
-        factors[:, factor_index] = factors[0, factor_index]
-        # Obtain the observations.
-        observations = self.ground_truth_data.sample_observations_from_factors(
-            factors, random_state)
+    def _generate_training_samples(self, representation_model, num_samples,
+                                   batch_size, random_state, global_variances,
+                                   active_dims):
+        # Select random coordinate to keep fixed for each sample.
+        factor_index = random_state.randint(self.ground_truth_data.num_factors, size=num_samples)
+        # Gather all fixed-factor mini batches at once.
+        observations = self.ground_truth_data.sample_fixed_factor_batches(
+            num_samples, batch_size, factor_index, random_state)
+        observations = observations.reshape((-1,) + observations.shape[2:])
         observations = misc.adjust_dynamic_range(observations, [-1., 1.], self.drange_net)
-        # pdb.set_trace()
         if self.has_label_place:
             representations = get_return_v(representation_model.run(observations,
                                                                     np.zeros([observations.shape[0], 0]),
-                                                                    is_validation=True), 1)
+                                                                    is_validation=True, minibatch_size=batch_size, pipeline_depth=2), 1)
         else:
-            representations = get_return_v(representation_model.run(observations, is_validation=True), 1)
-        local_variances = np.var(representations, axis=0, ddof=1)
-        argmin = np.argmin(local_variances[active_dims] /
-                           global_variances[active_dims])
+            representations = get_return_v(representation_model.run(observations, is_validation=True, minibatch_size=batch_size, pipeline_depth=2), 1)
+        representations = representations.reshape(num_samples, batch_size, -1)
+        local_variances = np.var(representations, axis=1, ddof=1)
+        argmin = np.argmin(local_variances[:, active_dims] /
+                           global_variances[active_dims], axis=1)
         return factor_index, argmin
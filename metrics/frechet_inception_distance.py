@@ -53,7 +53,7 @@ class FID(metric_base.MetricBase):
             with tf.device('/gpu:%d' % gpu_idx):
                 # Gs_clone = Gs.clone()
                 Gs_clone = Gs
-                inception_clone = inception.clone()
+                inception_clone = self._make_tower(inception)
                 latents = tf.random_normal([self.minibatch_per_gpu] + Gs_clone.input_shape[1:])
                 labels = self._get_random_labels_tf(self.minibatch_per_gpu)
                 images = get_return_v(Gs_clone.get_output_for(latents, labels, **Gs_kwargs), 1)
@@ -35,8 +35,8 @@ class GVerify(metric_base.MetricBase):
         super().__init__(**kwargs)
 
     def _evaluate(self, I_net, Gs, **kwargs):
-        E = I_net.clone(is_validation=True)
-        G = Gs.clone(is_validation=True)
+        E = self._make_tower(I_net, is_validation=True)
+        G = self._make_tower(Gs, is_validation=True)
         n_samples = 64
 
         # Element e verify.
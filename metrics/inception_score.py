@@ -31,8 +31,8 @@ class IS(metric_base.MetricBase):
         result_expr = []
         for gpu_idx in range(num_gpus):
             with tf.device('/gpu:%d' % gpu_idx):
-                Gs_clone = Gs.clone()
-                inception_clone = inception.clone()
+                Gs_clone = self._make_tower(Gs)
+                inception_clone = self._make_tower(inception)
                 latents = tf.random_normal([self.minibatch_per_gpu] + Gs_clone.input_shape[1:])
                 labels = self._get_random_labels_tf(self.minibatch_per_gpu)
                 images = Gs_clone.get_output_for(latents, labels, **Gs_kwargs)
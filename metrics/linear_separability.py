@@ -116,7 +116,7 @@ class LS(metric_base.MetricBase):
         result_expr = []
         for gpu_idx in range(num_gpus):
             with tf.device('/gpu:%d' % gpu_idx):
-                Gs_clone = Gs.clone()
+                Gs_clone = self._make_tower(Gs)
 
                 # Generate images.
                 latents = tf.random_normal([self.minibatch_per_gpu] + Gs_clone.input_shape[1:])
@@ -21,8 +21,10 @@ from training import dataset
 # Base class for metrics.
 
 class MetricBase:
-    def __init__(self, name):
+    def __init__(self, name, tower_mode='clone'):
+        assert tower_mode in ['replica', 'clone']
         self.name = name
+        self.tower_mode = tower_mode # How _make_tower() builds per-device networks, see Network.replica() and Network.clone().
         self._dataset_obj = None
         self._progress_lo = None
         self._progress_hi = None
@@ -45,6 +47,8 @@ class MetricBase:
         self._mirror_augment = mirror_augment
         self._eval_time = 0
         self._results = []
+        self._tower_stats = dnnlib.EasyDict(towers=0, build_sec=0.0, var_bytes=0, graph_nodes=0)
+        self._snapshot = None
 
         if (dataset_args is None or mirror_augment is None) and run_dir is not None:
             run_config = misc.parse_config_for_previous_run(run_dir)
@@ -60,31 +64,38 @@ class MetricBase:
 
     def run(self, network_pkl, run_dir=None, data_dir=None, dataset_args=None, mirror_augment=None, num_gpus=1, tf_config=None, log_results=True,
             include_I=False, avg_mv_for_I=False, Gs_kwargs=dict(is_validation=True, return_atts=False), train_infernet=False, is_vae=False, use_D=False,
-            **kwargs):
+            snapshot=None, **kwargs):
+        # snapshot: (obj, states) returned by misc.SnapshotWriter.save() for network_pkl; the networks are then
+        # restored from memory and network_pkl does not need to be on disk yet.
         self._reset(network_pkl=network_pkl, run_dir=run_dir, data_dir=data_dir, dataset_args=dataset_args, mirror_augment=mirror_augment)
+        self._snapshot = snapshot
         time_begin = time.time()
         with tf.Graph().as_default(), tflib.create_session(tf_config).as_default(): # pylint: disable=not-context-manager
             self._report_progress(0, 1)
             if include_I:
                 if avg_mv_for_I:
-                    _G, _D, _I, Gs, I = misc.load_pkl(self._network_pkl)
+                    Gs, I = self._load_network_pkl(only=[3, 4])
                 else:
-                    _G, _D, I, Gs = misc.load_pkl(self._network_pkl)
+                    I, Gs = self._load_network_pkl(only=[2, 3])
                 outs = self._evaluate(Gs=Gs, Gs_kwargs=Gs_kwargs, I_net=I, num_gpus=num_gpus, **kwargs)
             elif train_infernet:
-                I, Gs = misc.load_pkl(self._network_pkl)
+                I, Gs = self._load_network_pkl()
                 outs = self._evaluate(Gs=Gs, Gs_kwargs=Gs_kwargs, I_net=I, num_gpus=num_gpus, **kwargs)
             elif is_vae:
                 if use_D:
-                    I, Gs, D = misc.load_pkl(self._network_pkl)
+                    I, Gs, D = self._load_network_pkl()
                 else:
-                    I, Gs = misc.load_pkl(self._network_pkl)
+                    I, Gs = self._load_network_pkl()
                 outs = self._evaluate(Gs=Gs, Gs_kwargs=Gs_kwargs, I_net=I, num_gpus=num_gpus, **kwargs)
             else:
-                _G, _D, Gs = misc.load_pkl(self._network_pkl)
+                Gs, = self._load_network_pkl(only=[2])
                 outs = self._evaluate(Gs=Gs, Gs_kwargs=Gs_kwargs, num_gpus=num_gpus, **kwargs)
             self._report_progress(1, 1)
+        self._snapshot = None # release the captured variable values
         self._eval_time = time.time() - time_begin # pylint: disable=attribute-defined-outside-init
+        if self._tower_stats.towers > 0:
+            print('%s: %d %s towers, %.2fs, %.1f MB of new variables, %d graph nodes' % (self.name, self._tower_stats.towers, self.tower_mode,
+                self._tower_stats.build_sec, self._tower_stats.var_bytes / 2**20, self._tower_stats.graph_nodes))
 
         if log_results:
             if run_dir is not None:
@@ -95,6 +106,33 @@ class MetricBase:
                 print(self.get_result_str().strip())
         return outs
 
+    def _load_network_pkl(self, only=None): # only: see misc.load_pkl(), skips unused networks of split snapshots
+        stats_before = tflib.network.get_import_stats()
+        time_begin = time.time()
+        networks = misc.load_captured(self._snapshot, only=only) if self._snapshot is not None else misc.load_pkl(self._network_pkl, only=only)
+        stats = {key: value - stats_before[key] for key, value in tflib.network.get_import_stats().items()}
+        print('Loaded %s in %.2fs (%s)' % (os.path.basename(self._network_pkl), time.time() - time_begin, tflib.network.format_import_stats(stats)))
+        return networks
+
+    def _make_tower(self, net, **new_static_kwargs):
+        """Per-device copy of a network for building evaluation towers, depending on self.tower_mode.
+        Replicas read the variables of net; clones allocate and copy their own."""
+        graph = tf.get_default_graph()
+        num_nodes_before = len(graph.get_operations())
+        time_begin = time.time()
+        if self.tower_mode == 'clone':
+            tower = net.clone(**new_static_kwargs)
+            self._tower_stats.var_bytes += sum(int(np.prod(var.shape.as_list())) * var.dtype.size for var in tower.vars.values())
+        else:
+            tower = net.replica(**new_static_kwargs)
+        self._tower_stats.towers += 1
+        self._tower_stats.build_sec += time.time() - time_begin
+        self._tower_stats.graph_nodes += len(graph.get_operations()) - num_nodes_before
+        return tower
+
+    def get_tower_stats(self):
+        return dict(self._tower_stats)
+
     def get_result_str(self):
         network_name = os.path.splitext(os.path.basename(self._network_pkl))[0]
         if len(network_name) > 29:
@@ -152,7 +190,7 @@ class MetricBase:
         while True:
             latents = np.random.randn(minibatch_size, *Gs.input_shape[1:])
             fmt = dict(func=tflib.convert_images_to_uint8, nchw_to_nhwc=True)
-            images = Gs.run(latents, None, output_transform=fmt, is_validation=True, num_gpus=num_gpus, assume_frozen=True)
+            images = Gs.run(latents, None, output_transform=fmt, is_validation=True, num_gpus=num_gpus, assume_frozen=True, tower_mode=self.tower_mode)
             yield images
 
     def _get_random_labels_tf(self, minibatch_size):
@@ -0,0 +1,178 @@
+# Copyright (c) 2019, NVIDIA Corporation. All rights reserved.
+#
+# This work is made available under the Nvidia Source Code License-NC.
+# To view a copy of this license, visit
+# https://nvlabs.github.io/stylegan2/license.html
+
+"""Out-of-process metric evaluation fed from a queue directory.
+
+The training loop submits one job per network snapshot and keeps training.
+Worker processes (run_metric_worker.py) claim jobs by renaming them from
+pending/ to running/, wait for the snapshot file to appear, evaluate the
+metrics with MetricGroup.run() and write the results to done/. Results are
+appended to metric-*.txt in the run dir and to a TensorBoard event file, the
+same way in-process evaluation reports them.
+
+    <queue_dir>/pending/<job>.json   submitted, not yet claimed
+    <queue_dir>/running/<job>.json   claimed by a worker
+    <queue_dir>/done/<job>.json      job plus results
+    <queue_dir>/closed               no more jobs will be submitted"""
+
+import glob
+import json
+import os
+import time
+import numpy as np
+import tensorflow as tf
+import dnnlib
+import dnnlib.tflib as tflib
+
+from metrics import metric_base
+
+#----------------------------------------------------------------------------
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (np.generic,)):
+        return value.item()
+    if isinstance(value, dict):
+        return {key: _to_json(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(val) for val in value]
+    return value
+
+def _write_json(obj, filename):
+    # Write to a temporary file first so that readers never see partial files.
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(_to_json(obj), f)
+    os.replace(tmp_file, filename)
+
+def _read_json(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+#----------------------------------------------------------------------------
+# Training side.
+
+class MetricQueue:
+    """Submits metric jobs to queue_dir and collects the results of completed jobs."""
+
+    def __init__(self, queue_dir, metric_arg_list):
+        self.queue_dir = queue_dir
+        self.metric_arg_list = list(metric_arg_list)
+        self._jobs = []     # Submitted job names, in order.
+        self._done = dict() # Job name => completed job dict.
+        for subdir in ['pending', 'running', 'done']:
+            os.makedirs(os.path.join(queue_dir, subdir), exist_ok=True)
+
+    def submit(self, network_pkl, cur_nimg, **run_kwargs):
+        """Queue the evaluation of all metrics for network_pkl. run_kwargs are passed to MetricGroup.run()."""
+        job_name = 'job-%06d' % len(self._jobs)
+        job = dict(name=job_name, network_pkl=network_pkl, nimg=int(cur_nimg), metric_arg_list=self.metric_arg_list,
+                   run_kwargs=run_kwargs, submit_time=time.time())
+        _write_json(job, os.path.join(self.queue_dir, 'pending', job_name + '.json'))
+        self._jobs.append(job_name)
+        return job_name
+
+    def poll(self):
+        """Collect newly completed jobs without blocking. Returns the number of jobs still outstanding."""
+        for job_name in self._jobs:
+            if job_name not in self._done:
+                done_file = os.path.join(self.queue_dir, 'done', job_name + '.json')
+                if os.path.isfile(done_file):
+                    self._done[job_name] = _read_json(done_file)
+        return len(self._jobs) - len(self._done)
+
+    def wait(self, job_name, poll_sec=1.0):
+        """Block until the given job has completed and return it."""
+        print('Waiting for a metric worker to finish %s (run_metric_worker.py --queue-dir=%s)...' % (job_name, self.queue_dir))
+        while self.poll() > 0 and job_name not in self._done:
+            time.sleep(poll_sec)
+        return self._done[job_name]
+
+    def num_completed(self):
+        self.poll()
+        return len(self._done)
+
+    def latest_outs(self):
+        """Return the outputs of MetricGroup.run() for the most recent completed job, or None."""
+        self.poll()
+        for job_name in reversed(self._jobs):
+            if job_name in self._done:
+                return self._done[job_name]['outs']
+        return None
+
+    def close(self):
+        """Tell the workers that no more jobs will be submitted. Outstanding jobs are still evaluated."""
+        with open(os.path.join(self.queue_dir, 'closed'), 'w'):
+            pass
+        num_outstanding = self.poll()
+        if num_outstanding > 0:
+            print('%d metric jobs outstanding in %s.' % (num_outstanding, self.queue_dir))
+
+#----------------------------------------------------------------------------
+# Worker side.
+
+def _claim_job(queue_dir):
+    for pending_file in sorted(glob.glob(os.path.join(queue_dir, 'pending', '*.json'))):
+        running_file = os.path.join(queue_dir, 'running', os.path.basename(pending_file))
+        try:
+            os.rename(pending_file, running_file) # Atomic; fails if another worker claimed the job first.
+        except OSError:
+            continue
+        return running_file
+    return None
+
+def _write_summaries(summary_log, metric_group, nimg):
+    summary = tf.Summary()
+    for metric in metric_group.metrics:
+        for res in metric._results: # pylint: disable=protected-access
+            summary.value.add(tag='Metrics/' + metric.name + res.suffix, simple_value=res.value)
+    summary_log.add_summary(summary, nimg)
+    summary_log.flush()
+
+def run_worker(queue_dir, run_dir=None, poll_sec=5.0, exit_when_idle=False):
+    """Evaluate jobs from queue_dir until the queue is closed and empty.
+    run_dir defaults to the parent directory of queue_dir, i.e. the training run dir."""
+    tflib.init_tf()
+    if run_dir is None:
+        run_dir = os.path.dirname(os.path.abspath(queue_dir))
+    metric_groups = dict() # Metric groups are reused across jobs so that they keep their datasets open.
+    summary_log = None
+
+    while True:
+        running_file = _claim_job(queue_dir)
+        if running_file is None:
+            if exit_when_idle or os.path.isfile(os.path.join(queue_dir, 'closed')):
+                break
+            time.sleep(poll_sec)
+            continue
+
+        job = _read_json(running_file)
+        while not os.path.isfile(job['network_pkl']): # Snapshots are written asynchronously.
+            time.sleep(poll_sec)
+        print('%s: evaluating %s...' % (job['name'], os.path.basename(job['network_pkl'])))
+
+        group_key = json.dumps(job['metric_arg_list'], sort_keys=True)
+        if group_key not in metric_groups:
+            metric_groups[group_key] = metric_base.MetricGroup([dnnlib.EasyDict(kwargs) for kwargs in job['metric_arg_list']])
+        metric_group = metric_groups[group_key]
+        time_begin = time.time()
+        outs = metric_group.run(job['network_pkl'], run_dir=run_dir, **job['run_kwargs'])
+
+        if summary_log is None:
+            summary_log = tf.summary.FileWriter(run_dir, filename_suffix='.metrics')
+        _write_summaries(summary_log, metric_group, job['nimg'])
+        job.update(outs=outs, results=metric_group.get_result_str(), eval_sec=time.time() - time_begin, worker_pid=os.getpid())
+        _write_json(job, os.path.join(queue_dir, 'done', job['name'] + '.json'))
+        os.remove(running_file)
+
+    if summary_log is not None:
+        summary_log.close()
+    for metric_group in metric_groups.values():
+        for metric in metric_group.metrics:
+            metric.close()
+
+#----------------------------------------------------------------------------
@@ -55,7 +55,7 @@ class MIGMetric(metric_base.MetricBase):
         self.drange_net = drange_net
 
     def _evaluate(self, I_net, **kwargs):
-        representation_model = I_net.clone(is_validation=True)
+        representation_model = self._make_tower(I_net, is_validation=True)
         random_state = np.random.RandomState(123)
 
         mus_train, ys_train = self.generate_batch_factor_code(
@@ -54,7 +54,7 @@ class PPL(metric_base.MetricBase):
         distance_expr = []
         for gpu_idx in range(num_gpus):
             with tf.device('/gpu:%d' % gpu_idx):
-                Gs_clone = Gs.clone()
+                Gs_clone = Gs.clone() # Always a clone: the noise variables of each tower are re-initialized below.
                 noise_vars = [var for name, var in Gs_clone.components.synthesis.vars.items() if name.startswith('noise')]
 
                 # Generate random latents and interpolation t-values.
@@ -200,8 +200,8 @@ class PR(metric_base.MetricBase):
         result_expr = []
         for gpu_idx in range(num_gpus):
             with tf.device('/gpu:%d' % gpu_idx):
-                Gs_clone = Gs.clone()
-                feature_net_clone = feature_net.clone()
+                Gs_clone = self._make_tower(Gs)
+                feature_net_clone = self._make_tower(feature_net)
                 latents = tf.random_normal([self.minibatch_per_gpu] + Gs_clone.input_shape[1:])
                 labels = self._get_random_labels_tf(self.minibatch_per_gpu)
                 images = Gs_clone.get_output_for(latents, labels, **Gs_kwargs)
@@ -57,7 +57,7 @@ class TPL(metric_base.MetricBase):
         lerps_expr = []
         for gpu_idx in range(num_gpus):
             with tf.device('/gpu:%d' % gpu_idx):
-                Gs_clone = Gs.clone()
+                Gs_clone = Gs.clone() # Always a clone: the noise variables of each tower are re-initialized below.
                 if self.no_mapping:
                     noise_vars = [var for name, var in Gs_clone.vars.items() if name.startswith('noise')]
                 else:
@@ -66,13 +66,18 @@ def load_networks(path_or_gdrive_path):
     if path_or_url in _cached_networks:
         return _cached_networks[path_or_url]
 
+    tflib.init_tf()
+    if not dnnlib.util.is_url(path_or_url) and tflib.snapshot.is_snapshot_file(path_or_url):
+        G, D, Gs = tflib.snapshot.load_networks(path_or_url)
+        _cached_networks[path_or_url] = G, D, Gs
+        return G, D, Gs
+
     if dnnlib.util.is_url(path_or_url):
         stream = dnnlib.util.open_url(path_or_url, cache_dir='.stylegan2-cache')
     else:
         stream = open(path_or_url, 'rb')
 
-    tflib.init_tf()
-    with stream:
+    with stream, tflib.batch_set_vars():
         G, D, Gs = pickle.load(stream, encoding='latin1')
     _cached_networks[path_or_url] = G, D, Gs
     return G, D, Gs
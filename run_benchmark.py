@@ -0,0 +1,351 @@
+# Copyright (c) 2019, NVIDIA Corporation. All rights reserved.
+#
+# This work is made available under the Nvidia Source Code License-NC.
+# To view a copy of this license, visit
+# https://nvlabs.github.io/stylegan2/license.html
+
+"""Throughput benchmarks for trained networks."""
+
+import argparse
+import contextlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+import dnnlib
+import dnnlib.tflib as tflib
+
+from training import misc
+
+#----------------------------------------------------------------------------
+
+def _select_networks(network_pkl, nets):
+    if nets is not None:
+        networks = list(misc.load_pkl(network_pkl, only=nets))
+    else:
+        networks = [obj for obj in misc.load_pkl(network_pkl) if isinstance(obj, tflib.Network)]
+    if len(networks) == 0:
+        print('Error: no matching networks in "%s".' % network_pkl)
+        sys.exit(1)
+    return networks
+
+def _random_inputs(net, num_items):
+    rnd = np.random.RandomState(123)
+    return [rnd.randn(num_items, *shape[1:]).astype(np.float32) for shape in net.input_shapes]
+
+def _run_kwargs(net):
+    params = inspect.signature(net._build_func).parameters # pylint: disable=protected-access
+    accepts_kwargs = any(param.kind == param.VAR_KEYWORD for param in params.values())
+    return dict(is_validation=True) if accepts_kwargs or 'is_validation' in params else dict()
+
+def _time_run(net, in_arrays, num_repeats, **run_kwargs): # => seconds per call
+    net.run(*in_arrays, **run_kwargs) # build graph and warm up
+    time_begin = time.time()
+    for _repeat in range(num_repeats):
+        net.run(*in_arrays, **run_kwargs)
+    return (time.time() - time_begin) / num_repeats
+
+#----------------------------------------------------------------------------
+
+def network_run(network_pkl, nets, minibatch_size, num_items, num_repeats, pipeline_depth, cpu):
+    if cpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    tflib.init_tf()
+    print('Loading networks from "%s"...' % network_pkl)
+    networks = _select_networks(network_pkl, nets)
+    modes = [
+        ('dynamic', dict()),
+        ('static', dict(static_shapes=True)),
+        ('static+pipelined', dict(static_shapes=True, pipeline_depth=pipeline_depth)),
+    ]
+
+    results = []
+    print('%-16s%-20s%-12s%-12s%s' % ('Network', 'Mode', 'sec/call', 'items/s', 'speedup'))
+    print('%-16s%-20s%-12s%-12s%s' % ('---', '---', '---', '---', '---'))
+    for net in networks:
+        in_arrays = _random_inputs(net, num_items)
+        run_kwargs = dict(_run_kwargs(net), minibatch_size=minibatch_size)
+        base_sec = None
+        for mode, mode_kwargs in modes:
+            sec = _time_run(net, in_arrays, num_repeats, **run_kwargs, **mode_kwargs)
+            base_sec = sec if base_sec is None else base_sec
+            results.append(dict(network=net.name, mode=mode, sec_per_call=sec, items_per_sec=num_items / sec))
+            print('%-16s%-20s%-12.4f%-12.1f%.2fx' % (net.name, mode, sec, num_items / sec, base_sec / sec))
+
+    with open(dnnlib.make_run_dir_path('benchmark-network-run.json'), 'w') as f:
+        json.dump(dict(network_pkl=network_pkl, minibatch_size=minibatch_size, num_items=num_items, cpu=cpu, results=results), f, indent=2)
+
+def frozen_run(network_pkl, nets, minibatch_size, num_items, num_repeats, cpu):
+    if cpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    tflib.init_tf()
+    print('Loading networks from "%s"...' % network_pkl)
+    time_begin = time.time()
+    networks = _select_networks(network_pkl, nets)
+    pkl_sec = time.time() - time_begin
+
+    results = []
+    print('%-16s%-12s%-12s%-12s%-12s%s' % ('Network', 'Mode', 'startup', 'sec/call', 'items/s', 'nodes'))
+    print('%-16s%-12s%-12s%-12s%-12s%s' % ('---', '---', '---', '---', '---', '---'))
+    for net in networks:
+        in_arrays = _random_inputs(net, num_items)
+        mb_arrays = [x[:minibatch_size] for x in in_arrays]
+        run_kwargs = _run_kwargs(net)
+        pb_file = dnnlib.make_run_dir_path('%s-frozen.pb' % net.name)
+        meta = tflib.frozen.export_frozen(net, pb_file, num_outputs=1, **run_kwargs)
+
+        # Network.run(): startup = pickle import + first minibatch (graph construction).
+        time_begin = time.time()
+        net.run(*mb_arrays, minibatch_size=minibatch_size, **run_kwargs)
+        startup_sec = pkl_sec + time.time() - time_begin
+        sec = _time_run(net, in_arrays, num_repeats, minibatch_size=minibatch_size, **run_kwargs)
+        results.append(dict(network=net.name, mode='network', startup_sec=startup_sec, sec_per_call=sec, items_per_sec=num_items / sec, num_nodes=meta['num_nodes_source']))
+        print('%-16s%-12s%-12.2f%-12.4f%-12.1f%d' % (net.name, 'network', startup_sec, sec, num_items / sec, meta['num_nodes_source']))
+
+        # Frozen graph: startup = loading the exported graph + first minibatch.
+        time_begin = time.time()
+        frozen = tflib.frozen.FrozenNetwork(pb_file)
+        frozen.run(*mb_arrays)
+        startup_sec = time.time() - time_begin
+        sec = _time_run(frozen, in_arrays, num_repeats, minibatch_size=minibatch_size)
+        frozen.close()
+        results.append(dict(network=net.name, mode='frozen', startup_sec=startup_sec, sec_per_call=sec, items_per_sec=num_items / sec, num_nodes=meta['num_nodes_frozen']))
+        print('%-16s%-12s%-12.2f%-12.4f%-12.1f%d' % (net.name, 'frozen', startup_sec, sec, num_items / sec, meta['num_nodes_frozen']))
+
+    with open(dnnlib.make_run_dir_path('benchmark-frozen-run.json'), 'w') as f:
+        json.dump(dict(network_pkl=network_pkl, minibatch_size=minibatch_size, num_items=num_items, cpu=cpu, results=results), f, indent=2)
+
+def layer_profile(network_pkl, nets, func_name, static_kwargs, minibatch_size, num_timing_runs, cpu):
+    if cpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    tflib.init_tf()
+    if network_pkl is not None:
+        print('Loading networks from "%s"...' % network_pkl)
+        networks = _select_networks(network_pkl, nets)
+    elif func_name is not None:
+        networks = [tflib.Network(func_name.split('.')[-1], func_name=func_name, **static_kwargs)]
+        tflib.init_uninitialized_vars()
+    else:
+        print('Error: specify --network or --func-name.')
+        sys.exit(1)
+
+    for net in networks:
+        profile = tflib.profiler.profile_layers(net, minibatch_size=minibatch_size, num_timing_runs=num_timing_runs, **_run_kwargs(net))
+        tflib.profiler.print_profile(profile, title='%s (minibatch %d)' % (net.name, minibatch_size))
+        tflib.profiler.save_profile_json(profile, dnnlib.make_run_dir_path('profile-%s.json' % net.name),
+            network=net.name, build_func_name=net._build_func_name, minibatch_size=minibatch_size, num_timing_runs=num_timing_runs, cpu=cpu) # pylint: disable=protected-access
+
+def load_networks(network_pkl, num_repeats, cpu):
+    if cpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    tflib.init_tf()
+    modes = [
+        ('per-network', contextlib.ExitStack),   # every Network.__setstate__() sets its variables in its own session call
+        ('batched', tflib.batch_set_vars),       # all variables are set in one session call
+    ]
+
+    results = []
+    print('%-16s%-12s%-12s%s' % ('Mode', 'networks', 'sec/load', 'speedup'))
+    print('%-16s%-12s%-12s%s' % ('---', '---', '---', '---'))
+    base_sec = None
+    for mode, context in modes:
+        secs = []
+        for _repeat in range(num_repeats + 1): # the first load also execs the build modules
+            with tf.Graph().as_default(), tflib.create_session().as_default():
+                time_begin = time.time()
+                with misc.open_file_or_url(network_pkl) as f, context():
+                    networks = pickle.load(f, encoding='latin1')
+                secs.append(time.time() - time_begin)
+        num_networks = len(networks) if isinstance(networks, tuple) else 1
+        sec = float(np.median(secs[1:]))
+        base_sec = sec if base_sec is None else base_sec
+        results.append(dict(mode=mode, num_networks=num_networks, sec_per_load=sec, first_load_sec=secs[0]))
+        print('%-16s%-12d%-12.3f%.2fx' % (mode, num_networks, sec, base_sec / sec))
+
+    with open(dnnlib.make_run_dir_path('benchmark-load-networks.json'), 'w') as f:
+        json.dump(dict(network_pkl=network_pkl, num_repeats=num_repeats, cpu=cpu, results=results), f, indent=2)
+
+def ema_update(network_pkl, nets, beta, stride, num_steps, cpu):
+    if cpu:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+    tflib.init_tf()
+    print('Loading networks from "%s"...' % network_pkl)
+    networks = _select_networks(network_pkl, nets)
+    modes = [
+        ('per-variable', dict(stride=1, fused=False)),
+        ('fused', dict(stride=1, fused=True)),
+        ('strided', dict(stride=stride, fused=False)),
+        ('strided+fused', dict(stride=stride, fused=True)),
+    ]
+
+    results = []
+    print('%-16s%-16s%-12s%-12s%-12s%s' % ('Network', 'Mode', 'ms/step', 'speedup', 'max_diff', 'rel_diff'))
+    print('%-16s%-16s%-12s%-12s%-12s%s' % ('---', '---', '---', '---', '---', '---'))
+    for net in networks:
+        # The source network drifts deterministically every step, like G during training.
+        src = net.clone(net.name + '_EmaSrc')
+        dst = net.clone(net.name + '_EmaDst')
+        step_in = tf.placeholder(tf.float32, name='step_in', shape=[])
+        drift_op = tf.group(*[tf.assign_add(var, 1e-3 * tf.sin(step_in * 0.1 + tf.reshape(tf.cast(tf.range(var.shape.num_elements()), tf.float32), var.shape)))
+                              for var in src.trainables.values() if var.dtype.base_dtype == tf.float32])
+        update_ops = {mode: dst.setup_as_moving_average_of(src, beta=beta, **mode_kwargs) for mode, mode_kwargs in modes}
+
+        ref_values = None
+        init_values = np.concatenate([value.ravel() for value in tflib.run(list(net.trainables.values()))])
+        base_sec = None
+        for mode, mode_kwargs in modes:
+            src.copy_vars_from(net)
+            dst.copy_vars_from(net)
+            update_op = update_ops[mode]
+            tflib.run(update_op) # warm up
+            dst.copy_vars_from(net)
+            update_sec = 0.0
+            for step in range(num_steps):
+                tflib.run(drift_op, {step_in: step})
+                if step % mode_kwargs['stride'] == 0:
+                    time_begin = time.time()
+                    tflib.run(update_op)
+                    update_sec += time.time() - time_begin
+            values = np.concatenate([value.ravel() for value in tflib.run(list(dst.trainables.values()))])
+            ref_values = values if ref_values is None else ref_values
+            max_diff = float(np.max(np.abs(values - ref_values)))
+            rel_diff = max_diff / max(float(np.max(np.abs(ref_values - init_values))), 1e-30)
+            sec = update_sec / num_steps
+            base_sec = sec if base_sec is None else base_sec
+            results.append(dict(network=net.name, mode=mode, stride=mode_kwargs['stride'], fused=mode_kwargs['fused'], ms_per_step=sec * 1000.0,
+                                max_abs_diff=max_diff, rel_diff=rel_diff))
+            print('%-16s%-16s%-12.4f%-12s%-12.2e%.2e' % (net.name, mode, sec * 1000.0, '%.2fx' % (base_sec / sec), max_diff, rel_diff))
+
+    with open(dnnlib.make_run_dir_path('benchmark-ema-update.json'), 'w') as f:
+        json.dump(dict(network_pkl=network_pkl, beta=beta, stride=stride, num_steps=num_steps, cpu=cpu, results=results), f, indent=2)
+
+#----------------------------------------------------------------------------
+
+def _str_to_bool(v):
+    if isinstance(v, bool):
+        return v
+    if v.lower() in ('yes', 'true', 't', 'y', '1'):
+        return True
+    elif v.lower() in ('no', 'false', 'f', 'n', '0'):
+        return False
+    else:
+        raise argparse.ArgumentTypeError('Boolean value expected.')
+
+#----------------------------------------------------------------------------
+
+_examples = '''examples:
+
+  # Compare dynamic vs. static-shape Network.run for the VC2 generator on CPU
+  python %(prog)s network-run --network=results/00000-vc2/network-snapshot-001000.pkl --nets=Gs --minibatch-size=25 --num-items=203
+
+  # Same for the encoder of a VAE snapshot
+  python %(prog)s network-run --network=results/00001-vae/network-snapshot-001000.pkl --nets=E
+
+  # Compare a frozen, constant-folded export of the VC2 generator against Network.run on CPU
+  python %(prog)s frozen-run --network=results/00000-vc2/network-snapshot-001000.pkl --nets=Gs
+
+  # Same for the generator of a VAE snapshot
+  python %(prog)s frozen-run --network=results/00001-vae/network-snapshot-001000.pkl --nets=G
+
+  # Load time of a 4-network VC2 snapshot with per-network vs. batched variable assignment
+  python %(prog)s load-networks --network=results/00000-vc2/network-snapshot-001000.pkl
+
+  # Cost and accuracy of per-variable, fused and strided (every 4 steps, beta**4) moving-average updates of Gs on CPU
+  python %(prog)s ema-update --network=results/00000-vc2/network-snapshot-001000.pkl --nets=Gs --stride=4
+
+  # Per-layer FLOPs, parameter/activation memory and CPU time of a trained generator
+  python %(prog)s layer-profile --network=results/00000-vc2/network-snapshot-001000.pkl --nets=Gs --minibatch-size=8
+
+  # Same for an untrained module configuration, built from its network function and the G kwargs of a training config
+  python %(prog)s layer-profile --func-name=training.vae_networks.G_main_modular --static-kwargs="$(cat G_kwargs.json)"
+'''
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='''Network benchmarks.
+
+Run 'python %(prog)s <subcommand> --help' for subcommand help.''',
+        epilog=_examples,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    subparsers = parser.add_subparsers(help='Sub-commands', dest='command')
+
+    parser_network_run = subparsers.add_parser('network-run', help='Benchmark Network.run with dynamic vs. static shapes')
+    parser_network_run.add_argument('--network', help='Network pickle filename', dest='network_pkl', required=True)
+    parser_network_run.add_argument('--nets', help='Comma-separated network names to benchmark (default: all)', type=lambda x: x.split(','), default=None)
+    parser_network_run.add_argument('--minibatch-size', help='Minibatch size (default: %(default)s)', type=int, default=32)
+    parser_network_run.add_argument('--num-items', help='Items per run, not a multiple of the minibatch size to exercise padding (default: %(default)s)', type=int, default=1000)
+    parser_network_run.add_argument('--num-repeats', help='Timed runs per mode (default: %(default)s)', type=int, default=5)
+    parser_network_run.add_argument('--pipeline-depth', help='Pipeline depth of the pipelined mode (default: %(default)s)', type=int, default=2)
+    parser_network_run.add_argument('--cpu', help='Hide GPUs and benchmark on CPU (default: %(default)s)', type=_str_to_bool, default=True, metavar='BOOL')
+    parser_network_run.add_argument('--result-dir', help='Root directory for run results (default: %(default)s)', default='results', metavar='DIR')
+
+    parser_frozen_run = subparsers.add_parser('frozen-run', help='Benchmark a frozen inference export against Network.run')
+    parser_frozen_run.add_argument('--network', help='Network pickle filename', dest='network_pkl', required=True)
+    parser_frozen_run.add_argument('--nets', help='Comma-separated network names to benchmark (default: %(default)s)', type=lambda x: x.split(','), default='Gs')
+    parser_frozen_run.add_argument('--minibatch-size', help='Minibatch size (default: %(default)s)', type=int, default=32)
+    parser_frozen_run.add_argument('--num-items', help='Items per run (default: %(default)s)', type=int, default=1024)
+    parser_frozen_run.add_argument('--num-repeats', help='Timed runs per mode (default: %(default)s)', type=int, default=5)
+    parser_frozen_run.add_argument('--cpu', help='Hide GPUs and benchmark on CPU (default: %(default)s)', type=_str_to_bool, default=True, metavar='BOOL')
+    parser_frozen_run.add_argument('--result-dir', help='Root directory for run results (default: %(default)s)', default='results', metavar='DIR')
+
+    parser_layer_profile = subparsers.add_parser('layer-profile', help='Per-layer FLOPs, parameter/activation memory and execution time')
+    parser_layer_profile.add_argument('--network', help='Network pickle filename', dest='network_pkl', default=None)
+    parser_layer_profile.add_argument('--nets', help='Comma-separated network names to profile (default: all)', type=lambda x: x.split(','), default=None)
+    parser_layer_profile.add_argument('--func-name', help='Build a fresh network from this function instead of loading --network', default=None)
+    parser_layer_profile.add_argument('--static-kwargs', help='JSON dict of static kwargs for --func-name (default: %(default)s)', type=json.loads, default='{}')
+    parser_layer_profile.add_argument('--minibatch-size', help='Minibatch size (default: %(default)s)', type=int, default=1)
+    parser_layer_profile.add_argument('--num-timing-runs', help='Traced runs for per-layer timing, 0 = no timing (default: %(default)s)', type=int, default=10)
+    parser_layer_profile.add_argument('--cpu', help='Hide GPUs and profile on CPU (default: %(default)s)', type=_str_to_bool, default=True, metavar='BOOL')
+    parser_layer_profile.add_argument('--result-dir', help='Root directory for run results (default: %(default)s)', default='results', metavar='DIR')
+
+    parser_load_networks = subparsers.add_parser('load-networks', help='Benchmark network pickle loading with per-network vs. batched variable assignment')
+    parser_load_networks.add_argument('--network', help='Network pickle filename', dest='network_pkl', required=True)
+    parser_load_networks.add_argument('--num-repeats', help='Timed loads per mode (default: %(default)s)', type=int, default=5)
+    parser_load_networks.add_argument('--cpu', help='Hide GPUs and benchmark on CPU (default: %(default)s)', type=_str_to_bool, default=True, metavar='BOOL')
+    parser_load_networks.add_argument('--result-dir', help='Root directory for run results (default: %(default)s)', default='results', metavar='DIR')
+
+    parser_ema_update = subparsers.add_parser('ema-update', help='Benchmark per-variable vs. fused vs. strided moving-average updates')
+    parser_ema_update.add_argument('--network', help='Network pickle filename', dest='network_pkl', required=True)
+    parser_ema_update.add_argument('--nets', help='Comma-separated network names to benchmark (default: %(default)s)', type=lambda x: x.split(','), default='Gs')
+    parser_ema_update.add_argument('--beta', help='Per-step decay (default: %(default)s)', type=float, default=0.998)
+    parser_ema_update.add_argument('--stride', help='Update interval of the strided modes (default: %(default)s)', type=int, default=4)
+    parser_ema_update.add_argument('--num-steps', help='Simulated training steps per mode (default: %(default)s)', type=int, default=200)
+    parser_ema_update.add_argument('--cpu', help='Hide GPUs and benchmark on CPU (default: %(default)s)', type=_str_to_bool, default=True, metavar='BOOL')
+    parser_ema_update.add_argument('--result-dir', help='Root directory for run results (default: %(default)s)', default='results', metavar='DIR')
+
+    args = parser.parse_args()
+    kwargs = vars(args)
+    subcmd = kwargs.pop('command')
+
+    if subcmd is None:
+        print ('Error: missing subcommand.  Re-run with --help for usage.')
+        sys.exit(1)
+
+    sc = dnnlib.SubmitConfig()
+    sc.num_gpus = 1
+    sc.submit_target = dnnlib.SubmitTarget.LOCAL
+    sc.local.do_not_copy_source_files = True
+    sc.run_dir_root = kwargs.pop('result_dir')
+    sc.run_desc = 'benchmark-' + subcmd
+
+    func_name_map = {
+        'network-run': 'run_benchmark.network_run',
+        'frozen-run': 'run_benchmark.frozen_run',
+        'layer-profile': 'run_benchmark.layer_profile',
+        'load-networks': 'run_benchmark.load_networks',
+        'ema-update': 'run_benchmark.ema_update',
+    }
+    dnnlib.submit_run(sc, func_name_map[subcmd], **kwargs)
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
+
+#----------------------------------------------------------------------------
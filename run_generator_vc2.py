@@ -123,6 +123,7 @@ def generate_traversals(network_pkl, seeds, tpl_metric, n_samples_per, topk_dims
                             grid_labels,
                             is_validation=True,
                             minibatch_size=2,
+                            pipeline_depth=2,
                             randomize_noise=True), 2)
         if return_atts:
             atts = atts[:, topk_dims]
@@ -225,6 +226,7 @@ def style_mixing_example(network_pkl, row_seeds, col_seeds, truncation_psi, col_
     Gs_syn_kwargs.output_transform = dict(func=tflib.convert_images_to_uint8, nchw_to_nhwc=True)
     Gs_syn_kwargs.randomize_noise = False
     Gs_syn_kwargs.minibatch_size = minibatch_size
+    Gs_syn_kwargs.pipeline_depth = 2
 
     print('Generating W vectors...')
     all_seeds = list(set(row_seeds + col_seeds))
@@ -0,0 +1,41 @@
+# Copyright (c) 2019, NVIDIA Corporation. All rights reserved.
+#
+# This work is made available under the Nvidia Source Code License-NC.
+# To view a copy of this license, visit
+# https://nvlabs.github.io/stylegan2/license.html
+
+import argparse
+
+from metrics import metric_queue
+
+#----------------------------------------------------------------------------
+
+_examples = '''examples:
+
+  # Evaluate the metrics of a run started with --async_metrics=true on GPU 1.
+  CUDA_VISIBLE_DEVICES=1 python %(prog)s --queue-dir=results/00000-vc2_gan2/metric-queue
+
+  # Several workers can share one queue.
+  CUDA_VISIBLE_DEVICES=2 python %(prog)s --queue-dir=results/00000-vc2_gan2/metric-queue
+'''
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Evaluate metrics for snapshots queued by a training run. Exits once training has finished and the queue is empty.',
+        epilog=_examples,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--queue-dir', help='Metric queue directory of the training run', required=True, metavar='DIR')
+    parser.add_argument('--run-dir', help='Directory for metric-*.txt and TensorBoard logs (default: parent of the queue dir)', default=None, metavar='DIR')
+    parser.add_argument('--poll-sec', help='Seconds between queue polls (default: %(default)s)', default=5.0, type=float)
+    parser.add_argument('--exit-when-idle', help='Exit as soon as the queue is empty', action='store_true')
+
+    args = parser.parse_args()
+    metric_queue.run_worker(args.queue_dir, run_dir=args.run_dir, poll_sec=args.poll_sec, exit_when_idle=args.exit_when_idle)
+
+#----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
+
+#----------------------------------------------------------------------------
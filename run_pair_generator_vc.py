@@ -112,12 +112,14 @@ def generate_image_pairs(network_pkl,
                    grid_labels,
                    is_validation=True,
                    minibatch_size=batch_size,
+                   pipeline_depth=2,
                    **Gs_kwargs), 1)
         fakes_2 = get_return_v(
             Gs.run(z_2,
                    grid_labels,
                    is_validation=True,
                    minibatch_size=batch_size,
+                   pipeline_depth=2,
                    **Gs_kwargs), 1)
         print('fakes_1.shape:', fakes_1.shape)
         print('fakes_2.shape:', fakes_2.shape)
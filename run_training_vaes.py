@@ -23,6 +23,7 @@ import sys
 
 import dnnlib
 from dnnlib import EasyDict
+from dnnlib.tflib import custom_ops
 
 from metrics.metric_defaults import metric_defaults
 from training.vc_modular_networks2 import split_module_names, LATENT_MODULES
@@ -48,7 +49,8 @@ def run(dataset, data_dir, result_dir, num_gpus, total_kimg, mirror_augment, met
         use_sphere_points=False, use_learnable_sphere_points=False, n_sphere_points=100,
         use_group_decomp=False, mapping_after_exp=False, snapshot_ticks=10,
         subgroup_sizes_ls=None, subspace_sizes_ls=None, lie_alg_init_type_ls=None,
-        forward_eg=False, forward_eg_prob=0.3333):
+        forward_eg=False, forward_eg_prob=0.3333,
+        benchmark_steps=0, benchmark_resolution=64, benchmark_channels=3, benchmark_cpu=False):
     train = EasyDict(
         run_func_name='training.training_loop_vae.training_loop_vae'
     )  # Options for training loop.
@@ -289,6 +291,12 @@ def run(dataset, data_dir, result_dir, num_gpus, total_kimg, mirror_augment, met
 
     desc += '-' + dataset
     dataset_args = EasyDict(tfrecord_dir=dataset, max_label_size='full')
+    if benchmark_steps > 0:
+        desc += '-benchmark'
+        dataset_args = EasyDict(class_name='training.dataset.SyntheticDataset', resolution=benchmark_resolution, num_channels=benchmark_channels)
+        if benchmark_cpu:
+            os.environ['CUDA_VISIBLE_DEVICES'] = ''
+            custom_ops.force_ref_impl = True
 
     assert num_gpus in [1, 2, 4, 8]
     sc.num_gpus = num_gpus
@@ -318,6 +326,7 @@ def run(dataset, data_dir, result_dir, num_gpus, total_kimg, mirror_augment, met
                   subgroup_sizes_ls=subgroup_sizes_ls,
                   subspace_sizes_ls=subspace_sizes_ls,
                   forward_eg=forward_eg,
+                  benchmark_steps=benchmark_steps,
                   topk_dims_to_show=topk_dims_to_show)
     kwargs.submit_config = copy.deepcopy(sc)
     kwargs.submit_config.run_dir_root = result_dir
@@ -738,9 +747,17 @@ def main():
                         default=0.3333,
                         metavar='FORWARD_EG_PROB',
                         type=float)
+    parser.add_argument('--benchmark_steps', help='If > 0, time this many warmup and timed minibatches on synthetic data, write benchmark-steps.json and exit.',
+                        metavar='BENCHMARK_STEPS', default=0, type=int)
+    parser.add_argument('--benchmark_resolution', help='Image resolution of the synthetic data in benchmark mode.',
+                        metavar='BENCHMARK_RESOLUTION', default=64, type=int)
+    parser.add_argument('--benchmark_channels', help='Image channels of the synthetic data in benchmark mode (1 for dSprites).',
+                        metavar='BENCHMARK_CHANNELS', default=3, type=int)
+    parser.add_argument('--benchmark_cpu', help='Run the benchmark on CPU with the reference implementation of the custom ops.',
+                        default=False, metavar='BENCHMARK_CPU', type=_str_to_bool)
     args = parser.parse_args()
 
-    if not os.path.exists(args.data_dir):
+    if args.benchmark_steps == 0 and not os.path.exists(args.data_dir):
         print('Error: dataset root directory does not exist.')
         sys.exit(1)
 
@@ -23,6 +23,7 @@ import sys
 
 import dnnlib
 from dnnlib import EasyDict
+from dnnlib.tflib import custom_ops
 
 from metrics.metric_defaults import metric_defaults
 from training.vc_modular_networks2 import split_module_names, LATENT_MODULES
@@ -47,7 +48,9 @@ def run(dataset, data_dir, result_dir, config_id, num_gpus, total_kimg, gamma,
         loose_rate=0.2, topk_dims_to_show=20, n_neg_samples=1, temperature=1.,
         learning_rate=0.002, avg_mv_for_I=False, use_cascade=False, cascade_alt_freq_k=1,
         regW_lambda=1,
-        network_snapshot_ticks=10):
+        network_snapshot_ticks=10, phase_timing=False, async_metrics=False,
+        cached_steps=True, benchmark_cached_steps=0, G_smoothing_stride=1, fused_ema=False,
+        benchmark_steps=0, benchmark_resolution=64, benchmark_channels=3, benchmark_cpu=False):
     # print('module_list:', module_list)
     train = EasyDict(run_func_name='training.training_loop_vc2.training_loop_vc2'
                      )  # Options for training loop.
@@ -305,6 +308,8 @@ def run(dataset, data_dir, result_dir, config_id, num_gpus, total_kimg, gamma,
     train.data_dir = data_dir
     train.total_kimg = total_kimg
     train.mirror_augment = mirror_augment
+    train.G_smoothing_stride = G_smoothing_stride
+    train.fused_ema = fused_ema
     train.image_snapshot_ticks = train.network_snapshot_ticks = 10
     # sched.G_lrate_base = sched.D_lrate_base = 0.002
     sched.G_lrate_base = sched.D_lrate_base = learning_rate
@@ -315,6 +320,13 @@ def run(dataset, data_dir, result_dir, config_id, num_gpus, total_kimg, gamma,
 
     desc += '-' + dataset
     dataset_args = EasyDict(tfrecord_dir=dataset, max_label_size='full')
+    if benchmark_steps > 0:
+        desc += '-benchmark'
+        dataset_args = EasyDict(class_name='training.dataset.SyntheticDataset', resolution=benchmark_resolution, num_channels=benchmark_channels)
+        if benchmark_cpu:
+            os.environ['CUDA_VISIBLE_DEVICES'] = ''
+            tf_config['allow_soft_placement'] = True
+            custom_ops.force_ref_impl = True
 
     assert num_gpus in [1, 2, 4, 8]
     sc.num_gpus = num_gpus
@@ -363,7 +375,9 @@ def run(dataset, data_dir, result_dir, config_id, num_gpus, total_kimg, gamma,
                   tf_config=tf_config, resume_pkl=resume_pkl, n_discrete=D_global_size,
                   n_continuous=n_continuous, n_samples_per=n_samples_per,
                   topk_dims_to_show=topk_dims_to_show, cascade_alt_freq_k=cascade_alt_freq_k,
-                  network_snapshot_ticks=network_snapshot_ticks)
+                  network_snapshot_ticks=network_snapshot_ticks, phase_timing=phase_timing,
+                  async_metrics=async_metrics, cached_steps=cached_steps,
+                  benchmark_cached_steps=benchmark_cached_steps, benchmark_steps=benchmark_steps)
     kwargs.submit_config = copy.deepcopy(sc)
     kwargs.submit_config.run_dir_root = result_dir
     kwargs.submit_config.run_desc = desc
@@ -529,12 +543,32 @@ def main():
                         metavar='CASCADE_ALT_FREQ_K', default=1, type=float)
     parser.add_argument('--network_snapshot_ticks', help='Snapshot ticks.',
                         metavar='NETWORK_SNAPSHOT_TICKS', default=10, type=int)
+    parser.add_argument('--phase_timing', help='Time each phase of a training step separately (written to timing-phases.jsonl).',
+                        default=False, metavar='PHASE_TIMING', type=_str_to_bool)
+    parser.add_argument('--async_metrics', help='Evaluate metrics in separate run_metric_worker.py processes instead of blocking training.',
+                        default=False, metavar='ASYNC_METRICS', type=_str_to_bool)
+    parser.add_argument('--cached_steps', help='Run fast-path minibatches through cached session callables.',
+                        default=True, metavar='CACHED_STEPS', type=_str_to_bool)
+    parser.add_argument('--benchmark_cached_steps', help='If > 0, report steps/s with and without cached_steps over this many minibatches and exit.',
+                        metavar='BENCHMARK_CACHED_STEPS', default=0, type=int)
+    parser.add_argument('--G_smoothing_stride', help='Update Gs (and Is) every this many minibatches with decay beta**stride.',
+                        metavar='G_SMOOTHING_STRIDE', default=1, type=int)
+    parser.add_argument('--fused_ema', help='Update the moving averages with one lerp per dtype instead of one per variable.',
+                        default=False, metavar='FUSED_EMA', type=_str_to_bool)
     parser.add_argument('--regW_lambda', help='Lambda for regularization on z input W.',
                         metavar='REGW_LAMBDA', default=1, type=float)
+    parser.add_argument('--benchmark_steps', help='If > 0, time this many warmup and timed minibatches on synthetic data, write benchmark-steps.json and exit.',
+                        metavar='BENCHMARK_STEPS', default=0, type=int)
+    parser.add_argument('--benchmark_resolution', help='Image resolution of the synthetic data in benchmark mode.',
+                        metavar='BENCHMARK_RESOLUTION', default=64, type=int)
+    parser.add_argument('--benchmark_channels', help='Image channels of the synthetic data in benchmark mode (1 for dSprites).',
+                        metavar='BENCHMARK_CHANNELS', default=3, type=int)
+    parser.add_argument('--benchmark_cpu', help='Run the benchmark on CPU with the reference implementation of the custom ops.',
+                        default=False, metavar='BENCHMARK_CPU', type=_str_to_bool)
 
     args = parser.parse_args()
 
-    if not os.path.exists(args.data_dir):
+    if args.benchmark_steps == 0 and not os.path.exists(args.data_dir):
         print('Error: dataset root directory does not exist.')
         sys.exit(1)
 
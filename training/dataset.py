@@ -8,7 +8,14 @@
 
 import os
 import glob
+import json
+import struct
+import hashlib
+import threading
+import collections
+import concurrent.futures
 import numpy as np
+import PIL.Image
 import tensorflow as tf
 import dnnlib
 import dnnlib.tflib as tflib
@@ -27,7 +34,11 @@ class TFRecordDataset:
         shuffle_mb      = 4096,     # Shuffle data within specified window (megabytes), 0 = disable shuffling.
         prefetch_mb     = 2048,     # Amount of data to prefetch (megabytes), 0 = disable prefetching.
         buffer_mb       = 256,      # Read buffer size (megabytes).
-        num_threads     = 2):       # Number of concurrent threads.
+        num_threads     = 2,        # Number of concurrent threads.
+        shard_index     = 0,        # Shard to read when num_shards > 1.
+        num_shards      = 1,        # Split the records into this many disjoint shards, 1 = read everything.
+        shuffle_seed    = 0,        # Base seed of the deterministic per-shard shuffle, used when num_shards > 1.
+        verify_manifest = False):   # Check the manifest's content hash against the records? Reads the whole dataset once.
 
         self.tfrecord_dir       = tfrecord_dir
         self.resolution         = None
@@ -38,7 +49,14 @@ class TFRecordDataset:
         self.label_file         = label_file
         self.label_size         = None      # components
         self.label_dtype        = None
+        self.num_images         = 0
+        self.shard_index        = shard_index
+        self.num_shards         = num_shards
+        self.shard_size         = 0         # Records read by this shard.
+        self.manifest           = None
         self._np_labels         = None
+        self._label_index       = None
+        self._tfr_records       = dict()    # lod => (tfrecords file, record offsets)
         self._tf_minibatch_in   = None
         self._tf_labels_var     = None
         self._tf_labels_dataset = None
@@ -49,16 +67,19 @@ class TFRecordDataset:
         self._cur_minibatch     = -1
         self._cur_lod           = -1
 
-        # List tfrecords files and inspect their shapes.
+        # List tfrecords files and look up their shapes in the dataset manifest.
         assert os.path.isdir(self.tfrecord_dir)
-        tfr_files = sorted(glob.glob(os.path.join(self.tfrecord_dir, '*.tfrecords')))
+        self.manifest = load_tfrecord_manifest(self.tfrecord_dir, verify=verify_manifest)
+        tfr_files = [os.path.join(self.tfrecord_dir, entry['file']) for entry in self.manifest['files']]
         assert len(tfr_files) >= 1
-        tfr_shapes = []
-        for tfr_file in tfr_files:
-            tfr_opt = tf.python_io.TFRecordOptions(tf.python_io.TFRecordCompressionType.NONE)
-            for record in tf.python_io.tf_record_iterator(tfr_file, tfr_opt):
-                tfr_shapes.append(self.parse_tfrecord_np(record).shape)
-                break
+        tfr_shapes = [tuple(entry['shape']) for entry in self.manifest['files']]
+        self.num_images = min(entry['num_records'] for entry in self.manifest['files'])
+        if max_images is not None:
+            self.num_images = min(self.num_images, max_images)
+        assert 0 <= shard_index < num_shards
+        shard_blocks = get_shard_blocks(self.num_images, shard_index, num_shards)
+        shard_seed = get_shard_seed(shuffle_seed, shard_index, num_shards)
+        self.shard_size = int(np.sum(shard_blocks[:, 1] - shard_blocks[:, 0]))
 
         # Autodetect label filename.
         if self.label_file is None:
@@ -99,21 +120,27 @@ class TFRecordDataset:
             self._tf_minibatch_in = tf.placeholder(tf.int64, name='minibatch_in', shape=[])
             self._tf_labels_var = tflib.create_var_with_large_initial_value(self._np_labels, name='labels_var')
             self._tf_labels_dataset = tf.data.Dataset.from_tensor_slices(self._tf_labels_var)
-            for tfr_file, tfr_shape, tfr_lod in zip(tfr_files, tfr_shapes, tfr_lods):
+            for tfr_file, tfr_shape, tfr_lod, entry in zip(tfr_files, tfr_shapes, tfr_lods, self.manifest['files']):
                 if tfr_lod < 0:
                     continue
-                dset = tf.data.TFRecordDataset(tfr_file, compression_type='', buffer_size=buffer_mb<<20)
-                if max_images is not None:
-                    dset = dset.take(max_images)
-                dset = dset.map(self.parse_tfrecord_tf, num_parallel_calls=num_threads)
-                dset = tf.data.Dataset.zip((dset, self._tf_labels_dataset))
+                self._tfr_records[tfr_lod] = (tfr_file, get_record_offsets(entry))
+                block_reader = num_shards > 1 and 'record_bytes' in entry
+                if block_reader:
+                    dset = self._make_shard_dataset(tfr_file, entry, shard_blocks, shard_seed, shuffle_mb > 0, repeat, buffer_mb, num_threads)
+                else:
+                    dset = tf.data.TFRecordDataset(tfr_file, compression_type='', buffer_size=buffer_mb<<20)
+                    dset = dset.take(self.num_images)
+                    dset = dset.map(self.parse_tfrecord_tf, num_parallel_calls=num_threads)
+                    dset = tf.data.Dataset.zip((dset, self._tf_labels_dataset))
+                    if num_shards > 1:
+                        dset = dset.shard(num_shards, shard_index) # variable-size records => every shard scans the whole file
                 bytes_per_item = np.prod(tfr_shape) * np.dtype(self.dtype).itemsize
-                if shuffle_mb > 0:
-                    dset = dset.shuffle(((shuffle_mb << 20) - 1) // bytes_per_item + 1)
-                if repeat:
+                if shuffle_mb > 0: # the memory budgets are split between the shards
+                    dset = dset.shuffle(min(((shuffle_mb << 20) // num_shards - 1) // bytes_per_item + 1, self.shard_size), seed=shard_seed)
+                if repeat and not block_reader: # the block reader repeats its block list instead
                     dset = dset.repeat()
                 if prefetch_mb > 0:
-                    dset = dset.prefetch(((prefetch_mb << 20) - 1) // bytes_per_item + 1)
+                    dset = dset.prefetch(((prefetch_mb << 20) // num_shards - 1) // bytes_per_item + 1)
                 dset = dset.batch(self._tf_minibatch_in)
                 self._tf_datasets[tfr_lod] = dset
             self._tf_iterator = tf.data.Iterator.from_structure(self._tf_datasets[0].output_types, self._tf_datasets[0].output_shapes)
@@ -123,6 +150,26 @@ class TFRecordDataset:
     def close(self):
         pass
 
+    # Read this shard's blocks of fixed-size records straight from their byte ranges, interleaving several blocks at a time.
+    def _make_shard_dataset(self, tfr_file, entry, shard_blocks, shard_seed, shuffle, repeat, buffer_mb, num_threads):
+        record_bytes = entry['record_bytes']
+        file_bytes = entry['size']
+        def read_block(block):
+            records = tf.data.FixedLengthRecordDataset(tfr_file, record_bytes,
+                header_bytes=block[0] * record_bytes, footer_bytes=file_bytes - block[1] * record_bytes,
+                buffer_size=min(buffer_mb << 20, SHARD_BLOCK_RECORDS * record_bytes))
+            return tf.data.Dataset.zip((records, tf.data.Dataset.range(block[0], block[1])))
+        def parse_record(record, pos):
+            example = tf.substr(record, TFRECORD_HEADER_BYTES, record_bytes - TFRECORD_FRAMING_BYTES)
+            return self.parse_tfrecord_tf(example), tf.gather(self._tf_labels_var, pos)
+        dset = tf.data.Dataset.from_tensor_slices(shard_blocks)
+        if shuffle:
+            dset = dset.shuffle(len(shard_blocks), seed=shard_seed)
+        if repeat:
+            dset = dset.repeat()
+        dset = dset.interleave(read_block, cycle_length=min(SHARD_INTERLEAVE_BLOCKS, len(shard_blocks)), block_length=1)
+        return dset.map(parse_record, num_parallel_calls=num_threads)
+
     # Use the given minibatch size and level-of-detail for the data returned by get_minibatch_tf().
     def configure(self, minibatch_size, lod=0):
         lod = int(np.floor(lod))
@@ -144,6 +191,23 @@ class TFRecordDataset:
                 self._tf_minibatch_np = self.get_minibatch_tf()
             return tflib.run(self._tf_minibatch_np)
 
+    # Per-class record positions: dict(positions, offsets), see build_label_index().
+    def get_label_index(self):
+        if self._label_index is None:
+            self._label_index = get_dataset_label_index(self)
+        return self._label_index
+
+    # Get images and labels at the given record positions as NumPy arrays, read directly from the tfrecords files.
+    def get_records_np(self, positions, lod=0): # => images, labels
+        tfr_file, offsets = self._tfr_records[int(np.floor(lod))]
+        positions = np.asarray(positions, dtype=np.int64)
+        images = read_tfrecords_np(tfr_file, offsets, positions, self.parse_tfrecord_np)
+        return images, self._np_labels[positions]
+
+    # Get class-balanced minibatch as NumPy arrays: classes are drawn uniformly, then records uniformly within the class.
+    def get_balanced_minibatch_np(self, minibatch_size, lod=0): # => images, labels
+        return self.get_records_np(sample_balanced_positions(self.get_label_index(), minibatch_size), lod)
+
     # Get random labels as TensorFlow expression.
     def get_random_labels_tf(self, minibatch_size): # => labels
         with tf.name_scope('Dataset'):
@@ -176,16 +240,756 @@ class TFRecordDataset:
         data = ex.features.feature['data'].bytes_list.value[0] # pylint: disable=no-member
         return np.fromstring(data, np.uint8).reshape(shape)
 
+#----------------------------------------------------------------------------
+# Dataset manifest: per-LOD shapes, record counts and byte offsets of the
+# tfrecords files, plus label dtype/shape and a content hash. Written by
+# dataset_tool.TFRecordExporter.close() so that opening a dataset does not
+# need to probe every file; rebuilt once by a full scan if it is missing
+# or stale. Staleness is judged by file names and sizes; the content hash
+# is only checked on request (verify=True), as that reads every record.
+
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = '-manifest.json'
+TFRECORD_FRAMING_BYTES = 16 # uint64 length + uint32 length crc + uint32 data crc.
+TFRECORD_HEADER_BYTES = 12 # uint64 length + uint32 length crc, preceding the data.
+
+def save_index(index_file, index):
+    tmp_file = index_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_file, index_file)
+
+def make_manifest_file_entry(tfr_file, shape, record_sizes, sha1):
+    entry = dict(file=os.path.basename(tfr_file), size=os.path.getsize(tfr_file), shape=list(shape), num_records=len(record_sizes), sha1=sha1)
+    if len(set(record_sizes)) <= 1:
+        entry['record_bytes'] = record_sizes[0] if len(record_sizes) else 0
+    else:
+        entry['offsets'] = np.cumsum([0] + list(record_sizes[:-1])).tolist()
+    return entry
+
+def make_manifest_label_entry(label_file):
+    with open(label_file, 'rb') as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    labels = np.load(label_file, mmap_mode='r')
+    return dict(file=os.path.basename(label_file), size=os.path.getsize(label_file), shape=list(labels.shape), dtype=labels.dtype.name, sha1=sha1)
+
+def make_manifest(file_entries, label_entry):
+    content = hashlib.sha1()
+    for entry in sorted(file_entries, key=lambda entry: entry['file']) + ([label_entry] if label_entry is not None else []):
+        content.update(entry['sha1'].encode('ascii')) # by file name, so that exporter (LOD order) and rebuild (sorted) agree
+    return dict(version=MANIFEST_VERSION, files=file_entries, labels=label_entry, content_hash=content.hexdigest())
+
+def get_record_offsets(file_entry): # => byte offset of each record within the tfrecords file
+    if 'offsets' in file_entry:
+        return np.int64(file_entry['offsets'])
+    return np.arange(file_entry['num_records'], dtype=np.int64) * file_entry['record_bytes']
+
+def build_tfrecord_manifest(tfrecord_dir):
+    file_entries = []
+    tfr_opt = tf.python_io.TFRecordOptions(tf.python_io.TFRecordCompressionType.NONE)
+    for tfr_file in sorted(glob.glob(os.path.join(tfrecord_dir, '*.tfrecords'))):
+        shape = None
+        record_sizes = []
+        sha1 = hashlib.sha1()
+        for record in tf.python_io.tf_record_iterator(tfr_file, tfr_opt):
+            if shape is None:
+                shape = TFRecordDataset.parse_tfrecord_np(record).shape
+            record_sizes.append(len(record) + TFRECORD_FRAMING_BYTES)
+            sha1.update(record)
+        file_entries.append(make_manifest_file_entry(tfr_file, shape, record_sizes, sha1.hexdigest()))
+    label_files = sorted(glob.glob(os.path.join(tfrecord_dir, '*.labels')))
+    label_entry = make_manifest_label_entry(label_files[0]) if len(label_files) else None
+    return make_manifest(file_entries, label_entry)
+
+def _is_manifest_current(tfrecord_dir, manifest):
+    if manifest.get('version') != MANIFEST_VERSION:
+        return False
+    tfr_files = sorted(os.path.basename(f) for f in glob.glob(os.path.join(tfrecord_dir, '*.tfrecords')))
+    if tfr_files != sorted(entry['file'] for entry in manifest['files']): # The exporter lists files in LOD order.
+        return False
+    entries = manifest['files'] + ([manifest['labels']] if manifest['labels'] is not None else [])
+    for entry in entries:
+        path = os.path.join(tfrecord_dir, entry['file'])
+        if not os.path.isfile(path) or os.path.getsize(path) != entry['size']:
+            return False
+    return True
+
+def load_tfrecord_manifest(tfrecord_dir, verbose=False, verify=False):
+    manifest = None
+    guess = sorted(glob.glob(os.path.join(tfrecord_dir, '*' + MANIFEST_SUFFIX)))
+    if len(guess):
+        with open(guess[0], 'r') as f:
+            manifest = json.load(f)
+        if not _is_manifest_current(tfrecord_dir, manifest):
+            manifest = None
+        elif not verify:
+            return manifest
+
+    # Missing, stale or being verified => rebuild once and try to persist it for the next run.
+    if verbose:
+        print('%s dataset manifest for "%s"...' % ('Verifying' if manifest is not None else 'Building', tfrecord_dir))
+    rebuilt = build_tfrecord_manifest(tfrecord_dir)
+    if manifest is not None:
+        if manifest.get('content_hash') == rebuilt['content_hash']:
+            return manifest
+        print('Warning: dataset manifest of "%s" does not match the dataset content; rebuilding it.' % tfrecord_dir)
+    manifest = rebuilt
+    manifest_file = os.path.join(tfrecord_dir, os.path.basename(os.path.normpath(tfrecord_dir)) + MANIFEST_SUFFIX)
+    try:
+        save_index(manifest_file, manifest)
+    except OSError:
+        pass # read-only dataset directory
+    return manifest
+
+#----------------------------------------------------------------------------
+# Sharded reading: records are split into contiguous blocks that are dealt
+# round-robin to the shards, so that N workers read disjoint data spread
+# over the whole dataset. Each shard shuffles its blocks and records with
+# its own deterministic seed.
+
+SHARD_BLOCK_RECORDS = 256
+SHARD_INTERLEAVE_BLOCKS = 8
+
+def get_shard_blocks(num_records, shard_index, num_shards): # => int64 [num_blocks, 2] of [begin, end)
+    if num_shards > num_records:
+        raise ValueError('Cannot split %d records into %d non-empty shards' % (num_records, num_shards))
+    block_records = min(SHARD_BLOCK_RECORDS, num_records // num_shards) # small datasets => smaller blocks, so that every shard gets one
+    begins = np.arange(shard_index * block_records, num_records, num_shards * block_records, dtype=np.int64)
+    return np.stack([begins, np.minimum(begins + block_records, num_records)], axis=1).reshape(-1, 2)
+
+def get_shard_seed(shuffle_seed, shard_index, num_shards): # => None = unseeded (single shard)
+    if num_shards <= 1:
+        return None
+    return (shuffle_seed * num_shards + shard_index) % (1 << 31)
+
+def get_shard_positions(shard_blocks): # => int64 record positions of the shard
+    return np.concatenate([np.zeros([0], dtype=np.int64)] + [np.arange(begin, end, dtype=np.int64) for begin, end in shard_blocks])
+
+#----------------------------------------------------------------------------
+# Per-class label index: record positions grouped by class (argmax of the
+# label vector), stored CSR-style as positions sorted by class plus per-class
+# offsets. Persisted next to the labels file so that class-conditional
+# snapshot grids and balanced sampling never have to scan the dataset.
+
+LABEL_INDEX_SUFFIX = '-classes.npz'
+
+def build_label_index(labels): # => dict(positions, offsets)
+    labels = np.asarray(labels)
+    classes = np.argmax(labels, axis=1) if labels.shape[1] > 0 else np.zeros([labels.shape[0]], dtype=np.int64)
+    counts = np.bincount(classes, minlength=labels.shape[1])
+    positions = np.argsort(classes, kind='stable').astype(np.int64)
+    return dict(positions=positions, offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+
+def load_label_index(label_file, label_size): # => dict(positions, offsets)
+    index_file = os.path.splitext(label_file)[0] + LABEL_INDEX_SUFFIX
+    label_bytes = os.path.getsize(label_file)
+    if os.path.isfile(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(label_file):
+        with np.load(index_file) as data:
+            if int(data['label_bytes']) == label_bytes and int(data['label_size']) == label_size:
+                return dict(positions=data['positions'], offsets=data['offsets'])
+
+    # Missing or stale => rebuild and try to persist it for the next run.
+    index = build_label_index(np.load(label_file, mmap_mode='r')[:, :label_size])
+    try:
+        tmp_file = index_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, label_bytes=label_bytes, label_size=label_size, **index)
+        os.replace(tmp_file, index_file)
+    except OSError:
+        pass # read-only dataset directory
+    return index
+
+def restrict_label_index(index, num_images): # => index without positions >= num_images
+    keep = index['positions'] < num_images
+    if np.all(keep):
+        return index
+    classes = np.repeat(np.arange(len(index['offsets']) - 1), np.diff(index['offsets']))
+    counts = np.bincount(classes[keep], minlength=len(index['offsets']) - 1)
+    return dict(positions=index['positions'][keep], offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+
+def get_dataset_label_index(dset):
+    if dset.label_file is not None and dset.label_size > 0:
+        return restrict_label_index(load_label_index(dset.label_file, dset.label_size), dset.num_images)
+    return build_label_index(dset._np_labels[:dset.num_images]) # pylint: disable=protected-access
+
+def sample_balanced_positions(index, minibatch_size, rnd=np.random): # => record positions
+    counts = np.diff(index['offsets'])
+    classes = np.flatnonzero(counts)
+    cls = classes[rnd.randint(classes.size, size=[minibatch_size])]
+    within = (rnd.random_sample([minibatch_size]) * counts[cls]).astype(np.int64)
+    return index['positions'][index['offsets'][cls] + within]
+
+def read_tfrecords_np(tfr_file, offsets, positions, parse_func): # => images
+    images = [None] * len(positions)
+    with open(tfr_file, 'rb') as f:
+        for i in np.argsort(positions, kind='stable'): # sequential access pattern within the file
+            f.seek(offsets[positions[i]])
+            length, = struct.unpack('<Q', f.read(8))
+            f.seek(4, os.SEEK_CUR) # length crc
+            images[i] = parse_func(f.read(length))
+    return np.stack(images)
+
+#----------------------------------------------------------------------------
+# Index file describing the raw per-LOD shards written by
+# dataset_tool.MmapExporter.
+
+MMAP_FORMAT = 'mmap-uint8-v1'
+MMAP_INDEX_SUFFIX = '-mmap.json'
+
+def find_mmap_index(data_dir):
+    guess = sorted(glob.glob(os.path.join(data_dir, '*' + MMAP_INDEX_SUFFIX)))
+    return guess[0] if len(guess) else None
+
+def load_mmap_index(index_file):
+    with open(index_file, 'r') as f:
+        index = json.load(f)
+    if index.get('format') != MMAP_FORMAT:
+        raise ValueError('Unsupported dataset index format in "%s"' % index_file)
+    return index
+
+#----------------------------------------------------------------------------
+# Dataset class that slices minibatches directly out of memory-mapped raw
+# uint8 shards. Drop-in replacement for TFRecordDataset: no protobuf
+# parsing, and each minibatch is a single slice/gather of the memmap.
+
+class MmapDataset:
+    def __init__(self,
+        tfrecord_dir,               # Directory containing the raw shards and their index.
+        resolution      = None,     # Dataset resolution, None = autodetect.
+        label_file      = None,     # Relative path of the labels file, None = autodetect.
+        max_label_size  = 0,        # 0 = no labels, 'full' = full labels, <int> = N first label components.
+        max_images      = None,     # Maximum number of images to use, None = use all images.
+        repeat          = True,     # Repeat dataset indefinitely?
+        shuffle_mb      = 4096,     # Shuffle data, 0 = disable shuffling. The whole dataset is shuffled since reads are random access.
+        prefetch_mb     = 2048,     # Amount of data to prefetch (megabytes), 0 = disable prefetching.
+        buffer_mb       = 256,      # Unused, kept for compatibility with TFRecordDataset.
+        num_threads     = 2,        # Unused, kept for compatibility with TFRecordDataset.
+        shard_index     = 0,        # Shard to read when num_shards > 1.
+        num_shards      = 1,        # Split the records into this many disjoint shards, 1 = read everything.
+        shuffle_seed    = 0):       # Base seed of the deterministic per-shard shuffle, used when num_shards > 1.
+
+        self.tfrecord_dir       = tfrecord_dir
+        self.resolution         = None
+        self.resolution_log2    = None
+        self.shape              = []        # [channels, height, width]
+        self.dtype              = 'uint8'
+        self.dynamic_range      = [0, 255]
+        self.label_file         = label_file
+        self.label_size         = None      # components
+        self.label_dtype        = None
+        self.num_images         = 0
+        self.shard_index        = shard_index
+        self.num_shards         = num_shards
+        self.shard_size         = 0         # Records read by this shard.
+        self._repeat            = repeat
+        self._shuffle           = shuffle_mb > 0
+        self._np_data           = dict()    # lod => np.memmap [N, C, H, W]
+        self._np_labels         = None
+        self._label_index       = None
+        self._shard_positions   = None      # Record positions read by this shard.
+        self._shard_seed        = None
+        self._np_iterator       = None
+        self._np_iterator_key   = None
+        self._tf_minibatch_in   = None
+        self._tf_labels_var     = None
+        self._tf_datasets       = dict()
+        self._tf_iterator       = None
+        self._tf_init_ops       = dict()
+        self._cur_minibatch     = -1
+        self._cur_lod           = -1
+
+        # Load index and map the shards.
+        assert os.path.isdir(self.tfrecord_dir)
+        index_file = find_mmap_index(self.tfrecord_dir)
+        assert index_file is not None
+        index = load_mmap_index(index_file)
+        self.num_images = index['num_images']
+        if max_images is not None:
+            self.num_images = min(self.num_images, max_images)
+        assert 0 <= shard_index < num_shards
+        self._shard_positions = get_shard_positions(get_shard_blocks(self.num_images, shard_index, num_shards))
+        self._shard_seed = get_shard_seed(shuffle_seed, shard_index, num_shards)
+        self.shard_size = self._shard_positions.size
+        max_shape = max((lod_info['shape'] for lod_info in index['lods']), key=np.prod)
+        self.resolution = resolution if resolution is not None else max_shape[1]
+        self.resolution_log2 = int(np.log2(self.resolution))
+        self.shape = [max_shape[0], self.resolution, self.resolution]
+        for lod_info in index['lods']:
+            shape = lod_info['shape']
+            lod = self.resolution_log2 - int(np.log2(shape[1]))
+            assert shape[0] == max_shape[0] and shape[1] == shape[2]
+            if lod < 0:
+                continue
+            raw_file = os.path.join(self.tfrecord_dir, lod_info['file'])
+            self._np_data[lod] = np.memmap(raw_file, dtype=index['dtype'], mode='r', shape=tuple([index['num_images']] + shape))
+
+        # Autodetect label filename.
+        if self.label_file is None:
+            guess = sorted(glob.glob(os.path.join(self.tfrecord_dir, '*.labels')))
+            if len(guess):
+                self.label_file = guess[0]
+        elif not os.path.isfile(self.label_file):
+            guess = os.path.join(self.tfrecord_dir, self.label_file)
+            if os.path.isfile(guess):
+                self.label_file = guess
+
+        # Load labels.
+        assert max_label_size == 'full' or max_label_size >= 0
+        self._np_labels = np.zeros([self.num_images, 0], dtype=np.float32)
+        if self.label_file is not None and max_label_size != 0:
+            self._np_labels = np.load(self.label_file)
+            assert self._np_labels.ndim == 2
+        if max_label_size != 'full' and self._np_labels.shape[1] > max_label_size:
+            self._np_labels = self._np_labels[:, :max_label_size]
+        self._np_labels = self._np_labels[:self.num_images]
+        self.label_size = self._np_labels.shape[1]
+        self.label_dtype = self._np_labels.dtype.name
+
+        # Build TF expressions.
+        with tf.name_scope('Dataset'), tf.device('/cpu:0'):
+            self._tf_minibatch_in = tf.placeholder(tf.int64, name='minibatch_in', shape=[])
+            self._tf_labels_var = tflib.create_var_with_large_initial_value(self._np_labels, name='labels_var')
+            for lod, data in self._np_data.items():
+                dset = tf.data.Dataset.from_generator(self._iterate_minibatches,
+                    output_types=(tf.as_dtype(self.dtype), tf.as_dtype(self.label_dtype)),
+                    output_shapes=(tf.TensorShape([None] + list(data.shape[1:])), tf.TensorShape([None, self.label_size])),
+                    args=(self._tf_minibatch_in, lod))
+                if prefetch_mb > 0:
+                    dset = dset.prefetch(2)
+                self._tf_datasets[lod] = dset
+            self._tf_iterator = tf.data.Iterator.from_structure(self._tf_datasets[0].output_types, self._tf_datasets[0].output_shapes)
+            self._tf_init_ops = {lod: self._tf_iterator.make_initializer(dset) for lod, dset in self._tf_datasets.items()}
+
+    def close(self):
+        self._np_iterator = None
+        self._np_data = dict()
+
+    # Yield minibatch index arrays, continuing across epoch boundaries when repeating.
+    def _iterate_indices(self, minibatch_size):
+        rnd = np.random.RandomState(self._shard_seed)
+        pending = np.zeros([0], dtype=np.int64)
+        while True:
+            epoch = rnd.permutation(self._shard_positions) if self._shuffle else self._shard_positions
+            pending = np.concatenate([pending, epoch])
+            while pending.size >= minibatch_size:
+                yield pending[:minibatch_size]
+                pending = pending[minibatch_size:]
+            if not self._repeat:
+                if pending.size:
+                    yield pending
+                return
+
+    # Yield (images, labels) NumPy minibatches sliced from the memmap.
+    def _iterate_minibatches(self, minibatch_size, lod):
+        data = self._np_data[int(lod)]
+        for idx in self._iterate_indices(int(minibatch_size)):
+            begin = idx[0]
+            if idx[-1] == begin + idx.size - 1 and np.all(np.diff(idx) == 1):
+                yield data[begin : begin + idx.size], self._np_labels[begin : begin + idx.size]
+            else:
+                idx = np.sort(idx) # sequential access pattern within the shard
+                yield data[idx], self._np_labels[idx]
+
+    # Use the given minibatch size and level-of-detail for the data returned by get_minibatch_tf().
+    def configure(self, minibatch_size, lod=0):
+        lod = int(np.floor(lod))
+        assert minibatch_size >= 1 and lod in self._tf_datasets
+        if self._cur_minibatch != minibatch_size or self._cur_lod != lod:
+            self._tf_init_ops[lod].run({self._tf_minibatch_in: minibatch_size})
+            self._cur_minibatch = minibatch_size
+            self._cur_lod = lod
+
+    # Get next minibatch as TensorFlow expressions.
+    def get_minibatch_tf(self): # => images, labels
+        return self._tf_iterator.get_next()
+
+    # Get next minibatch as NumPy arrays. Served straight from the memmap, without a session call.
+    def get_minibatch_np(self, minibatch_size, lod=0): # => images, labels
+        lod = int(np.floor(lod))
+        assert minibatch_size >= 1 and lod in self._np_data
+        if self._np_iterator_key != (minibatch_size, lod):
+            self._np_iterator = self._iterate_minibatches(minibatch_size, lod)
+            self._np_iterator_key = (minibatch_size, lod)
+        try:
+            images, labels = next(self._np_iterator)
+        except StopIteration:
+            raise tf.errors.OutOfRangeError(None, None, 'End of dataset')
+        return np.array(images), np.array(labels)
+
+    # Per-class record positions: dict(positions, offsets), see build_label_index().
+    def get_label_index(self):
+        if self._label_index is None:
+            self._label_index = get_dataset_label_index(self)
+        return self._label_index
+
+    # Get images and labels at the given record positions as NumPy arrays.
+    def get_records_np(self, positions, lod=0): # => images, labels
+        positions = np.asarray(positions, dtype=np.int64)
+        return np.array(self._np_data[int(np.floor(lod))][positions]), np.array(self._np_labels[positions])
+
+    # Get class-balanced minibatch as NumPy arrays: classes are drawn uniformly, then records uniformly within the class.
+    def get_balanced_minibatch_np(self, minibatch_size, lod=0): # => images, labels
+        return self.get_records_np(sample_balanced_positions(self.get_label_index(), minibatch_size), lod)
+
+    # Get random labels as TensorFlow expression.
+    def get_random_labels_tf(self, minibatch_size): # => labels
+        with tf.name_scope('Dataset'):
+            if self.label_size > 0:
+                with tf.device('/cpu:0'):
+                    return tf.gather(self._tf_labels_var, tf.random_uniform([minibatch_size], 0, self._np_labels.shape[0], dtype=tf.int32))
+            return tf.zeros([minibatch_size, 0], self.label_dtype)
+
+    # Get random labels as NumPy array.
+    def get_random_labels_np(self, minibatch_size): # => labels
+        if self.label_size > 0:
+            return self._np_labels[np.random.randint(self._np_labels.shape[0], size=[minibatch_size])]
+        return np.zeros([minibatch_size, 0], self.label_dtype)
+
+#----------------------------------------------------------------------------
+# Dataset class that reads PNG/JPEG files straight from a directory, without
+# converting them with dataset_tool first. Images are decoded by a thread
+# pool, lower LODs are built on the fly with the same 2x2 box filter as
+# dataset_tool, and decoded uint8 arrays are kept in a bounded LRU cache.
+
+IMAGE_FOLDER_EXTENSIONS = ['.png', '.jpg', '.jpeg']
+
+class ImageFolderDataset:
+    def __init__(self,
+        tfrecord_dir,               # Directory containing the PNG/JPEG images.
+        resolution      = None,     # Dataset resolution, None = autodetect.
+        label_file      = None,     # Relative path of the labels file, None = autodetect.
+        max_label_size  = 0,        # 0 = no labels, 'full' = full labels, <int> = N first label components.
+        max_images      = None,     # Maximum number of images to use, None = use all images.
+        repeat          = True,     # Repeat dataset indefinitely?
+        shuffle_mb      = 4096,     # Shuffle data, 0 = disable shuffling. The whole dataset is shuffled since reads are random access.
+        prefetch_mb     = 2048,     # Amount of data to prefetch (megabytes), 0 = disable prefetching.
+        buffer_mb       = 256,      # Unused, kept for compatibility with TFRecordDataset.
+        num_threads     = 8,        # Number of decoder threads.
+        cache_mb        = 2048,     # Size of the decoded image cache (megabytes), 0 = disable caching.
+        shard_index     = 0,        # Shard to read when num_shards > 1.
+        num_shards      = 1,        # Split the records into this many disjoint shards, 1 = read everything.
+        shuffle_seed    = 0):       # Base seed of the deterministic per-shard shuffle, used when num_shards > 1.
+
+        self.tfrecord_dir       = tfrecord_dir
+        self.resolution         = None
+        self.resolution_log2    = None
+        self.shape              = []        # [channels, height, width]
+        self.dtype              = 'uint8'
+        self.dynamic_range      = [0, 255]
+        self.label_file         = label_file
+        self.label_size         = None      # components
+        self.label_dtype        = None
+        self.num_images         = 0
+        self.shard_index        = shard_index
+        self.num_shards         = num_shards
+        self.shard_size         = 0         # Records read by this shard.
+        self.image_files        = []
+        self._repeat            = repeat
+        self._shuffle           = shuffle_mb > 0
+        self._lods              = []
+        self._np_labels         = None
+        self._label_index       = None
+        self._shard_positions   = None      # Record positions read by this shard.
+        self._shard_seed        = None
+        self._np_iterator       = None
+        self._np_iterator_key   = None
+        self._pool              = None
+        self._cache             = collections.OrderedDict() # (idx, lod) => uint8 [C, H, W]
+        self._cache_bytes       = 0
+        self._cache_max_bytes   = cache_mb << 20
+        self._cache_lock        = threading.Lock()
+        self._tf_minibatch_in   = None
+        self._tf_labels_var     = None
+        self._tf_datasets       = dict()
+        self._tf_iterator       = None
+        self._tf_init_ops       = dict()
+        self._cur_minibatch     = -1
+        self._cur_lod           = -1
+
+        # List image files and determine shape from the first one.
+        assert os.path.isdir(self.tfrecord_dir)
+        self.image_files = find_image_files(self.tfrecord_dir)
+        assert len(self.image_files) >= 1
+        self.num_images = len(self.image_files)
+        if max_images is not None:
+            self.num_images = min(self.num_images, max_images)
+        self.image_files = self.image_files[:self.num_images]
+        img = np.asarray(PIL.Image.open(self.image_files[0]))
+        channels = img.shape[2] if img.ndim == 3 else 1
+        assert img.shape[0] == img.shape[1] and channels in [1, 3]
+        self.resolution = resolution if resolution is not None else img.shape[0]
+        self.resolution_log2 = int(np.log2(self.resolution))
+        self.shape = [channels, self.resolution, self.resolution]
+        assert self.resolution == 2 ** self.resolution_log2 and img.shape[0] % self.resolution == 0
+        self._base_lod = int(np.log2(img.shape[0])) - self.resolution_log2 # lod of the stored images relative to the dataset resolution
+        self._lods = list(range(self.resolution_log2 - 1))
+
+        assert 0 <= shard_index < num_shards
+        self._shard_positions = get_shard_positions(get_shard_blocks(self.num_images, shard_index, num_shards))
+        self._shard_seed = get_shard_seed(shuffle_seed, shard_index, num_shards)
+        self.shard_size = self._shard_positions.size
+
+        # Autodetect label filename.
+        if self.label_file is None:
+            guess = sorted(glob.glob(os.path.join(self.tfrecord_dir, '*.labels')))
+            if len(guess):
+                self.label_file = guess[0]
+        elif not os.path.isfile(self.label_file):
+            guess = os.path.join(self.tfrecord_dir, self.label_file)
+            if os.path.isfile(guess):
+                self.label_file = guess
+
+        # Load labels.
+        assert max_label_size == 'full' or max_label_size >= 0
+        self._np_labels = np.zeros([self.num_images, 0], dtype=np.float32)
+        if self.label_file is not None and max_label_size != 0:
+            self._np_labels = np.load(self.label_file)
+            assert self._np_labels.ndim == 2
+        if max_label_size != 'full' and self._np_labels.shape[1] > max_label_size:
+            self._np_labels = self._np_labels[:, :max_label_size]
+        self._np_labels = self._np_labels[:self.num_images]
+        self.label_size = self._np_labels.shape[1]
+        self.label_dtype = self._np_labels.dtype.name
+
+        # Build TF expressions.
+        self._pool = concurrent.futures.ThreadPoolExecutor(max(num_threads, 1))
+        with tf.name_scope('Dataset'), tf.device('/cpu:0'):
+            self._tf_minibatch_in = tf.placeholder(tf.int64, name='minibatch_in', shape=[])
+            self._tf_labels_var = tflib.create_var_with_large_initial_value(self._np_labels, name='labels_var')
+            for lod in self._lods:
+                res = self.resolution >> lod
+                dset = tf.data.Dataset.from_generator(self._iterate_minibatches,
+                    output_types=(tf.as_dtype(self.dtype), tf.as_dtype(self.label_dtype)),
+                    output_shapes=(tf.TensorShape([None, channels, res, res]), tf.TensorShape([None, self.label_size])),
+                    args=(self._tf_minibatch_in, lod))
+                if prefetch_mb > 0:
+                    dset = dset.prefetch(2)
+                self._tf_datasets[lod] = dset
+            self._tf_iterator = tf.data.Iterator.from_structure(self._tf_datasets[0].output_types, self._tf_datasets[0].output_shapes)
+            self._tf_init_ops = {lod: self._tf_iterator.make_initializer(dset) for lod, dset in self._tf_datasets.items()}
+
+    def close(self):
+        self._np_iterator = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+
+    # Decode one image at the given lod, going through the LRU cache.
+    def _load_image(self, idx, lod):
+        key = (int(idx), int(lod))
+        with self._cache_lock:
+            img = self._cache.get(key)
+            if img is not None:
+                self._cache.move_to_end(key)
+                return img
+        img = np.asarray(PIL.Image.open(self.image_files[key[0]]))
+        if self.shape[0] == 1:
+            img = img[np.newaxis, :, :] # HW => CHW
+        else:
+            if img.ndim == 2:
+                img = np.tile(img[:, :, np.newaxis], [1, 1, 3])
+            img = img[:, :, :3].transpose([2, 0, 1]) # HWC => CHW
+        img = downscale_image(img, self._base_lod + key[1])
+        assert list(img.shape) == [self.shape[0], self.resolution >> key[1], self.resolution >> key[1]]
+        if img.nbytes <= self._cache_max_bytes:
+            with self._cache_lock:
+                if key not in self._cache:
+                    self._cache[key] = img
+                    self._cache_bytes += img.nbytes
+                while self._cache_bytes > self._cache_max_bytes:
+                    _key, old = self._cache.popitem(last=False)
+                    self._cache_bytes -= old.nbytes
+        return img
+
+    # Decode the given records in parallel.
+    def _load_images(self, positions, lod):
+        return np.stack(list(self._pool.map(lambda idx: self._load_image(idx, lod), positions)))
+
+    # Yield minibatch index arrays, continuing across epoch boundaries when repeating.
+    def _iterate_indices(self, minibatch_size):
+        rnd = np.random.RandomState(self._shard_seed)
+        pending = np.zeros([0], dtype=np.int64)
+        while True:
+            epoch = rnd.permutation(self._shard_positions) if self._shuffle else self._shard_positions
+            pending = np.concatenate([pending, epoch])
+            while pending.size >= minibatch_size:
+                yield pending[:minibatch_size]
+                pending = pending[minibatch_size:]
+            if not self._repeat:
+                if pending.size:
+                    yield pending
+                return
+
+    # Yield (images, labels) NumPy minibatches decoded by the thread pool.
+    def _iterate_minibatches(self, minibatch_size, lod):
+        for idx in self._iterate_indices(int(minibatch_size)):
+            yield self._load_images(idx, int(lod)), self._np_labels[idx]
+
+    # Use the given minibatch size and level-of-detail for the data returned by get_minibatch_tf().
+    def configure(self, minibatch_size, lod=0):
+        lod = int(np.floor(lod))
+        assert minibatch_size >= 1 and lod in self._tf_datasets
+        if self._cur_minibatch != minibatch_size or self._cur_lod != lod:
+            self._tf_init_ops[lod].run({self._tf_minibatch_in: minibatch_size})
+            self._cur_minibatch = minibatch_size
+            self._cur_lod = lod
+
+    # Get next minibatch as TensorFlow expressions.
+    def get_minibatch_tf(self): # => images, labels
+        return self._tf_iterator.get_next()
+
+    # Get next minibatch as NumPy arrays. Decoded directly, without a session call.
+    def get_minibatch_np(self, minibatch_size, lod=0): # => images, labels
+        lod = int(np.floor(lod))
+        assert minibatch_size >= 1 and lod in self._lods
+        if self._np_iterator_key != (minibatch_size, lod):
+            self._np_iterator = self._iterate_minibatches(minibatch_size, lod)
+            self._np_iterator_key = (minibatch_size, lod)
+        try:
+            images, labels = next(self._np_iterator)
+        except StopIteration:
+            raise tf.errors.OutOfRangeError(None, None, 'End of dataset')
+        return images, np.array(labels)
+
+    # Per-class record positions: dict(positions, offsets), see build_label_index().
+    def get_label_index(self):
+        if self._label_index is None:
+            self._label_index = get_dataset_label_index(self)
+        return self._label_index
+
+    # Get images and labels at the given record positions as NumPy arrays.
+    def get_records_np(self, positions, lod=0): # => images, labels
+        positions = np.asarray(positions, dtype=np.int64)
+        return self._load_images(positions, int(np.floor(lod))), np.array(self._np_labels[positions])
+
+    # Get class-balanced minibatch as NumPy arrays: classes are drawn uniformly, then records uniformly within the class.
+    def get_balanced_minibatch_np(self, minibatch_size, lod=0): # => images, labels
+        return self.get_records_np(sample_balanced_positions(self.get_label_index(), minibatch_size), lod)
+
+    # Get random labels as TensorFlow expression.
+    def get_random_labels_tf(self, minibatch_size): # => labels
+        with tf.name_scope('Dataset'):
+            if self.label_size > 0:
+                with tf.device('/cpu:0'):
+                    return tf.gather(self._tf_labels_var, tf.random_uniform([minibatch_size], 0, self._np_labels.shape[0], dtype=tf.int32))
+            return tf.zeros([minibatch_size, 0], self.label_dtype)
+
+    # Get random labels as NumPy array.
+    def get_random_labels_np(self, minibatch_size): # => labels
+        if self.label_size > 0:
+            return self._np_labels[np.random.randint(self._np_labels.shape[0], size=[minibatch_size])]
+        return np.zeros([minibatch_size, 0], self.label_dtype)
+
+def find_image_files(image_dir):
+    return sorted(f for f in glob.glob(os.path.join(image_dir, '*')) if os.path.splitext(f)[1].lower() in IMAGE_FOLDER_EXTENSIONS)
+
+def downscale_image(img, lod): # => uint8 [C, H >> lod, W >> lod], same filter and rounding as dataset_tool
+    if lod == 0:
+        return img
+    for _i in range(lod):
+        img = img.astype(np.float32)
+        img = (img[:, 0::2, 0::2] + img[:, 0::2, 1::2] + img[:, 1::2, 0::2] + img[:, 1::2, 1::2]) * 0.25
+    return np.rint(img).clip(0, 255).astype(np.uint8)
+
+#----------------------------------------------------------------------------
+# Dataset class that generates random images of a given shape and dynamic
+# range on the device, for benchmarking training steps without any data files
+# or input pipeline. Use with dataset_args=dict(class_name=
+# 'training.dataset.SyntheticDataset', resolution=..., num_channels=...).
+
+class SyntheticDataset:
+    def __init__(self,
+        resolution      = 64,           # Image resolution.
+        num_channels    = 3,            # Number of image channels.
+        dtype           = 'uint8',      # Image dtype.
+        dynamic_range   = [0, 255],     # Range of the generated pixel values.
+        label_size      = 0,            # Number of label components; labels are all zero.
+        label_dtype     = 'float32',    # Label dtype.
+        num_images      = 1 << 20,      # Reported dataset size.
+        **_kwargs):                     # Ignored, accepts the TFRecordDataset options of existing configs.
+
+        self.resolution         = resolution
+        self.resolution_log2    = int(np.log2(resolution))
+        self.shape              = [num_channels, resolution, resolution]
+        self.dtype              = dtype
+        self.dynamic_range      = dynamic_range
+        self.label_size         = label_size
+        self.label_dtype        = label_dtype
+        self.num_images         = num_images
+        self.shard_index        = 0
+        self.num_shards         = 1
+        self.shard_size         = num_images
+        self._tf_minibatch_var  = None
+        self._tf_lod_var        = None
+        self._tf_minibatch_np   = None
+        self._cur_minibatch     = -1
+        self._cur_lod           = -1
+        assert self.resolution == 2 ** self.resolution_log2
+
+        with tf.name_scope('Dataset'), tf.control_dependencies(None):
+            self._tf_minibatch_var = tf.Variable(np.int32(0), name='minibatch_var', trainable=False)
+            self._tf_lod_var = tf.Variable(np.int32(0), name='lod_var', trainable=False)
+
+    def close(self):
+        pass
+
+    def configure(self, minibatch_size, lod=0):
+        lod = int(np.floor(lod))
+        assert minibatch_size >= 1 and 0 <= lod <= self.resolution_log2
+        if self._cur_minibatch != minibatch_size or self._cur_lod != lod:
+            tflib.set_vars({self._tf_minibatch_var: minibatch_size, self._tf_lod_var: lod})
+            self._cur_minibatch = minibatch_size
+            self._cur_lod = lod
+
+    # Get next minibatch as TensorFlow expressions.
+    def get_minibatch_tf(self): # => images, labels
+        with tf.name_scope('SyntheticDataset'):
+            shrink = tf.bitwise.left_shift(1, self._tf_lod_var)
+            shape = [self._tf_minibatch_var, self.shape[0], self.shape[1] // shrink, self.shape[2] // shrink]
+            if np.dtype(self.dtype).kind in 'iu':
+                images = tf.random_uniform(shape, self.dynamic_range[0], self.dynamic_range[1] + 1, dtype=tf.int32)
+            else:
+                images = tf.random_uniform(shape, self.dynamic_range[0], self.dynamic_range[1], dtype=tf.float32)
+            return tf.cast(images, self.dtype), tf.zeros([self._tf_minibatch_var, self.label_size], self.label_dtype)
+
+    # Get next minibatch as NumPy arrays.
+    def get_minibatch_np(self, minibatch_size, lod=0): # => images, labels
+        self.configure(minibatch_size, lod)
+        with tf.name_scope('Dataset'):
+            if self._tf_minibatch_np is None:
+                self._tf_minibatch_np = self.get_minibatch_tf()
+            return tflib.run(self._tf_minibatch_np)
+
+    # Get random labels as TensorFlow expression.
+    def get_random_labels_tf(self, minibatch_size): # => labels
+        with tf.name_scope('SyntheticDataset'):
+            return tf.zeros([minibatch_size, self.label_size], self.label_dtype)
+
+    # Get random labels as NumPy array.
+    def get_random_labels_np(self, minibatch_size): # => labels
+        return np.zeros([minibatch_size, self.label_size], self.label_dtype)
+
 #----------------------------------------------------------------------------
 # Helper func for constructing a dataset object using the given options.
 
-def load_dataset(class_name=None, data_dir=None, verbose=False, **kwargs):
+def load_dataset(class_name=None, data_dir=None, verbose=False, shard_index=0, num_shards=1, **kwargs):
     kwargs = dict(kwargs)
+    if num_shards != 1:
+        kwargs.update(shard_index=shard_index, num_shards=num_shards)
     if 'tfrecord_dir' in kwargs:
-        if class_name is None:
-            class_name = __name__ + '.TFRecordDataset'
         if data_dir is not None:
             kwargs['tfrecord_dir'] = os.path.join(data_dir, kwargs['tfrecord_dir'])
+        if class_name is None:
+            class_name = __name__ + '.TFRecordDataset'
+            tfrecord_dir = kwargs['tfrecord_dir']
+            if not glob.glob(os.path.join(tfrecord_dir, '*.tfrecords')):
+                if find_mmap_index(tfrecord_dir) is not None:
+                    class_name = __name__ + '.MmapDataset'
+                elif len(find_image_files(tfrecord_dir)):
+                    class_name = __name__ + '.ImageFolderDataset'
 
     assert class_name is not None
     if verbose:
@@ -195,6 +999,8 @@ def load_dataset(class_name=None, data_dir=None, verbose=False, **kwargs):
         print('Dataset shape =', np.int32(dataset.shape).tolist())
         print('Dynamic range =', dataset.dynamic_range)
         print('Label size    =', dataset.label_size)
+        if num_shards != 1:
+            print('Shard         = %d of %d (%d images)' % (shard_index, num_shards, dataset.shard_size))
     return dataset
 
 #----------------------------------------------------------------------------
@@ -6,30 +6,282 @@
 
 """Miscellaneous utility functions."""
 
+import json
 import os
 import pickle
+import queue
+import threading
+import time
 import numpy as np
+import tensorflow as tf
 import PIL.Image
 import PIL.ImageFont
 import dnnlib
+import dnnlib.tflib as tflib
 
 #----------------------------------------------------------------------------
 # Convenience wrappers for pickle that are able to load data produced by
-# older versions of the code, and from external URLs.
+# older versions of the code, from external URLs, and from split network
+# snapshots (see dnnlib.tflib.snapshot).
 
 def open_file_or_url(file_or_url):
     if dnnlib.util.is_url(file_or_url):
         return dnnlib.util.open_url(file_or_url, cache_dir='.stylegan2-cache')
     return open(file_or_url, 'rb')
 
-def load_pkl(file_or_url):
-    with open_file_or_url(file_or_url) as file:
-        return pickle.load(file, encoding='latin1')
+def load_pkl(file_or_url, only=None):
+    if not dnnlib.util.is_url(file_or_url) and tflib.snapshot.is_snapshot_file(file_or_url):
+        return tflib.snapshot.load_networks(file_or_url, only=only)
+    with open_file_or_url(file_or_url) as file, tflib.batch_set_vars():
+        obj = pickle.load(file, encoding='latin1')
+    return _select_networks(obj, only)
+
+def load_captured(snapshot, only=None):
+    """Like load_pkl(), but for the (obj, states) returned by SnapshotWriter.save(). The networks are
+    instantiated in the current default graph straight from the captured variable values."""
+    obj, states = snapshot
+    return tflib.snapshot.restore_networks(_select_networks(obj, only), states)
+
+def _select_networks(obj, only):
+    if only is None:
+        return obj
+    networks = list(obj) if isinstance(obj, (tuple, list)) else [obj]
+    entries = [dict(name=net.name, net=net) for net in networks]
+    selected = [entry['net'] for entry in tflib.snapshot.select_entries(entries, [only] if isinstance(only, (str, int)) else only)]
+    return selected[0] if isinstance(only, (str, int)) else tuple(selected)
 
 def save_pkl(obj, filename):
     with open(filename, 'wb') as file:
         pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
 
+#----------------------------------------------------------------------------
+# Background writer for network snapshots taken during training.
+
+class SnapshotWriter:
+    """Saves network pickles without stalling the training loop.
+
+    save() fetches the variables of all networks in a single session call and
+    returns; pickling, fsync and the atomic rename run on a background thread.
+    At most max_pending snapshots are queued before save() blocks. The time
+    spent in save() and the background write times are reported as the
+    Timing/snapshot_stall_sec and Timing/snapshot_write_sec autosummaries.
+
+    save() returns the captured snapshot, which metrics can load with
+    load_captured() instead of waiting for the file to be written."""
+
+    def __init__(self, max_pending=1):
+        self._queue = queue.Queue(max_pending)
+        self._lock = threading.Lock()
+        self._write_secs = []
+        self._error = None
+        self._num_saved = 0
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def save(self, obj, filename):
+        self._check_error()
+        time_begin = time.time()
+        states = tflib.snapshot.capture_states(obj)
+        self._queue.put((obj, states, filename))
+        stall_sec = time.time() - time_begin
+        if self._num_saved == 0:
+            self.wait() # autosummaries must exist before the first save_summaries() finalizes them
+        self._num_saved += 1
+        tflib.autosummary.autosummary('Timing/snapshot_stall_sec', stall_sec)
+        with self._lock:
+            write_secs, self._write_secs = self._write_secs, []
+        for write_sec in write_secs:
+            tflib.autosummary.autosummary('Timing/snapshot_write_sec', write_sec)
+        return obj, states
+
+    def wait(self):
+        """Block until all queued snapshots are on disk."""
+        self._queue.join()
+        self._check_error()
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _check_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            obj, states, filename = item
+            try:
+                time_begin = time.time()
+                tmp_filename = filename + '.tmp'
+                with open(tmp_filename, 'wb') as file:
+                    tflib.snapshot.NetworkPickler(file, states).dump(obj)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(tmp_filename, filename)
+                with self._lock:
+                    self._write_secs.append(time.time() - time_begin)
+            except Exception as e: # pylint: disable=broad-except
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+#----------------------------------------------------------------------------
+# Opt-in per-phase timing of training steps.
+
+class PhaseTimer:
+    """Times the session calls that make up a training step, e.g. data fetch, G, G_reg, D, D_reg, Gs_update.
+
+    run(feed_dict, **phase_ops) runs the ops of one or more phases. When disabled, all of them are fused
+    into a single session call, exactly like tflib.run(). When enabled, each phase runs in its own timed
+    session call. report() is called once per tick: it writes Timing/phase/<phase>_sec_per_kimg
+    autosummaries for all declared phases and appends a JSON line with per-call percentiles to jsonl_file."""
+
+    def __init__(self, phases, enabled=False, jsonl_file=None):
+        self.phases = list(phases)
+        self.enabled = enabled
+        self.jsonl_file = jsonl_file
+        self._durations = {phase: [] for phase in self.phases}
+
+    def run(self, feed_dict, **phase_ops):
+        if not self.enabled:
+            tflib.run(list(phase_ops.values()), feed_dict)
+            return
+        for phase, ops in phase_ops.items():
+            time_begin = time.time()
+            tflib.run(ops, feed_dict)
+            self._durations[phase].append(time.time() - time_begin)
+
+    def get_stats(self):
+        """Return per-call statistics of the phases that ran since the last call, and reset them."""
+        stats = dict()
+        for phase in self.phases:
+            durations = np.array(self._durations[phase]) * 1000.0
+            self._durations[phase] = []
+            if len(durations) > 0:
+                p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+                stats[phase] = dict(calls=len(durations), total_sec=float(durations.sum() / 1000.0), mean_ms=float(durations.mean()),
+                                    p50_ms=float(p50), p90_ms=float(p90), p99_ms=float(p99), max_ms=float(durations.max()))
+        return stats
+
+    def report(self, cur_tick, cur_kimg, tick_kimg):
+        if not self.enabled:
+            return
+        stats = self.get_stats()
+        for phase in self.phases:
+            total_sec = stats[phase]['total_sec'] if phase in stats else 0.0
+            tflib.autosummary.autosummary('Timing/phase/%s_sec_per_kimg' % phase, total_sec / max(tick_kimg, 1e-8))
+        if self.jsonl_file is not None:
+            with open(self.jsonl_file, 'a') as f:
+                f.write(json.dumps(dict(tick=cur_tick, kimg=cur_kimg, tick_kimg=tick_kimg, phases=stats)) + '\n')
+
+#----------------------------------------------------------------------------
+# Throughput benchmark of training steps.
+
+class StepBenchmark:
+    """Counts the minibatches of a training loop in benchmark mode and writes the report.
+
+    The first num_steps minibatches are warmup, the next num_steps are timed. Step time is the sum
+    of the session calls recorded by an enabled PhaseTimer, so tick maintenance is excluded. The loop
+    must not call phase_timer.report() meanwhile, as that resets the recorded durations.
+    step() returns True once the timed steps are done and the report has been written."""
+
+    def __init__(self, num_steps, phase_timer, report_file, **meta):
+        assert num_steps > 0 and phase_timer.enabled
+        self.num_steps = num_steps
+        self.phase_timer = phase_timer
+        self.report_file = report_file
+        self.meta = meta
+        self.done = False
+        self._cur_step = 0
+        self._num_images = 0
+        self._time_begin = None
+
+    def step(self, minibatch_size):
+        self._cur_step += 1
+        if self._cur_step == self.num_steps:
+            self.phase_timer.get_stats() # discard warmup
+            self._time_begin = time.time()
+        elif self._cur_step > self.num_steps:
+            self._num_images += minibatch_size
+        if self._cur_step == 2 * self.num_steps:
+            self._write_report(time.time() - self._time_begin)
+            self.done = True
+        return self.done
+
+    def _write_report(self, wall_sec):
+        import resource # pylint: disable=import-outside-toplevel
+        phases = self.phase_timer.get_stats()
+        step_sec = sum(stats['total_sec'] for stats in phases.values())
+        for stats in phases.values():
+            stats['sec_per_step'] = stats['total_sec'] / self.num_steps
+        report = dict(self.meta,
+            warmup_steps=self.num_steps,
+            timed_steps=self.num_steps,
+            num_images=self._num_images,
+            img_per_sec=self._num_images / step_sec,
+            sec_per_step=step_sec / self.num_steps,
+            wall_sec=wall_sec,
+            phases=phases,
+            peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            cuda_visible_devices=os.environ.get('CUDA_VISIBLE_DEVICES'))
+        print('Benchmark: %.1f img/s, %.4f sec/step, peak RSS %.0f MB' % (report['img_per_sec'], report['sec_per_step'], report['peak_rss_mb']))
+        for phase, stats in phases.items():
+            print('  %-16s%.4f sec/step' % (phase, stats['sec_per_step']))
+        with open(self.report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+
+#----------------------------------------------------------------------------
+# Cached session calls for training steps.
+
+class StepPlanner:
+    """Runs the session calls of a training step through callables cached per step configuration.
+
+    build_stages(*key) returns the stages of a step as a list of op lists. Each stage is fetched by one
+    session call and stages run in order, exactly like consecutive tflib.run() calls; merging them into a
+    single grouped op would let TensorFlow reorder the updates, since the gradient ops already exist and
+    cannot be given new control dependencies. The stages of each key are compiled once with
+    tf.Session.make_callable(), which skips the fetch and feed_dict processing of every tf.Session.run()."""
+
+    def __init__(self, build_stages, feed_list):
+        self.build_stages = build_stages
+        self.feed_list = list(feed_list)
+        self._plans = dict()
+
+    def _get_plan(self, key):
+        plan = self._plans.get(key)
+        if plan is None:
+            session = tf.get_default_session()
+            plan = [session.make_callable(stage, feed_list=self.feed_list) for stage in self.build_stages(*key)]
+            self._plans[key] = plan
+        return plan
+
+    def run(self, key, feed_dict):
+        feed_values = [feed_dict[expr] for expr in self.feed_list]
+        for stage_fn in self._get_plan(key):
+            stage_fn(*feed_values)
+
+    def benchmark(self, keys, feed_dict):
+        """Time one step per key with plain tflib.run() calls and with the cached callables; returns steps/s of both."""
+        results = dict(num_steps=len(keys))
+        def run_uncached(key):
+            for stage in self.build_stages(*key):
+                tflib.run(stage, feed_dict)
+        for mode, run_step in [('tflib_run', run_uncached), ('cached', lambda key: self.run(key, feed_dict))]:
+            for key in keys[:2]: # warm up
+                run_step(key)
+            time_begin = time.time()
+            for key in keys:
+                run_step(key)
+            results[mode + '_steps_per_sec'] = len(keys) / (time.time() - time_begin)
+        results['speedup'] = results['cached_steps_per_sec'] / results['tflib_run_steps_per_sec']
+        return results
+
 #----------------------------------------------------------------------------
 # Image utils.
 
@@ -122,23 +374,31 @@ def setup_snapshot_image_grid(training_set,
         bw, bh = class_layouts[layout]
         nw = (gw - 1) // bw + 1
         nh = (gh - 1) // bh + 1
+        label_index = training_set.get_label_index()
+        offsets = label_index['offsets']
+        num_classes = len(offsets) - 1
+        block_classes = np.arange(nw * nh) % num_classes # block i holds class i, overflowing to i + label_size, ...
         blocks = [[] for _i in range(nw * nh)]
-        for _iter in range(1000000):
-            real, label = training_set.get_minibatch_np(1)
-            idx = np.argmax(label[0])
-            while idx < len(blocks) and len(blocks[idx]) >= bw * bh:
-                idx += training_set.label_size
-            if idx < len(blocks):
-                blocks[idx].append((real, label))
-                if all(len(block) >= bw * bh for block in blocks):
-                    break
+        for cls in range(num_classes):
+            cls_blocks = np.flatnonzero(block_classes == cls)
+            cls_positions = label_index['positions'][offsets[cls] : offsets[cls + 1]]
+            num_needed = cls_blocks.size * bw * bh
+            if num_needed == 0 or cls_positions.size == 0:
+                continue
+            picks = np.random.choice(cls_positions, num_needed, replace=(cls_positions.size < num_needed))
+            for k, i in enumerate(cls_blocks):
+                blocks[i] = picks[k * bw * bh : (k + 1) * bw * bh]
+        grid_idx = []
+        grid_positions = []
         for i, block in enumerate(blocks):
-            for j, (real, label) in enumerate(block):
+            for j, pos in enumerate(block):
                 x = (i %  nw) * bw + j %  bw
                 y = (i // nw) * bh + j // bw
                 if x < gw and y < gh:
-                    reals[x + y * gw] = real[0]
-                    labels[x + y * gw] = label[0]
+                    grid_idx.append(x + y * gw)
+                    grid_positions.append(pos)
+        if len(grid_positions):
+            reals[grid_idx], labels[grid_idx] = training_set.get_records_np(grid_positions)
 
     return (gw, gh), reals, labels
 
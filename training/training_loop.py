@@ -127,6 +127,8 @@ def training_loop(
     drange_net              = [-1,1],   # Dynamic range used when feeding image data to the networks.
     image_snapshot_ticks    = 50,       # How often to save image snapshots? None = only save 'reals.png' and 'fakes-init.png'.
     network_snapshot_ticks  = 50,       # How often to save network snapshots? None = only save 'networks-final.pkl'.
+    phase_timing            = False,    # Time each phase of a training step separately? Splits fused session calls, see misc.PhaseTimer.
+    benchmark_steps         = 0,        # If > 0, time this many warmup and this many timed minibatches, write benchmark-steps.json and exit. No snapshots or metrics.
     save_tf_graph           = False,    # Include full TensorFlow computation graph in the tfevents file?
     save_weight_histograms  = False,    # Include weight histograms in the tfevents file?
     resume_pkl              = None,     # Network pickle to resume training from, None = train from scratch.
@@ -138,6 +140,12 @@ def training_loop(
 
     # Initialize dnnlib and TensorFlow.
     tflib.init_tf(tf_config)
+
+    # Benchmark mode: time training steps only, see misc.StepBenchmark.
+    if benchmark_steps > 0:
+        image_snapshot_ticks = network_snapshot_ticks = None
+        metric_arg_list = []
+        phase_timing = True
     num_gpus = dnnlib.submit_config.num_gpus
 
     # Load training set.
@@ -286,6 +294,9 @@ def training_loop(
     if save_weight_histograms:
         G.setup_weight_histograms(); D.setup_weight_histograms()
     metrics = metric_base.MetricGroup(metric_arg_list)
+    snapshot_writer = misc.SnapshotWriter()
+    phase_timer = misc.PhaseTimer(['G', 'data_fetch', 'G_reg', 'D', 'ema', 'D_reg'], enabled=phase_timing, jsonl_file=dnnlib.make_run_dir_path('timing-phases.jsonl'))
+    benchmark = misc.StepBenchmark(benchmark_steps, phase_timer, dnnlib.make_run_dir_path('benchmark-steps.json'), run_func_name=__name__) if benchmark_steps > 0 else None
 
     print('Training for %d kimg...\n' % total_kimg)
     dnnlib.RunContext.get().update('', cur_epoch=resume_kimg, max_epoch=total_kimg)
@@ -297,6 +308,7 @@ def training_loop(
     running_mb_counter = 0
     while cur_nimg < total_kimg * 1000:
         if dnnlib.RunContext.get().should_stop(): break
+        if benchmark is not None and benchmark.done: break
 
         # Choose training parameters and configure training ops.
         sched = training_schedule(cur_nimg=cur_nimg, training_set=training_set, **sched_args)
@@ -318,27 +330,29 @@ def training_loop(
 
             # Fast path without gradient accumulation.
             if len(rounds) == 1:
-                tflib.run([G_train_op, data_fetch_op], feed_dict)
+                phase_timer.run(feed_dict, G=G_train_op, data_fetch=data_fetch_op)
                 if run_G_reg:
-                    tflib.run(G_reg_op, feed_dict)
-                tflib.run([D_train_op, Gs_update_op], feed_dict)
+                    phase_timer.run(feed_dict, G_reg=G_reg_op)
+                phase_timer.run(feed_dict, D=D_train_op, ema=Gs_update_op)
                 if run_D_reg:
-                    tflib.run(D_reg_op, feed_dict)
+                    phase_timer.run(feed_dict, D_reg=D_reg_op)
 
             # Slow path with gradient accumulation.
             else:
                 for _round in rounds:
-                    tflib.run(G_train_op, feed_dict)
+                    phase_timer.run(feed_dict, G=G_train_op)
                 if run_G_reg:
                     for _round in rounds:
-                        tflib.run(G_reg_op, feed_dict)
-                tflib.run(Gs_update_op, feed_dict)
+                        phase_timer.run(feed_dict, G_reg=G_reg_op)
+                phase_timer.run(feed_dict, ema=Gs_update_op)
                 for _round in rounds:
-                    tflib.run(data_fetch_op, feed_dict)
-                    tflib.run(D_train_op, feed_dict)
+                    phase_timer.run(feed_dict, data_fetch=data_fetch_op)
+                    phase_timer.run(feed_dict, D=D_train_op)
                 if run_D_reg:
                     for _round in rounds:
-                        tflib.run(D_reg_op, feed_dict)
+                        phase_timer.run(feed_dict, D_reg=D_reg_op)
+            if benchmark is not None and benchmark.step(sched.minibatch_size):
+                break
 
         # Perform maintenance tasks once per tick.
         done = (cur_nimg >= total_kimg * 1000)
@@ -363,14 +377,18 @@ def training_loop(
             autosummary('Timing/total_hours', total_time / (60.0 * 60.0))
             autosummary('Timing/total_days', total_time / (24.0 * 60.0 * 60.0))
 
+            # Report per-phase timing. In benchmark mode the timings belong to StepBenchmark.
+            if benchmark is None:
+                phase_timer.report(cur_tick, cur_nimg / 1000.0, tick_kimg)
+
             # Save snapshots.
             if image_snapshot_ticks is not None and (cur_tick % image_snapshot_ticks == 0 or done):
                 grid_fakes = Gs.run(grid_latents, grid_labels, is_validation=True, minibatch_size=sched.minibatch_gpu)
                 misc.save_image_grid(grid_fakes, dnnlib.make_run_dir_path('fakes%06d.png' % (cur_nimg // 1000)), drange=drange_net, grid_size=grid_size)
             if network_snapshot_ticks is not None and (cur_tick % network_snapshot_ticks == 0 or done):
                 pkl = dnnlib.make_run_dir_path('network-snapshot-%06d.pkl' % (cur_nimg // 1000))
-                misc.save_pkl((G, D, Gs), pkl)
-                metrics.run(pkl, run_dir=dnnlib.make_run_dir_path(), data_dir=dnnlib.convert_path(data_dir), num_gpus=num_gpus, tf_config=tf_config)
+                snapshot = snapshot_writer.save((G, D, Gs), pkl)
+                metrics.run(pkl, snapshot=snapshot, run_dir=dnnlib.make_run_dir_path(), data_dir=dnnlib.convert_path(data_dir), num_gpus=num_gpus, tf_config=tf_config)
 
             # Update summaries and RunContext.
             metrics.update_autosummaries()
@@ -378,6 +396,12 @@ def training_loop(
             dnnlib.RunContext.get().update('%.2f' % sched.lod, cur_epoch=cur_nimg // 1000, max_epoch=total_kimg)
             maintenance_time = dnnlib.RunContext.get().get_last_update_interval() - tick_time
 
+    snapshot_writer.close()
+    if benchmark is not None:
+        summary_log.close()
+        training_set.close()
+        return
+
     # Save final snapshot.
     misc.save_pkl((G, D, Gs), dnnlib.make_run_dir_path('network-final.pkl'))
 
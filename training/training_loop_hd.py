@@ -224,6 +224,8 @@ def training_loop_hd(
     drange_net              = [-1,1],   # Dynamic range used when feeding image data to the networks.
     image_snapshot_ticks    = 50,       # How often to save image snapshots? None = only save 'reals.png' and 'fakes-init.png'.
     network_snapshot_ticks  = 50,       # How often to save network snapshots? None = only save 'networks-final.pkl'.
+    phase_timing            = False,    # Time each phase of a training step separately? Splits fused session calls, see misc.PhaseTimer.
+    benchmark_steps         = 0,        # If > 0, time this many warmup and this many timed minibatches, write benchmark-steps.json and exit. No snapshots or metrics.
     save_tf_graph           = False,    # Include full TensorFlow computation graph in the tfevents file?
     save_weight_histograms  = False,    # Include weight histograms in the tfevents file?
     resume_pkl              = None,     # Network pickle to resume training from, None = train from scratch.
@@ -245,6 +247,12 @@ def training_loop_hd(
 
     # Initialize dnnlib and TensorFlow.
     tflib.init_tf(tf_config)
+
+    # Benchmark mode: time training steps only, see misc.StepBenchmark.
+    if benchmark_steps > 0:
+        image_snapshot_ticks = network_snapshot_ticks = None
+        metric_arg_list = []
+        phase_timing = True
     num_gpus = dnnlib.submit_config.num_gpus
 
     # Load training set.
@@ -460,6 +468,9 @@ def training_loop_hd(
     if save_weight_histograms:
         I.setup_weight_histograms(); M.setup_weight_histograms()
     metrics = metric_base.MetricGroup(metric_arg_list)
+    snapshot_writer = misc.SnapshotWriter()
+    phase_timer = misc.PhaseTimer(['I', 'I_reg', 'ema'], enabled=phase_timing, jsonl_file=dnnlib.make_run_dir_path('timing-phases.jsonl'))
+    benchmark = misc.StepBenchmark(benchmark_steps, phase_timer, dnnlib.make_run_dir_path('benchmark-steps.json'), run_func_name=__name__) if benchmark_steps > 0 else None
 
     print('Training for %d kimg...\n' % total_kimg)
     dnnlib.RunContext.get().update('', cur_epoch=resume_kimg, max_epoch=total_kimg)
@@ -471,6 +482,7 @@ def training_loop_hd(
     running_mb_counter = 0
     while cur_nimg < total_kimg * 1000:
         if dnnlib.RunContext.get().should_stop(): break
+        if benchmark is not None and benchmark.done: break
 
         n_level = 0 if not use_level_training else min(cur_nimg // (level_I_kimg * 1000), training_set_resolution_log2 - 2)
         # Choose training parameters and configure training ops.
@@ -492,19 +504,21 @@ def training_loop_hd(
 
             # Fast path without gradient accumulation.
             if len(rounds) == 1:
-                tflib.run(I_train_ops[n_level], feed_dict)
+                phase_timer.run(feed_dict, I=I_train_ops[n_level])
                 if run_I_reg:
-                    tflib.run(I_reg_ops[n_level], feed_dict)
-                tflib.run([Is_update_op], feed_dict)
+                    phase_timer.run(feed_dict, I_reg=I_reg_ops[n_level])
+                phase_timer.run(feed_dict, ema=Is_update_op)
 
             # Slow path with gradient accumulation.
             else:
                 for _round in rounds:
-                    tflib.run(I_train_ops[n_level], feed_dict)
+                    phase_timer.run(feed_dict, I=I_train_ops[n_level])
                 if run_I_reg:
                     for _round in rounds:
-                        tflib.run(I_reg_ops[n_level], feed_dict)
-                tflib.run(Is_update_op, feed_dict)
+                        phase_timer.run(feed_dict, I_reg=I_reg_ops[n_level])
+                phase_timer.run(feed_dict, ema=Is_update_op)
+            if benchmark is not None and benchmark.step(sched.minibatch_size):
+                break
 
         # Perform maintenance tasks once per tick.
         done = (cur_nimg >= total_kimg * 1000)
@@ -529,6 +543,10 @@ def training_loop_hd(
             autosummary('Timing/total_hours', total_time / (60.0 * 60.0))
             autosummary('Timing/total_days', total_time / (24.0 * 60.0 * 60.0))
 
+            # Report per-phase timing. In benchmark mode the timings belong to StepBenchmark.
+            if benchmark is None:
+                phase_timer.report(cur_tick, cur_nimg / 1000.0, tick_kimg)
+
             # Save snapshots.
             if image_snapshot_ticks is not None and (cur_tick % image_snapshot_ticks == 0 or done):
 
@@ -578,8 +596,8 @@ def training_loop_hd(
 
             if network_snapshot_ticks is not None and (cur_tick % network_snapshot_ticks == 0 or done):
                 pkl = dnnlib.make_run_dir_path('network-snapshot-%06d.pkl' % (cur_nimg // 1000))
-                misc.save_pkl((I, M, Is), pkl)
-                metrics.run(pkl, run_dir=dnnlib.make_run_dir_path(), data_dir=dnnlib.convert_path(data_dir), num_gpus=num_gpus, tf_config=tf_config)
+                snapshot = snapshot_writer.save((I, M, Is), pkl)
+                metrics.run(pkl, snapshot=snapshot, run_dir=dnnlib.make_run_dir_path(), data_dir=dnnlib.convert_path(data_dir), num_gpus=num_gpus, tf_config=tf_config)
 
             # Update summaries and RunContext.
             metrics.update_autosummaries()
@@ -587,6 +605,12 @@ def training_loop_hd(
             dnnlib.RunContext.get().update('%.2f' % sched.lod, cur_epoch=cur_nimg // 1000, max_epoch=total_kimg)
             maintenance_time = dnnlib.RunContext.get().get_last_update_interval() - tick_time
 
+    snapshot_writer.close()
+    if benchmark is not None:
+        summary_log.close()
+        training_set.close()
+        return
+
     # Save final snapshot.
     misc.save_pkl((I, M, Is), dnnlib.make_run_dir_path('network-final.pkl'))
 
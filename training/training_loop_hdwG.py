@@ -122,6 +122,8 @@ def training_loop_hdwG(
     drange_net              = [-1,1],   # Dynamic range used when feeding image data to the networks.
     image_snapshot_ticks    = 50,       # How often to save image snapshots? None = only save 'reals.png' and 'fakes-init.png'.
     network_snapshot_ticks  = 50,       # How often to save network snapshots? None = only save 'networks-final.pkl'.
+    phase_timing            = False,    # Time each phase of a training step separately? Splits fused session calls, see misc.PhaseTimer.
+    benchmark_steps         = 0,        # If > 0, time this many warmup and this many timed minibatches, write benchmark-steps.json and exit. No snapshots or metrics.
     save_tf_graph           = False,    # Include full TensorFlow computation graph in the tfevents file?
     save_weight_histograms  = False,    # Include weight histograms in the tfevents file?
     resume_pkl              = None,     # Network pickle to resume training from, None = train from scratch.
@@ -144,6 +146,12 @@ def training_loop_hdwG(
 
     # Initialize dnnlib and TensorFlow.
     tflib.init_tf(tf_config)
+
+    # Benchmark mode: time training steps only, see misc.StepBenchmark.
+    if benchmark_steps > 0:
+        image_snapshot_ticks = network_snapshot_ticks = None
+        metric_arg_list = []
+        phase_timing = True
     num_gpus = dnnlib.submit_config.num_gpus
 
     # Load training set.
@@ -373,6 +381,9 @@ def training_loop_hdwG(
         G.setup_weight_histograms(); D.setup_weight_histograms()
         I.setup_weight_histograms(); M.setup_weight_histograms()
     metrics = metric_base.MetricGroup(metric_arg_list)
+    snapshot_writer = misc.SnapshotWriter()
+    phase_timer = misc.PhaseTimer(['I', 'data_fetch', 'I_reg', 'D', 'ema', 'D_reg'], enabled=phase_timing, jsonl_file=dnnlib.make_run_dir_path('timing-phases.jsonl'))
+    benchmark = misc.StepBenchmark(benchmark_steps, phase_timer, dnnlib.make_run_dir_path('benchmark-steps.json'), run_func_name=__name__) if benchmark_steps > 0 else None
 
     print('Training for %d kimg...\n' % total_kimg)
     dnnlib.RunContext.get().update('', cur_epoch=resume_kimg, max_epoch=total_kimg)
@@ -384,6 +395,7 @@ def training_loop_hdwG(
     running_mb_counter = 0
     while cur_nimg < total_kimg * 1000:
         if dnnlib.RunContext.get().should_stop(): break
+        if benchmark is not None and benchmark.done: break
 
         # Choose training parameters and configure training ops.
         sched = training_schedule(cur_nimg=cur_nimg, training_set=training_set, **sched_args)
@@ -405,27 +417,29 @@ def training_loop_hdwG(
 
             # Fast path without gradient accumulation.
             if len(rounds) == 1:
-                tflib.run([I_train_op, data_fetch_op], feed_dict)
+                phase_timer.run(feed_dict, I=I_train_op, data_fetch=data_fetch_op)
                 if run_I_reg:
-                    tflib.run(I_reg_op, feed_dict)
-                tflib.run([D_train_op, Gs_update_op], feed_dict)
+                    phase_timer.run(feed_dict, I_reg=I_reg_op)
+                phase_timer.run(feed_dict, D=D_train_op, ema=Gs_update_op)
                 if run_D_reg:
-                    tflib.run(D_reg_op, feed_dict)
+                    phase_timer.run(feed_dict, D_reg=D_reg_op)
 
             # Slow path with gradient accumulation.
             else:
                 for _round in rounds:
-                    tflib.run(I_train_op, feed_dict)
+                    phase_timer.run(feed_dict, I=I_train_op)
                 if run_I_reg:
                     for _round in rounds:
-                        tflib.run(I_reg_op, feed_dict)
-                tflib.run(Gs_update_op, feed_dict)
+                        phase_timer.run(feed_dict, I_reg=I_reg_op)
+                phase_timer.run(feed_dict, ema=Gs_update_op)
                 for _round in rounds:
-                    tflib.run(data_fetch_op, feed_dict)
-                    tflib.run(D_train_op, feed_dict)
+                    phase_timer.run(feed_dict, data_fetch=data_fetch_op)
+                    phase_timer.run(feed_dict, D=D_train_op)
                 if run_D_reg:
                     for _round in rounds:
-                        tflib.run(D_reg_op, feed_dict)
+                        phase_timer.run(feed_dict, D_reg=D_reg_op)
+            if benchmark is not None and benchmark.step(sched.minibatch_size):
+                break
 
         # Perform maintenance tasks once per tick.
         done = (cur_nimg >= total_kimg * 1000)
@@ -450,6 +464,10 @@ def training_loop_hdwG(
             autosummary('Timing/total_hours', total_time / (60.0 * 60.0))
             autosummary('Timing/total_days', total_time / (24.0 * 60.0 * 60.0))
 
+            # Report per-phase timing. In benchmark mode the timings belong to StepBenchmark.
+            if benchmark is None:
+                phase_timer.report(cur_tick, cur_nimg / 1000.0, tick_kimg)
+
             # Save snapshots.
             if image_snapshot_ticks is not None and (cur_tick % image_snapshot_ticks == 0 or done):
                 if not use_hyperplane:
@@ -506,10 +524,10 @@ def training_loop_hdwG(
             if network_snapshot_ticks is not None and (cur_tick % network_snapshot_ticks == 0 or done):
                 pkl = dnnlib.make_run_dir_path('network-snapshot-%06d.pkl' % (cur_nimg // 1000))
                 if use_hd_with_cls:
-                    misc.save_pkl((G, D, Gs, I, M, Is, I_info), pkl)
+                    snapshot = snapshot_writer.save((G, D, Gs, I, M, Is, I_info), pkl)
                 else:
-                    misc.save_pkl((G, D, Gs, I, M, Is), pkl)
-                metrics.run(pkl, run_dir=dnnlib.make_run_dir_path(), data_dir=dnnlib.convert_path(data_dir), num_gpus=num_gpus, tf_config=tf_config)
+                    snapshot = snapshot_writer.save((G, D, Gs, I, M, Is), pkl)
+                metrics.run(pkl, snapshot=snapshot, run_dir=dnnlib.make_run_dir_path(), data_dir=dnnlib.convert_path(data_dir), num_gpus=num_gpus, tf_config=tf_config)
 
             # Update summaries and RunContext.
             metrics.update_autosummaries()
@@ -517,6 +535,12 @@ def training_loop_hdwG(
             dnnlib.RunContext.get().update('%.2f' % sched.lod, cur_epoch=cur_nimg // 1000, max_epoch=total_kimg)
             maintenance_time = dnnlib.RunContext.get().get_last_update_interval() - tick_time
 
+    snapshot_writer.close()
+    if benchmark is not None:
+        summary_log.close()
+        training_set.close()
+        return
+
     # Save final snapshot.
     if use_hd_with_cls:
         misc.save_pkl((G, D, Gs, I, M, Is, I_info), dnnlib.make_run_dir_path('network-final.pkl'))
@@ -59,6 +59,8 @@ def training_loop_infernet(
         ],  # Dynamic range used when feeding image data to the networks.
         image_snapshot_ticks=50,  # How often to save image snapshots? None = only save 'reals.png' and 'fakes-init.png'.
         network_snapshot_ticks=5,  # How often to save network snapshots? None = only save 'networks-final.pkl'.
+        phase_timing=False,  # Time each phase of a training step separately? Splits fused session calls, see misc.PhaseTimer.
+        benchmark_steps=0,  # If > 0, time this many warmup and this many timed minibatches, write benchmark-steps.json and exit. No snapshots or metrics.
         save_tf_graph=False,  # Include full TensorFlow computation graph in the tfevents file?
         save_weight_histograms=False,  # Include weight histograms in the tfevents file?
         G_pkl=None,  # The G to load.
@@ -70,6 +72,12 @@ def training_loop_infernet(
 
     # Initialize dnnlib and TensorFlow.
     tflib.init_tf(tf_config)
+
+    # Benchmark mode: time training steps only, see misc.StepBenchmark.
+    if benchmark_steps > 0:
+        image_snapshot_ticks = network_snapshot_ticks = None
+        metric_arg_list = []
+        phase_timing = True
     num_gpus = dnnlib.submit_config.num_gpus
 
     # Construct or load networks.
@@ -154,6 +162,9 @@ def training_loop_infernet(
     if save_weight_histograms:
         I.setup_weight_histograms()
     metrics = metric_base.MetricGroup(metric_arg_list)
+    snapshot_writer = misc.SnapshotWriter()
+    phase_timer = misc.PhaseTimer(['I'], enabled=phase_timing, jsonl_file=dnnlib.make_run_dir_path('timing-phases.jsonl'))
+    benchmark = misc.StepBenchmark(benchmark_steps, phase_timer, dnnlib.make_run_dir_path('benchmark-steps.json'), run_func_name=__name__) if benchmark_steps > 0 else None
 
     print('Training for %d kimg...\n' % total_kimg)
     dnnlib.RunContext.get().update('',
@@ -167,6 +178,7 @@ def training_loop_infernet(
     running_mb_counter = 0
     while cur_nimg < total_kimg * 1000:
         if dnnlib.RunContext.get().should_stop(): break
+        if benchmark is not None and benchmark.done: break
 
         # Choose training parameters and configure training ops.
         assert sched_args.minibatch_size % (sched_args.minibatch_gpu * num_gpus) == 0
@@ -185,11 +197,13 @@ def training_loop_infernet(
 
             # Fast path without gradient accumulation.
             if len(rounds) == 1:
-                tflib.run([I_train_op], feed_dict)
+                phase_timer.run(feed_dict, I=I_train_op)
             # Slow path with gradient accumulation.
             else:
                 for _round in rounds:
-                    tflib.run(I_train_op, feed_dict)
+                    phase_timer.run(feed_dict, I=I_train_op)
+            if benchmark is not None and benchmark.step(sched_args.minibatch_size):
+                break
 
         # Perform maintenance tasks once per tick.
         done = (cur_nimg >= total_kimg * 1000)
@@ -217,11 +231,15 @@ def training_loop_infernet(
             autosummary('Timing/total_hours', total_time / (60.0 * 60.0))
             autosummary('Timing/total_days', total_time / (24.0 * 60.0 * 60.0))
 
+            # Report per-phase timing. In benchmark mode the timings belong to StepBenchmark.
+            if benchmark is None:
+                phase_timer.report(cur_tick, cur_nimg / 1000.0, tick_kimg)
+
             # Save snapshots.
             if network_snapshot_ticks is not None and (cur_tick % network_snapshot_ticks == 0 or done):
                 pkl = dnnlib.make_run_dir_path('network-snapshot-%06d.pkl' % (cur_nimg // 1000))
-                misc.save_pkl((I, G), pkl)
-                metrics.run(pkl, run_dir=dnnlib.make_run_dir_path(), 
+                snapshot = snapshot_writer.save((I, G), pkl)
+                metrics.run(pkl, snapshot=snapshot, run_dir=dnnlib.make_run_dir_path(), 
                             num_gpus=num_gpus, tf_config=tf_config, train_infernet=True)
 
             # Update summaries and RunContext.
@@ -232,6 +250,11 @@ def training_loop_infernet(
             maintenance_time = dnnlib.RunContext.get(
             ).get_last_update_interval() - tick_time
 
+    snapshot_writer.close()
+    if benchmark is not None:
+        summary_log.close()
+        return
+
     # Save final snapshot.
     misc.save_pkl((I, G), dnnlib.make_run_dir_path('network-final.pkl'))
 
@@ -19,6 +19,7 @@ Code borrowed from training_loop.py of NVIDIA.
 import numpy as np
 import pdb
 import collections
+import json
 import tensorflow as tf
 import dnnlib
 import dnnlib.tflib as tflib
@@ -27,6 +28,7 @@ from dnnlib.tflib.autosummary import autosummary
 from training import dataset
 from training import misc
 from metrics import metric_base
+from metrics import metric_queue
 from training.training_loop import process_reals, training_schedule
 from training.utils import save_atts, add_outline, get_grid_latents, get_return_v
 
@@ -55,6 +57,8 @@ def training_loop_vc2(
         use_perdis=False,  # Whether use perceptual distance network.
         data_dir=None,  # Directory to load datasets from.
         G_smoothing_kimg=10.0,  # Half-life of the running average of generator weights.
+        G_smoothing_stride=1,  # Update the running averages (Gs, Is) every this many minibatches, with decay beta**stride.
+        fused_ema=False,  # Interpolate all running-average variables with a single lerp per dtype?
         minibatch_repeats=4,  # Number of minibatches to run before adjusting training parameters.
         lazy_regularization=True,  # Perform regularization as a separate training step?
         G_reg_interval=4,  # How often the perform regularization for G? Ignored if lazy_regularization=False.
@@ -68,6 +72,11 @@ def training_loop_vc2(
         ],  # Dynamic range used when feeding image data to the networks.
         image_snapshot_ticks=50,  # How often to save image snapshots? None = only save 'reals.png' and 'fakes-init.png'.
         network_snapshot_ticks=50,  # How often to save network snapshots? None = only save 'networks-final.pkl'.
+        phase_timing=False,  # Time each phase of a training step separately? Splits fused session calls, see misc.PhaseTimer.
+        benchmark_steps=0,  # If > 0, time this many warmup and this many timed minibatches, write benchmark-steps.json and exit. No snapshots or metrics.
+        async_metrics=False,  # Evaluate metrics in separate run_metric_worker.py processes fed from <run_dir>/metric-queue?
+        cached_steps=True,  # Run the fast path through session callables cached per step configuration, see misc.StepPlanner?
+        benchmark_cached_steps=0,  # If > 0, time this many fast-path minibatches with and without cached_steps and exit.
         save_tf_graph=False,  # Include full TensorFlow computation graph in the tfevents file?
         save_weight_histograms=False,  # Include weight histograms in the tfevents file?
         resume_pkl=None,  # Network pickle to resume training from, None = train from scratch.
@@ -87,6 +96,12 @@ def training_loop_vc2(
 
     # Initialize dnnlib and TensorFlow.
     tflib.init_tf(tf_config)
+
+    # Benchmark mode: time training steps only, see misc.StepBenchmark.
+    if benchmark_steps > 0:
+        image_snapshot_ticks = network_snapshot_ticks = None
+        metric_arg_list = []
+        phase_timing = True
     num_gpus = dnnlib.submit_config.num_gpus
 
     # If include I
@@ -391,9 +406,10 @@ def training_loop_vc2(
     D_train_op = D_opt.apply_updates()
     G_reg_op = G_reg_opt.apply_updates(allow_no_op=True)
     D_reg_op = D_reg_opt.apply_updates(allow_no_op=True)
-    Gs_update_op = Gs.setup_as_moving_average_of(G, beta=Gs_beta)
+    Gs_update_op = Gs.setup_as_moving_average_of(G, beta=Gs_beta, stride=G_smoothing_stride, fused=fused_ema)
     if avg_mv_for_I:
-        Is_update_op = Is.setup_as_moving_average_of(I, beta=Gs_beta)
+        Is_update_op = Is.setup_as_moving_average_of(I, beta=Gs_beta, stride=G_smoothing_stride, fused=fused_ema)
+    ema_update_ops = [Gs_update_op, Is_update_op] if avg_mv_for_I else [Gs_update_op]
     if use_vc2_info_gan:
         G2_train_op = G2_opt.apply_updates()
 
@@ -415,6 +431,41 @@ def training_loop_vc2(
         if include_I:
             I.setup_weight_histograms()
     metrics = metric_base.MetricGroup(metric_arg_list)
+    snapshot_writer = misc.SnapshotWriter()
+    metric_jobs = metric_queue.MetricQueue(dnnlib.make_run_dir_path('metric-queue'), metric_arg_list) if async_metrics and len(metrics.metrics) > 0 else None
+    phase_timer = misc.PhaseTimer(['G', 'data_fetch', 'G_reg', 'D', 'ema', 'D_reg', 'G2'], enabled=phase_timing, jsonl_file=dnnlib.make_run_dir_path('timing-phases.jsonl'))
+    benchmark = misc.StepBenchmark(benchmark_steps, phase_timer, dnnlib.make_run_dir_path('benchmark-steps.json'), run_func_name=__name__) if benchmark_steps > 0 else None
+
+    # Session calls of a fast-path minibatch, in order, for each (run_G_reg, run_D_reg, run_ema, use_vc2_info_gan, avg_mv_for_I).
+    def build_fast_path_stages(run_G_reg, run_D_reg, run_ema, use_vc2_info_gan, avg_mv_for_I):
+        stages = [[G_train_op, data_fetch_op]]
+        if run_G_reg:
+            stages.append([G_reg_op])
+        stages.append([D_train_op] + ema_update_ops if run_ema else [D_train_op])
+        if run_D_reg:
+            stages.append([D_reg_op])
+        if use_vc2_info_gan:
+            stages.append([G2_train_op])
+        return stages
+    step_planner = misc.StepPlanner(build_fast_path_stages, [lod_in, lrate_in, minibatch_size_in, minibatch_gpu_in, cascade_dim])
+
+    if benchmark_cached_steps > 0:
+        sched = training_schedule(cur_nimg=int(resume_kimg * 1000), training_set=training_set, **sched_args)
+        assert sched.minibatch_size == sched.minibatch_gpu * num_gpus, 'benchmark_cached_steps requires the fast path without gradient accumulation'
+        training_set.configure(sched.minibatch_gpu, sched.lod)
+        feed_dict = {lod_in: sched.lod, lrate_in: sched.G_lrate, minibatch_size_in: sched.minibatch_size, minibatch_gpu_in: sched.minibatch_gpu, cascade_dim: 0}
+        keys = [(lazy_regularization and mb % G_reg_interval == 0, lazy_regularization and mb % D_reg_interval == 0, mb % G_smoothing_stride == 0,
+                 use_vc2_info_gan, avg_mv_for_I)
+                for mb in range(benchmark_cached_steps)]
+        results = step_planner.benchmark(keys, feed_dict)
+        print('tflib.run: %.2f steps/s, cached: %.2f steps/s, speedup %.3fx' % (
+            results['tflib_run_steps_per_sec'], results['cached_steps_per_sec'], results['speedup']))
+        with open(dnnlib.make_run_dir_path('benchmark-cached-steps.json'), 'w') as f:
+            json.dump(dict(results, resolution=training_set.shape[1], minibatch_size=sched.minibatch_size), f, indent=2)
+        snapshot_writer.close()
+        summary_log.close()
+        training_set.close()
+        return
 
     print('Training for %d kimg...\n' % total_kimg)
     dnnlib.RunContext.get().update('',
@@ -428,6 +479,7 @@ def training_loop_vc2(
     running_mb_counter = 0
     while cur_nimg < total_kimg * 1000:
         if dnnlib.RunContext.get().should_stop(): break
+        if benchmark is not None and benchmark.done: break
 
         # Choose training parameters and configure training ops.
         sched = training_schedule(cur_nimg=cur_nimg,
@@ -465,43 +517,46 @@ def training_loop_vc2(
                          and running_mb_counter % G_reg_interval == 0)
             run_D_reg = (lazy_regularization
                          and running_mb_counter % D_reg_interval == 0)
+            run_ema = (running_mb_counter % G_smoothing_stride == 0)
             cur_nimg += sched.minibatch_size
             running_mb_counter += 1
 
             # Fast path without gradient accumulation.
-            if len(rounds) == 1:
-                tflib.run([G_train_op, data_fetch_op], feed_dict)
+            if len(rounds) == 1 and cached_steps and not phase_timing:
+                step_planner.run((run_G_reg, run_D_reg, run_ema, use_vc2_info_gan, avg_mv_for_I), feed_dict)
+            elif len(rounds) == 1:
+                phase_timer.run(feed_dict, G=G_train_op, data_fetch=data_fetch_op)
                 if run_G_reg:
-                    tflib.run(G_reg_op, feed_dict)
-                if avg_mv_for_I:
-                    tflib.run([D_train_op, Gs_update_op, Is_update_op], feed_dict)
+                    phase_timer.run(feed_dict, G_reg=G_reg_op)
+                if run_ema:
+                    phase_timer.run(feed_dict, D=D_train_op, ema=ema_update_ops)
                 else:
-                    tflib.run([D_train_op, Gs_update_op], feed_dict)
+                    phase_timer.run(feed_dict, D=D_train_op)
                 if run_D_reg:
-                    tflib.run(D_reg_op, feed_dict)
+                    phase_timer.run(feed_dict, D_reg=D_reg_op)
                 if use_vc2_info_gan:
-                    tflib.run(G2_train_op, feed_dict)
+                    phase_timer.run(feed_dict, G2=G2_train_op)
 
             # Slow path with gradient accumulation.
             else:
                 for _round in rounds:
-                    tflib.run(G_train_op, feed_dict)
+                    phase_timer.run(feed_dict, G=G_train_op)
                 if run_G_reg:
                     for _round in rounds:
-                        tflib.run(G_reg_op, feed_dict)
-                if avg_mv_for_I:
-                    tflib.run([Gs_update_op, Is_update_op], feed_dict)
-                else:
-                    tflib.run(Gs_update_op, feed_dict)
+                        phase_timer.run(feed_dict, G_reg=G_reg_op)
+                if run_ema:
+                    phase_timer.run(feed_dict, ema=ema_update_ops)
                 for _round in rounds:
-                    tflib.run(data_fetch_op, feed_dict)
-                    tflib.run(D_train_op, feed_dict)
+                    phase_timer.run(feed_dict, data_fetch=data_fetch_op)
+                    phase_timer.run(feed_dict, D=D_train_op)
                 if run_D_reg:
                     for _round in rounds:
-                        tflib.run(D_reg_op, feed_dict)
+                        phase_timer.run(feed_dict, D_reg=D_reg_op)
                 if use_vc2_info_gan:
                     for _round in rounds:
-                        tflib.run(G2_train_op, feed_dict)
+                        phase_timer.run(feed_dict, G2=G2_train_op)
+            if benchmark is not None and benchmark.step(sched.minibatch_size):
+                break
 
         # Perform maintenance tasks once per tick.
         done = (cur_nimg >= total_kimg * 1000)
@@ -530,6 +585,10 @@ def training_loop_vc2(
             autosummary('Timing/total_hours', total_time / (60.0 * 60.0))
             autosummary('Timing/total_days', total_time / (24.0 * 60.0 * 60.0))
 
+            # Report per-phase timing. In benchmark mode the timings belong to StepBenchmark.
+            if benchmark is None:
+                phase_timer.report(cur_tick, cur_nimg / 1000.0, tick_kimg)
+
             # Save snapshots.
             if network_snapshot_ticks is not None and (
                     cur_tick % network_snapshot_ticks == 0 or done):
@@ -537,20 +596,26 @@ def training_loop_vc2(
                                                (cur_nimg // 1000))
                 if include_I:
                     if avg_mv_for_I:
-                        misc.save_pkl((G, D, I, Gs, Is), pkl)
+                        snapshot = snapshot_writer.save((G, D, I, Gs, Is), pkl)
                     else:
-                        misc.save_pkl((G, D, I, Gs), pkl)
+                        snapshot = snapshot_writer.save((G, D, I, Gs), pkl)
                 else:
-                    misc.save_pkl((G, D, Gs), pkl)
-                met_outs = metrics.run(pkl,
-                                       run_dir=dnnlib.make_run_dir_path(),
-                                       data_dir=dnnlib.convert_path(data_dir),
-                                       num_gpus=num_gpus,
-                                       tf_config=tf_config,
-                                       include_I=include_I,
-                                       avg_mv_for_I=avg_mv_for_I,
-                                       Gs_kwargs=dict(is_validation=True, return_atts=False),
-                                       mapping_nodup=True)
+                    snapshot = snapshot_writer.save((G, D, Gs), pkl)
+                metric_kwargs = dict(data_dir=dnnlib.convert_path(data_dir),
+                                     num_gpus=num_gpus,
+                                     tf_config=tf_config,
+                                     include_I=include_I,
+                                     avg_mv_for_I=avg_mv_for_I,
+                                     Gs_kwargs=dict(is_validation=True, return_atts=False),
+                                     mapping_nodup=True)
+                if metric_jobs is not None:
+                    # Use the most recent completed results; only wait if topk_dims needs them and none exist yet.
+                    job_name = metric_jobs.submit(pkl, cur_nimg, **metric_kwargs)
+                    if topk_dims_to_show > 0 and metric_jobs.num_completed() == 0:
+                        metric_jobs.wait(job_name)
+                    met_outs = metric_jobs.latest_outs() or {}
+                else:
+                    met_outs = metrics.run(pkl, snapshot=snapshot, run_dir=dnnlib.make_run_dir_path(), **metric_kwargs)
                 if topk_dims_to_show > 0:
                     if 'tpl_per_dim' in met_outs:
                         avg_distance_per_dim = met_outs['tpl_per_dim'] # shape: (n_continuous)
@@ -625,6 +690,14 @@ def training_loop_vc2(
             maintenance_time = dnnlib.RunContext.get(
             ).get_last_update_interval() - tick_time
 
+    snapshot_writer.close()
+    if metric_jobs is not None:
+        metric_jobs.close()
+    if benchmark is not None:
+        summary_log.close()
+        training_set.close()
+        return
+
     # Save final snapshot.
     if include_I:
         if avg_mv_for_I: